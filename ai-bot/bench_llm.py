@@ -0,0 +1,45 @@
+"""
+Замер пропускной способности LLMClient.
+
+Пример (с локальной заглушкой stub_openai.py):
+    OPENAI_BASE_URL=http://localhost:9000/v1 python bench_llm.py -n 500 -c 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from llm_client import LLMClient, LLMError
+
+
+async def run(total, concurrency):
+    client = LLMClient(api_key='bench', max_concurrency=concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            await client.chat([{'role': 'user', 'content': f'запрос {i}'}], model='gpt-3.5-turbo', max_tokens=50)
+            latencies.append(time.perf_counter() - started)
+        except LLMError:
+            errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    await client.close()
+
+    print(f'Запросов: {total}, ошибок: {errors}, время: {elapsed:.2f} с')
+    print(f'Пропускная способность: {total / elapsed:.1f} запр/с')
+    if len(latencies) >= 2:
+        q = statistics.quantiles(latencies, n=100)
+        print(f'Задержка p50: {q[49] * 1000:.0f} мс, p95: {q[94] * 1000:.0f} мс, p99: {q[98] * 1000:.0f} мс')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замер пропускной способности LLMClient')
+    parser.add_argument('-n', '--total', type=int, default=200, help='всего запросов')
+    parser.add_argument('-c', '--concurrency', type=int, default=20, help='одновременных запросов')
+    args = parser.parse_args()
+    asyncio.run(run(args.total, args.concurrency))
@@ -1,12 +1,22 @@
 import os
+import html
+import time
+import asyncio
 import logging
-import requests
 from telegram import (
     Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
 )
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters, CallbackQueryHandler, ConversationHandler
+    ApplicationBuilder, BaseUpdateProcessor, CommandHandler, MessageHandler, ContextTypes, filters,
+    CallbackQueryHandler, ConversationHandler
 )
+from telegram.error import RetryAfter, TelegramError
+from llm_client import LLMClient  # Асинхронный клиент OpenAI API
+from gen_cache import GenerationCache, make_key  # Кэш результатов генерации
+from dispatcher import GenerationDispatcher, estimate_tokens  # Объединение запросов и бюджет токенов
+from user_store import create_user_store  # Постоянное хранилище настроек пользователей
+from instrumentation import instrument, start_loop_monitor  # Метрики Prometheus
+import health  # Health-сервер работает в процессе бота
 
 # Включаем логирование
 logging.basicConfig(level=logging.INFO)
@@ -21,12 +31,35 @@ def get_secret(path, default=None):
 TELEGRAM_TOKEN = get_secret(os.environ.get('TELEGRAM_TOKEN_FILE', '/run/secrets/telegram_token'))
 OPENAI_API_KEY = get_secret(os.environ.get('OPENAI_API_KEY_FILE', '/run/secrets/openai_api_key'))
 
+# Общий клиент OpenAI API с пулом соединений
+llm_client = LLMClient(OPENAI_API_KEY)
+GENERATION_PARAMS = {'model': 'gpt-3.5-turbo', 'max_tokens': 400, 'temperature': 0.8}
+ERROR_ANSWER = ('Ошибка генерации', 'Не удалось получить ответ от ИИ.')
+
+# Кэш ответов по запросу и настройкам генерации
+generation_cache = GenerationCache()
+# Диспетчер: single-flight, бюджет токенов в минуту, справедливая очередь
+dispatcher = GenerationDispatcher()
+# Настройки и состояние диалога пользователей (переживают перезапуск, общие для реплик)
+user_store = create_user_store()
+
+# Потоковая генерация: ответ появляется по мере генерации
+LLM_STREAMING = os.environ.get('LLM_STREAMING', '1') == '1'
+# Минимальный интервал между правками сообщения в секундах
+STREAM_EDIT_INTERVAL = float(os.environ.get('STREAM_EDIT_INTERVAL', 1.0))
+
+# Порт health-сервера (/health, /metrics)
+HEALTH_PORT = int(os.environ.get('HEALTH_PORT', 8000))
+
+# Сколько обновлений Telegram обрабатывается одновременно (всех пользователей)
+BOT_CONCURRENT_UPDATES = int(os.environ.get('BOT_CONCURRENT_UPDATES', 64))
+
 # --- Константы для ConversationHandler ---
 SELECT_SETTING, = range(1)
 
 # --- Главное меню ---
 main_menu = ReplyKeyboardMarkup([
-    [KeyboardButton('📝 Сгенерировать')],
+    [KeyboardButton('📝 Сгенерировать'), KeyboardButton('🔄 Сгенерировать заново')],
     [KeyboardButton('⚙️ Настройки генерации')],
     [KeyboardButton('ℹ️ О боте')]
 ], resize_keyboard=True)
@@ -83,6 +116,7 @@ async def settings_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text('Настройки генерации:', reply_markup=reply_markup)
     return SELECT_SETTING
 
+@instrument()
 async def settings_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -105,25 +139,26 @@ async def settings_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text('Главное меню:')
         await main_menu_handler(query, context)
     elif data.startswith('format_'):
-        context.user_data['format'] = data.replace('format_', '')
+        await user_store.update(update.effective_user.id, format=data.replace('format_', ''))
         await query.edit_message_text('Формат сохранён!')
         await settings_menu(query, context)
     elif data.startswith('tone_'):
-        context.user_data['tone'] = data.replace('tone_', '')
+        await user_store.update(update.effective_user.id, tone=data.replace('tone_', ''))
         await query.edit_message_text('Тональность сохранена!')
         await settings_menu(query, context)
     elif data.startswith('length_'):
-        context.user_data['length'] = data.replace('length_', '')
+        await user_store.update(update.effective_user.id, length=data.replace('length_', ''))
         await query.edit_message_text('Длина текста сохранена!')
         await settings_menu(query, context)
     return SELECT_SETTING
 
 # --- Обработка текстовых сообщений ---
+@instrument()
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
     if text == '📝 Сгенерировать':
         await update.message.reply_text('Пожалуйста, отправьте ваш запрос (например: "Описание для сайта про кофе")', reply_markup=ReplyKeyboardRemove())
-        context.user_data['awaiting_prompt'] = True
+        await user_store.update(update.effective_user.id, awaiting_prompt=True)
         return
     if text == '⚙️ Настройки генерации':
         await settings_menu(update, context)
@@ -131,33 +166,99 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if text == 'ℹ️ О боте':
         await about(update, context)
         return
-    if context.user_data.get('awaiting_prompt'):
-        await update.message.reply_text('⏳ Генерирую ответ...')
-        # Получаем настройки пользователя
-        fmt = context.user_data.get('format', 'title_text')
-        tone = context.user_data.get('tone', 'neutral')
-        length = context.user_data.get('length', 'medium')
-        title, body = generate_ai_text(text, fmt, tone, length)
-        if fmt == 'title_text':
-            await update.message.reply_text(f'<b>Заголовок:</b> {title}\n<b>Текст:</b> {body}', parse_mode='HTML', reply_markup=main_menu)
-        elif fmt == 'title':
-            await update.message.reply_text(f'<b>Заголовок:</b> {title}', parse_mode='HTML', reply_markup=main_menu)
-        elif fmt == 'text':
-            await update.message.reply_text(f'<b>Текст:</b> {body}', parse_mode='HTML', reply_markup=main_menu)
-        context.user_data['awaiting_prompt'] = False
+    if text == '🔄 Сгенерировать заново':
+        last_prompt = (await user_store.get(update.effective_user.id)).get('last_prompt')
+        if not last_prompt:
+            await update.message.reply_text('Сначала отправьте запрос через «📝 Сгенерировать».', reply_markup=main_menu)
+            return
+        await respond(update, context, last_prompt, regenerate=True)
+        return
+    if (await user_store.get(update.effective_user.id)).get('awaiting_prompt'):
+        await user_store.update(update.effective_user.id, awaiting_prompt=False)
+        await respond(update, context, text)
         return
     await update.message.reply_text('Пожалуйста, используйте кнопки меню.', reply_markup=main_menu)
 
-# --- Генерация текста через OpenAI API ---
-def generate_ai_text(prompt: str, fmt: str, tone: str, length: str):
+# --- Ответ на запрос пользователя ---
+async def respond(update: Update, context: ContextTypes.DEFAULT_TYPE, prompt: str, regenerate=False):
     """
-    Отправляет запрос к OpenAI API с учётом формата, тона и длины
+    Отвечает на запрос: сначала ищет готовый ответ в кэше, иначе генерирует.
+    regenerate: пропустить кэш и перезаписать сохранённый ответ.
     """
-    url = 'https://api.openai.com/v1/chat/completions'
-    headers = {
-        'Authorization': f'Bearer {OPENAI_API_KEY}',
-        'Content-Type': 'application/json'
-    }
+    # Получаем настройки пользователя
+    user_id = update.effective_user.id
+    state = await user_store.get(user_id)
+    fmt = state.get('format', 'title_text')
+    tone = state.get('tone', 'neutral')
+    length = state.get('length', 'medium')
+    await user_store.update(user_id, last_prompt=prompt)
+    key = make_key(prompt, fmt, tone, length)
+    cached = None if regenerate else await generation_cache.get(key)
+    if cached is not None:
+        await update.message.reply_text(format_answer(fmt, *cached), parse_mode='HTML', reply_markup=main_menu)
+        return
+    # В потоковом режиме ответ появляется в этом сообщении по мере генерации
+    message = await update.message.reply_text('⏳ Генерирую ответ...', reply_markup=main_menu if LLM_STREAMING else None)
+    executed = False  # True, если запрос выполнил именно этот обработчик
+
+    async def produce():
+        nonlocal executed
+        executed = True
+        if LLM_STREAMING:
+            return await stream_reply(message, prompt, fmt, tone, length)
+        return await generate_ai_text(prompt, fmt, tone, length)
+
+    cost = estimate_tokens(build_messages(prompt, fmt, tone, length), GENERATION_PARAMS['max_tokens'])
+    title, body = await dispatcher.submit(user_id, key, cost, produce)
+    if LLM_STREAMING and not executed:
+        # Запрос объединился с уже выполнявшимся: показываем его результат
+        await message.edit_text(format_answer(fmt, title, body), parse_mode='HTML')
+    elif not LLM_STREAMING:
+        await update.message.reply_text(format_answer(fmt, title, body), parse_mode='HTML', reply_markup=main_menu)
+    # Результат объединённого запроса уже сохранил тот, кто его выполнил
+    if executed and (title, body) != ERROR_ANSWER:
+        await generation_cache.set(key, title, body)
+
+# --- Статистика кэша и диспетчера ---
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    stats = generation_cache.stats()
+    dispatch = dispatcher.stats()
+    await update.message.reply_text(
+        f'Кэш генераций:\n'
+        f'Попаданий (память): {stats["hits_memory"]}\n'
+        f'Попаданий (диск): {stats["hits_disk"]}\n'
+        f'Промахов: {stats["misses"]}\n'
+        f'Доля попаданий: {stats["hit_rate"]:.0%}\n'
+        f'Записей в памяти: {stats["memory_items"]}\n\n'
+        f'Диспетчер:\n'
+        f'Выполнено запросов: {dispatch["executed"]}\n'
+        f'Объединено одинаковых: {dispatch["coalesced"]}\n'
+        f'В очереди: {dispatch["queued"]}\n'
+        f'Доступно токенов: {dispatch["tokens_available"]}',
+        reply_markup=main_menu
+    )
+
+# --- Генерация текста через OpenAI API ---
+def parse_answer(answer: str):
+    """Разбирает ответ вида "Заголовок: ...\nТекст: ..." на заголовок и текст."""
+    title, body = '', ''
+    if 'Заголовок:' in answer:
+        title = answer.split('Заголовок:')[1].split('Текст:')[0].strip() if 'Текст:' in answer else answer.split('Заголовок:')[1].strip()
+    if 'Текст:' in answer:
+        body = answer.split('Текст:')[1].strip()
+    return title, body
+
+def format_answer(fmt: str, title: str, body: str):
+    """Формирует HTML-текст ответа для выбранного формата."""
+    title, body = html.escape(title), html.escape(body)
+    if fmt == 'title':
+        return f'<b>Заголовок:</b> {title}'
+    if fmt == 'text':
+        return f'<b>Текст:</b> {body}'
+    return f'<b>Заголовок:</b> {title}\n<b>Текст:</b> {body}'
+
+def build_messages(prompt: str, fmt: str, tone: str, length: str):
+    """Формирует список сообщений для chat completions с учётом настроек."""
     # Формируем системный prompt с учётом настроек
     system_prompt = (
         f'Ты — помощник-копирайтер. Формат ответа: {fmt}. '
@@ -166,36 +267,150 @@ def generate_ai_text(prompt: str, fmt: str, tone: str, length: str):
         'Ответ возвращай в формате: "Заголовок: ...\nТекст: ...". '
         'Если только заголовок — только "Заголовок: ...". Если только текст — только "Текст: ...".'
     )
-    data = {
-        'model': 'gpt-3.5-turbo',
-        'messages': [
-            {'role': 'system', 'content': system_prompt},
-            {'role': 'user', 'content': prompt}
-        ],
-        'max_tokens': 400,
-        'temperature': 0.8
-    }
+    return [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': prompt}
+    ]
+
+@instrument()
+async def generate_ai_text(prompt: str, fmt: str, tone: str, length: str):
+    """
+    Отправляет запрос к OpenAI API с учётом формата, тона и длины
+    """
     try:
-        resp = requests.post(url, headers=headers, json=data, timeout=30)
-        resp.raise_for_status()
-        answer = resp.json()['choices'][0]['message']['content']
-        # Парсим ответ
-        title, body = '', ''
-        if 'Заголовок:' in answer:
-            title = answer.split('Заголовок:')[1].split('Текст:')[0].strip() if 'Текст:' in answer else answer.split('Заголовок:')[1].strip()
-        if 'Текст:' in answer:
-            body = answer.split('Текст:')[1].strip()
-        return title, body
+        answer = await llm_client.chat(build_messages(prompt, fmt, tone, length), **GENERATION_PARAMS)
+        return parse_answer(answer)
     except Exception as e:
         logging.error(f'Ошибка OpenAI: {e}')
-        return 'Ошибка генерации', 'Не удалось получить ответ от ИИ.'
+        return ERROR_ANSWER
+
+# --- Потоковая генерация ---
+def strip_partial_marker(answer: str):
+    """Отрезает незаконченный маркер в конце ответа (например, "Тек" от "Текст:")."""
+    for marker in ('Заголовок:', 'Текст:'):
+        for size in range(len(marker) - 1, 1, -1):
+            if answer.endswith(marker[:size]):
+                return answer[:-size]
+    return answer
+
+class StreamingAnswerParser:
+    """Инкрементальный разбор ответа с маркерами "Заголовок:" и "Текст:"."""
+
+    def __init__(self):
+        self.answer = ''
+
+    def feed(self, chunk: str):
+        """Добавляет фрагмент и возвращает текущие (заголовок, текст)."""
+        self.answer += chunk
+        return parse_answer(strip_partial_marker(self.answer))
+
+    def result(self):
+        return parse_answer(self.answer)
+
+@instrument()
+async def stream_reply(message, prompt: str, fmt: str, tone: str, length: str):
+    """
+    Генерирует ответ в потоковом режиме и по мере поступления фрагментов
+    редактирует сообщение message не чаще раза в STREAM_EDIT_INTERVAL секунд.
+    """
+    shown = message.text
+    next_edit = 0.0
+
+    async def edit(text, final=False):
+        nonlocal shown, next_edit
+        if text == shown:
+            return
+        try:
+            await message.edit_text(text, parse_mode='HTML')
+            shown = text
+            next_edit = time.monotonic() + STREAM_EDIT_INTERVAL
+        except RetryAfter as e:
+            # Telegram ограничивает частоту правок: промежуточные пропускаем, финальную дожидаемся
+            if final:
+                await asyncio.sleep(e.retry_after)
+                await edit(text, final=True)
+            else:
+                next_edit = time.monotonic() + e.retry_after
+        except TelegramError as e:
+            logging.warning(f'Не удалось обновить сообщение: {e}')
+
+    parser = StreamingAnswerParser()
+    try:
+        async for chunk in llm_client.stream_chat(build_messages(prompt, fmt, tone, length), **GENERATION_PARAMS):
+            title, body = parser.feed(chunk)
+            if (title or body) and time.monotonic() >= next_edit:
+                await edit(format_answer(fmt, title, body) + ' ▌')
+        title, body = parser.result()
+    except Exception as e:
+        logging.error(f'Ошибка OpenAI: {e}')
+        title, body = ERROR_ANSWER
+    await edit(format_answer(fmt, title, body), final=True)
+    return title, body
+
+# --- Запуск и остановка общих ресурсов ---
+async def post_init(app):
+    health.serve_in_background(port=HEALTH_PORT)
+    start_loop_monitor()
+    await user_store.start()
+    await generation_cache.init()
+    dispatcher.start()
+
+async def post_shutdown(app):
+    await dispatcher.stop()
+    await llm_client.close()
+    await generation_cache.close()
+    await user_store.close()
+
+# --- Параллельная обработка обновлений ---
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обновления разных пользователей обрабатываются параллельно (не больше
+    max_concurrent_updates одновременно), а обновления одного пользователя —
+    строго по очереди, поэтому ConversationHandler получает шаги диалога
+    в порядке поступления.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # id пользователя (или чата) -> [Lock, число ожидающих]
+
+    async def do_process_update(self, update, coroutine):
+        key = None
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                key = update.effective_user.id
+            elif update.effective_chat is not None:
+                key = update.effective_chat.id
+        if key is None:
+            await coroutine
+            return
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
 
 # --- Основная функция ---
 async def main():
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    # Обновления разных пользователей обрабатываются параллельно, одного — по порядку
+    app = (
+        ApplicationBuilder().token(TELEGRAM_TOKEN).concurrent_updates(PerUserUpdateProcessor(BOT_CONCURRENT_UPDATES))
+        .post_init(post_init).post_shutdown(post_shutdown).build()
+    )
     app.add_handler(CommandHandler('start', start))
     app.add_handler(CommandHandler('menu', main_menu_handler))
     app.add_handler(CommandHandler('about', about))
+    app.add_handler(CommandHandler('cachestats', cache_stats))
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('settings', settings_menu)],
         states={
@@ -208,5 +423,4 @@ async def main():
     await app.run_polling()
 
 if __name__ == '__main__':
-    import asyncio
     asyncio.run(main()) 
\ No newline at end of file
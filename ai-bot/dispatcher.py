@@ -0,0 +1,139 @@
+"""
+Диспетчер запросов генерации для AI-бота.
+
+- Одинаковые запросы, которые уже выполняются, объединяются в один вызов API
+  (single-flight): все ожидающие получают один и тот же результат.
+- Общий бюджет токенов в минуту (token bucket) не даёт превысить лимит
+  провайдера и получить лавину ответов 429.
+- Запросы сверх бюджета ждут в очередях по пользователям, которые
+  обслуживаются по кругу, поэтому один активный пользователь не
+  вытесняет остальных.
+"""
+import asyncio  # Для очередей, событий и воркеров
+import logging  # Для логирования событий
+import os  # Для чтения переменных окружения
+import time  # Для пополнения бюджета токенов
+from collections import OrderedDict, deque  # Для очередей по пользователям
+
+# Бюджет токенов в минуту (лимит TPM провайдера)
+LLM_TOKENS_PER_MINUTE = int(os.environ.get('LLM_TOKENS_PER_MINUTE', 90000))
+# Сколько запросов диспетчер выполняет одновременно
+LLM_DISPATCH_WORKERS = int(os.environ.get('LLM_DISPATCH_WORKERS', os.environ.get('LLM_MAX_CONCURRENCY', 10)))
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(messages, max_tokens):
+    """Грубая оценка стоимости запроса: ~3 символа на токен плюс максимум ответа."""
+    chars = sum(len(m['content']) for m in messages)
+    return chars // 3 + max_tokens
+
+
+class TokenBucket:
+    """Бюджет токенов, равномерно пополняемый до capacity за минуту."""
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, cost):
+        """Ждёт, пока в бюджете не наберётся cost токенов, и списывает их."""
+        cost = min(cost, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return
+            await asyncio.sleep((cost - self.tokens) / self.rate)
+
+
+class GenerationDispatcher:
+    """
+    Выполняет запросы генерации с объединением одинаковых запросов,
+    бюджетом токенов и справедливой очередью по пользователям.
+    """
+
+    def __init__(self, tokens_per_minute=LLM_TOKENS_PER_MINUTE, workers=LLM_DISPATCH_WORKERS):
+        self.workers = max(1, workers)
+        self._bucket = TokenBucket(tokens_per_minute)
+        self._inflight = {}  # key -> asyncio.Future
+        self._queues = OrderedDict()  # user_id -> deque[(key, cost, factory)]
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self.coalesced = 0
+        self.executed = 0
+
+    def start(self):
+        """Запускает воркеры. Вызывается из работающего event loop."""
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f'llm-dispatch-{i}'))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def submit(self, user_id, key, cost, factory):
+        """
+        Ставит запрос в очередь пользователя и ждёт результат.
+        key: ключ для объединения одинаковых запросов.
+        cost: оценка стоимости в токенах.
+        factory: корутина-фабрика без аргументов, выполняющая запрос.
+        Если такой же запрос уже выполняется, factory не вызывается,
+        а возвращается результат уже идущего запроса.
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self._queues.setdefault(user_id, deque()).append((key, cost, factory))
+        self._wakeup.set()
+        return await asyncio.shield(future)
+
+    def _next_job(self):
+        """Берёт следующий запрос по кругу: по одному от каждого пользователя."""
+        user_id, queue = self._queues.popitem(last=False)
+        job = queue.popleft()
+        if queue:
+            self._queues[user_id] = queue
+        return job
+
+    async def _worker(self):
+        while True:
+            while not self._queues:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            key, cost, factory = self._next_job()
+            future = self._inflight[key]
+            try:
+                await self._bucket.acquire(cost)
+                result = await factory()
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                logger.exception('Ошибка при выполнении запроса генерации')
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+                self.executed += 1
+            finally:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        return {
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'queued': sum(len(q) for q in self._queues.values()),
+            'tokens_available': int(self._bucket.tokens),
+        }
@@ -0,0 +1,158 @@
+"""
+Кэш результатов генерации для AI-бота.
+
+Ключ — нормализованный запрос пользователя вместе с форматом, тональностью
+и длиной. Первый уровень — LRU-словарь в памяти, второй (необязательный) —
+таблица SQLite с TTL и ограничением на число записей. Запросы к SQLite
+выполняются в выделенном потоке и не блокируют event loop.
+"""
+import asyncio  # Для выполнения запросов вне event loop
+import hashlib  # Для хэширования ключей
+import json  # Для сериализации ключа
+import logging  # Для логирования событий
+import os  # Для чтения переменных окружения
+import sqlite3  # Для дискового уровня кэша
+import time  # Для TTL
+from collections import OrderedDict  # Для LRU
+from concurrent.futures import ThreadPoolExecutor  # Для выделенного потока базы
+
+# Размер LRU-кэша в памяти (записей)
+GEN_CACHE_SIZE = int(os.environ.get('GEN_CACHE_SIZE', 1000))
+# Время жизни записи в секундах
+GEN_CACHE_TTL = float(os.environ.get('GEN_CACHE_TTL', 24 * 3600))
+# Путь к базе SQLite для дискового уровня (пусто — только память)
+GEN_CACHE_DB = os.environ.get('GEN_CACHE_DB', '')
+# Максимум записей на диске
+GEN_CACHE_DB_MAX_ROWS = int(os.environ.get('GEN_CACHE_DB_MAX_ROWS', 100000))
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(prompt: str, fmt: str, tone: str, length: str):
+    """Ключ кэша: регистр и лишние пробелы в запросе не учитываются."""
+    normalized = ' '.join(prompt.casefold().split())
+    raw = json.dumps([normalized, fmt, tone, length], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class GenerationCache:
+    """Двухуровневый кэш (память + SQLite) для пар (заголовок, текст)."""
+
+    def __init__(self, max_items=GEN_CACHE_SIZE, ttl=GEN_CACHE_TTL, db_path=GEN_CACHE_DB,
+                 db_max_rows=GEN_CACHE_DB_MAX_ROWS):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.db_path = db_path
+        self.db_max_rows = db_max_rows
+        self._lru = OrderedDict()  # key -> (expires_at, title, body)
+        self._conn = None
+        self._writes = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gen-cache') if db_path else None
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # --- Операции, выполняемые в потоке базы ---
+    def _init_db(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS gen_cache (
+                key TEXT PRIMARY KEY,
+                title TEXT,
+                body TEXT,
+                created_at REAL,
+                expires_at REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_gen_cache_expires ON gen_cache (expires_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_gen_cache_created ON gen_cache (created_at)')
+        conn.commit()
+        self._conn = conn
+
+    def _db_get(self, key):
+        return self._conn.execute(
+            'SELECT expires_at, title, body FROM gen_cache WHERE key=? AND expires_at>?', (key, time.time())
+        ).fetchone()
+
+    def _db_set(self, key, title, body, expires_at):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO gen_cache (key, title, body, created_at, expires_at) VALUES (?, ?, ?, ?, ?)',
+            (key, title, body, time.time(), expires_at)
+        )
+        self._writes += 1
+        # Чистку выполняем не на каждую запись, а раз в 100 записей
+        if self._writes % 100 == 0:
+            self._evict()
+        self._conn.commit()
+
+    def _evict(self):
+        self._conn.execute('DELETE FROM gen_cache WHERE expires_at<=?', (time.time(),))
+        (count,) = self._conn.execute('SELECT COUNT(*) FROM gen_cache').fetchone()
+        if count > self.db_max_rows:
+            self._conn.execute(
+                'DELETE FROM gen_cache WHERE key IN (SELECT key FROM gen_cache ORDER BY created_at LIMIT ?)',
+                (count - self.db_max_rows,)
+            )
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+    # --- Асинхронный интерфейс ---
+    async def init(self):
+        if self.db_path:
+            await self._run(self._init_db)
+            logger.info('Дисковый кэш генераций: %s', self.db_path)
+
+    def _remember(self, key, entry):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+
+    async def get(self, key):
+        """Возвращает (заголовок, текст) или None."""
+        entry = self._lru.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._lru.move_to_end(key)
+                self.hits_memory += 1
+                return entry[1], entry[2]
+            del self._lru[key]
+        if self._conn is not None:
+            entry = await self._run(self._db_get, key)
+            if entry is not None:
+                self._remember(key, tuple(entry))
+                self.hits_disk += 1
+                return entry[1], entry[2]
+        self.misses += 1
+        return None
+
+    async def set(self, key, title, body):
+        entry = (time.time() + self.ttl, title, body)
+        self._remember(key, entry)
+        if self._conn is not None:
+            await self._run(self._db_set, key, title, body, entry[0])
+
+    def stats(self):
+        total = self.hits_memory + self.hits_disk + self.misses
+        return {
+            'hits_memory': self.hits_memory,
+            'hits_disk': self.hits_disk,
+            'misses': self.misses,
+            'hit_rate': (self.hits_memory + self.hits_disk) / total if total else 0.0,
+            'memory_items': len(self._lru),
+        }
+
+    async def close(self):
+        if self._executor is not None:
+            await self._run(self._close)
+            self._executor.shutdown(wait=False)
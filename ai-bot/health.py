@@ -1,6 +1,9 @@
+import threading
 import time
+import uvicorn
 from fastapi import FastAPI
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+import instrumentation
 
 start_time = time.time()
 app = FastAPI()
@@ -12,4 +15,17 @@ def health():
         "status": "ok",
         "uptime": f"{uptime // 60} мин {uptime % 60} сек",
         "details": "AI Telegram Bot работает"
-    }) 
\ No newline at end of file
+    })
+
+@app.get("/metrics")
+def prometheus_metrics():
+    # Метрики процесса в формате Prometheus
+    body, content_type = instrumentation.render()
+    return Response(body, media_type=content_type)
+
+def serve_in_background(host="0.0.0.0", port=8000):
+    """Запускает health-сервер в отдельном потоке процесса бота."""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="health-server", daemon=True)
+    thread.start()
+    return server
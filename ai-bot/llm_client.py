@@ -0,0 +1,161 @@
+"""
+Асинхронный клиент OpenAI-совместимого API для AI-бота.
+
+Один httpx.AsyncClient на весь процесс держит пул keep-alive соединений,
+семафор ограничивает число одновременных запросов, а ответы 429/5xx и
+сетевые ошибки повторяются с экспоненциальной задержкой и джиттером.
+Адрес API задаётся через OPENAI_BASE_URL, поэтому клиент можно направить
+на локальную заглушку (stub_openai.py) и измерить пропускную способность.
+"""
+import asyncio  # Для семафора и задержек между повторами
+import json  # Для разбора событий SSE
+import logging  # Для логирования событий
+import os  # Для чтения переменных окружения
+import random  # Для джиттера
+import httpx  # Асинхронный HTTP-клиент с пулом соединений
+
+from instrumentation import outbound  # Задержки и ошибки запросов к LLM
+
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+# Сколько запросов к API выполняется одновременно
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 10))
+# Таймаут одного запроса в секундах
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 30))
+# Количество повторов при 429/5xx и сетевых ошибках
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 3))
+# Базовая и максимальная задержка между повторами в секундах
+LLM_BACKOFF_BASE = float(os.environ.get('LLM_BACKOFF_BASE', 0.5))
+LLM_BACKOFF_MAX = float(os.environ.get('LLM_BACKOFF_MAX', 10))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    """Запрос к API завершился ошибкой после всех повторов."""
+
+
+class LLMClient:
+    """
+    Клиент chat completions API с пулом соединений, ограничением
+    параллелизма и повторами.
+    """
+
+    def __init__(self, api_key, base_url=OPENAI_BASE_URL, max_concurrency=LLM_MAX_CONCURRENCY,
+                 timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={'Authorization': f'Bearer {api_key}'},
+            timeout=httpx.Timeout(timeout, connect=5),
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+                keepalive_expiry=60
+            )
+        )
+
+    async def close(self):
+        await self._client.aclose()
+
+    def _backoff(self, attempt, retry_after=None):
+        """Задержка перед повтором: Retry-After от сервера или экспонента с полным джиттером."""
+        if retry_after:
+            try:
+                return min(float(retry_after), LLM_BACKOFF_MAX)
+            except ValueError:
+                pass
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+    async def chat(self, messages, timeout=None, **params):
+        """
+        Выполняет запрос к /chat/completions и возвращает текст ответа.
+        timeout: таймаут этого запроса (по умолчанию — LLM_TIMEOUT).
+        params: дополнительные поля запроса (model, max_tokens, temperature...).
+        """
+        payload = {'messages': messages, **params}
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            async with self._semaphore:
+                try:
+                    with outbound('llm') as call:
+                        resp = await self._client.post('/chat/completions', json=payload, timeout=timeout or self.timeout)
+                        if resp.status_code >= 400:
+                            call.fail(f'HTTP {resp.status_code}')
+                except httpx.TransportError as e:
+                    last_error = e
+                else:
+                    if resp.status_code not in RETRY_STATUSES:
+                        resp.raise_for_status()
+                        return resp.json()['choices'][0]['message']['content']
+                    last_error = httpx.HTTPStatusError(f'HTTP {resp.status_code}', request=resp.request, response=resp)
+                    retry_after = resp.headers.get('retry-after')
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt, retry_after)
+                logger.warning('Запрос к LLM не удался (%s), повтор через %.2f с', last_error, delay)
+                await asyncio.sleep(delay)
+        raise LLMError(f'Не удалось получить ответ после {self.max_retries + 1} попыток: {last_error}')
+
+    async def stream_chat(self, messages, timeout=None, **params):
+        """
+        Потоковый вариант chat(): отдаёт фрагменты текста по мере генерации
+        (server-sent events с "stream": true). Повторы выполняются только до
+        получения первого фрагмента, после этого ошибка пробрасывается как LLMError.
+        """
+        payload = {'messages': messages, 'stream': True, **params}
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            started = False
+            async with self._semaphore:
+                try:
+                    # Время потокового вызова — до конца ответа, включая чтение всех фрагментов
+                    with outbound('llm_stream') as call:
+                        async with self._client.stream('POST', '/chat/completions', json=payload,
+                                                       timeout=timeout or self.timeout) as resp:
+                            if resp.status_code >= 400:
+                                call.fail(f'HTTP {resp.status_code}')
+                            if resp.status_code in RETRY_STATUSES:
+                                retry_after = resp.headers.get('retry-after')
+                                raise httpx.HTTPStatusError(f'HTTP {resp.status_code}', request=resp.request, response=resp)
+                            resp.raise_for_status()
+                            async for line in resp.aiter_lines():
+                                if not line.startswith('data:'):
+                                    continue
+                                data = line[len('data:'):].strip()
+                                if data == '[DONE]':
+                                    return
+                                try:
+                                    chunk = json.loads(data) if data else None
+                                except ValueError:
+                                    chunk = None
+                                if not isinstance(chunk, dict):
+                                    continue  # Пустое событие keep-alive или не JSON
+                                if chunk.get('error'):
+                                    error = chunk['error']
+                                    message = error.get('message') if isinstance(error, dict) else error
+                                    raise LLMError(f'API вернул ошибку в потоке ответа: {message}')
+                                # Фрагменты без choices (например, с usage) пропускаем
+                                choices = chunk.get('choices') or []
+                                delta = (choices[0].get('delta') or {}).get('content') if choices else None
+                                if delta:
+                                    started = True
+                                    yield delta
+                            return
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    if started:
+                        raise LLMError(f'Поток ответа прервался: {e}') from e
+                    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code not in RETRY_STATUSES:
+                        raise
+                    last_error = e
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt, retry_after)
+                logger.warning('Потоковый запрос к LLM не удался (%s), повтор через %.2f с', last_error, delay)
+                await asyncio.sleep(delay)
+        raise LLMError(f'Не удалось получить ответ после {self.max_retries + 1} попыток: {last_error}')
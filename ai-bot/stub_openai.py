@@ -0,0 +1,59 @@
+"""
+Локальная заглушка OpenAI chat completions API для нагрузочного тестирования.
+
+Запуск:
+    uvicorn stub_openai:app --port 9000
+и в боте или в bench_llm.py: OPENAI_BASE_URL=http://localhost:9000/v1
+
+Переменные окружения:
+STUB_LATENCY — задержка ответа в секундах (по умолчанию 0.5)
+STUB_ERROR_RATE — доля ответов 429/503 от 0 до 1 (по умолчанию 0)
+STUB_TOKEN_DELAY — задержка между фрагментами потокового ответа (по умолчанию 0.05)
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STUB_LATENCY = float(os.environ.get('STUB_LATENCY', 0.5))
+STUB_ERROR_RATE = float(os.environ.get('STUB_ERROR_RATE', 0))
+STUB_TOKEN_DELAY = float(os.environ.get('STUB_TOKEN_DELAY', 0.05))
+
+ANSWER = 'Заголовок: Тестовый заголовок\nТекст: Это ответ локальной заглушки OpenAI API.'
+
+app = FastAPI()
+
+
+@app.post('/v1/chat/completions')
+async def chat_completions(request: Request):
+    body = await request.json()
+    await asyncio.sleep(STUB_LATENCY * random.uniform(0.5, 1.5))
+    if random.random() < STUB_ERROR_RATE:
+        status = random.choice([429, 503])
+        return JSONResponse({'error': {'message': 'stub error'}}, status_code=status, headers={'Retry-After': '0.1'})
+    if body.get('stream'):
+        return StreamingResponse(stream_answer(body), media_type='text/event-stream')
+    return {
+        'id': f'stub-{time.time_ns()}',
+        'object': 'chat.completion',
+        'model': body.get('model', 'stub'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ANSWER}, 'finish_reason': 'stop'}],
+    }
+
+
+async def stream_answer(body):
+    """Отдаёт ANSWER по словам в формате server-sent events, как это делает OpenAI."""
+    chunk_id = f'stub-{time.time_ns()}'
+    for word in ANSWER.split(' '):
+        chunk = {
+            'id': chunk_id,
+            'object': 'chat.completion.chunk',
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}],
+        }
+        yield f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'
+        await asyncio.sleep(STUB_TOKEN_DELAY)
+    yield 'data: [DONE]\n\n'
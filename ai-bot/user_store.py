@@ -0,0 +1,293 @@
+"""
+Хранилище настроек и состояния диалога пользователей AI-бота.
+
+Обработчики читают данные из кэша в памяти и пишут туда же; изменения
+сбрасываются в хранилище пачкой в фоне (write-behind), поэтому обработчики
+не ждут диска или сети. Бэкенды:
+- sqlite — локальный файл SQLite (по умолчанию);
+- redis — Redis-совместимый сервер (REDIS_URL), нужен для нескольких реплик бота.
+  Если пакет redis не установлен или REDIS_URL не задан, используется
+  LocalRedis — локальная замена в памяти с тем же интерфейсом.
+"""
+import asyncio  # Для фонового сброса и выполнения запросов вне event loop
+import json  # Для сериализации значений
+import logging  # Для логирования событий
+import os  # Для чтения переменных окружения
+import sqlite3  # Для бэкенда SQLite
+import time  # Для TTL кэша
+from abc import ABC, abstractmethod  # Для базового класса хранилища
+from collections import OrderedDict  # Для LRU-кэша
+from concurrent.futures import ThreadPoolExecutor  # Для выделенного потока базы
+
+try:
+    import redis.asyncio as aioredis  # Необязательная зависимость
+except ImportError:
+    aioredis = None
+
+# Бэкенд хранилища: sqlite или redis
+USER_STORE_BACKEND = os.environ.get('USER_STORE_BACKEND', 'sqlite')
+# Путь к базе SQLite
+USER_STORE_PATH = os.environ.get('USER_STORE_PATH', 'user_state.db')
+# Адрес Redis (например, redis://redis:6379/0)
+REDIS_URL = os.environ.get('REDIS_URL', '')
+# Как часто сбрасывать изменения в хранилище (секунды)
+USER_STORE_FLUSH_INTERVAL = float(os.environ.get('USER_STORE_FLUSH_INTERVAL', 1.0))
+# Сколько секунд доверять кэшу (другие реплики могли изменить данные)
+USER_STORE_CACHE_TTL = float(os.environ.get('USER_STORE_CACHE_TTL', 30))
+# Сколько пользователей держать в кэше (давно не активные вытесняются)
+USER_STORE_CACHE_SIZE = int(os.environ.get('USER_STORE_CACHE_SIZE', 10000))
+
+logger = logging.getLogger(__name__)
+
+
+class UserStore(ABC):
+    """
+    Базовый класс: кэш чтения, накопление изменений и фоновый сброс.
+    Наследники реализуют _load(user_id) и _save_many({user_id: data}).
+    Кэш ограничен cache_size записями (LRU), устаревшие записи удаляются
+    в фоне; несброшенные изменения хранятся отдельно и при вытеснении
+    не теряются.
+    """
+
+    def __init__(self, flush_interval=USER_STORE_FLUSH_INTERVAL, cache_ttl=USER_STORE_CACHE_TTL,
+                 cache_size=USER_STORE_CACHE_SIZE):
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # user_id -> (loaded_at, dict), от давно использованных к недавним
+        self._dirty = {}  # user_id -> изменённые поля
+        self._flushing = {}  # Изменения, которые сейчас записываются в хранилище
+        self._flushes = 0  # Число завершённых сбросов: чтение, пересёкшееся со сбросом, повторяется
+        self._flush_task = None
+        self._swept_at = time.monotonic()
+
+    @abstractmethod
+    async def _load(self, user_id):
+        """Читает данные пользователя из хранилища; {} — если их нет."""
+
+    @abstractmethod
+    async def _save_many(self, changes):
+        """Записывает изменённые поля пользователей ({user_id: fields}) одной пачкой."""
+
+    async def _open(self):
+        pass
+
+    async def _close(self):
+        pass
+
+    async def start(self):
+        await self._open()
+        self._flush_task = asyncio.create_task(self._flush_loop(), name='user-store-flush')
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+        await self._close()
+
+    async def get(self, user_id):
+        """Возвращает данные пользователя (копию словаря)."""
+        entry = self._cache.get(user_id)
+        if entry is None or (time.monotonic() - entry[0] > self.cache_ttl and user_id not in self._dirty):
+            while True:
+                flushes = self._flushes
+                data = await self._load(user_id)
+                if flushes == self._flushes:
+                    break
+            # Несброшенные и записываемые сейчас изменения важнее прочитанных из хранилища
+            data.update(self._flushing.get(user_id, {}))
+            data.update(self._dirty.get(user_id, {}))
+            entry = (time.monotonic(), data)
+            self._remember(user_id, entry)
+        else:
+            self._cache.move_to_end(user_id)
+        return dict(entry[1])
+
+    def _remember(self, user_id, entry):
+        self._cache[user_id] = entry
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _evict_expired(self):
+        """Удаляет из кэша записи старше cache_ttl: они всё равно будут перечитаны."""
+        now = time.monotonic()
+        expired = [user_id for user_id, (loaded_at, _) in self._cache.items() if now - loaded_at > self.cache_ttl]
+        for user_id in expired:
+            del self._cache[user_id]
+        self._swept_at = now
+
+    async def update(self, user_id, **fields):
+        """Изменяет поля пользователя; запись в хранилище произойдёт в фоне."""
+        data = await self.get(user_id)
+        data.update(fields)
+        self._remember(user_id, (time.monotonic(), data))
+        self._dirty.setdefault(user_id, {}).update(fields)
+
+    async def flush(self):
+        """Записывает накопленные изменения одной пачкой."""
+        if not self._dirty:
+            return
+        changes, self._dirty = self._dirty, {}
+        self._flushing = changes
+        try:
+            await self._save_many(changes)
+        except Exception:
+            logger.exception('Не удалось сохранить данные пользователей, повторю позже')
+            for user_id, fields in changes.items():
+                self._dirty[user_id] = {**fields, **self._dirty.get(user_id, {})}
+        finally:
+            self._flushing = {}
+            self._flushes += 1
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.monotonic() - self._swept_at > self.cache_ttl:
+                self._evict_expired()
+
+
+class SQLiteUserStore(UserStore):
+    """Хранение в локальном файле SQLite (одна строка JSON на пользователя)."""
+
+    def __init__(self, path=USER_STORE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='user-store')
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _init_db(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_state (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL
+            )
+        ''')
+        conn.commit()
+        self._conn = conn
+
+    def _load_sync(self, user_id):
+        row = self._conn.execute('SELECT data FROM user_state WHERE user_id=?', (user_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def _save_sync(self, changes):
+        now = time.time()
+        for user_id, fields in changes.items():
+            data = self._load_sync(user_id)
+            data.update(fields)
+            self._conn.execute(
+                'INSERT INTO user_state (user_id, data, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (user_id) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at',
+                (user_id, json.dumps(data, ensure_ascii=False), now)
+            )
+        self._conn.commit()
+
+    def _close_sync(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _open(self):
+        await self._run(self._init_db)
+
+    async def _load(self, user_id):
+        return await self._run(self._load_sync, user_id)
+
+    async def _save_many(self, changes):
+        await self._run(self._save_sync, changes)
+
+    async def _close(self):
+        await self._run(self._close_sync)
+        self._executor.shutdown(wait=False)
+
+
+class LocalRedis:
+    """
+    Локальная замена Redis в памяти: поддерживает подмножество команд,
+    которое использует RedisUserStore (hgetall, hset, pipeline, aclose).
+    Данные не переживают перезапуск — только для разработки и тестов.
+    """
+
+    def __init__(self):
+        self._hashes = {}
+
+    async def hgetall(self, name):
+        return dict(self._hashes.get(name, {}))
+
+    async def hset(self, name, mapping):
+        self._hashes.setdefault(name, {}).update(mapping)
+        return len(mapping)
+
+    def pipeline(self, transaction=False):
+        return _LocalPipeline(self)
+
+    async def aclose(self):
+        pass
+
+
+class _LocalPipeline:
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._commands.clear()
+
+    def hset(self, name, mapping):
+        self._commands.append((name, mapping))
+        return self
+
+    async def execute(self):
+        results = [await self._client.hset(name, mapping) for name, mapping in self._commands]
+        self._commands.clear()
+        return results
+
+
+class RedisUserStore(UserStore):
+    """Хранение в Redis: хэш user:<id>, значения полей в JSON."""
+
+    def __init__(self, client, prefix='ai-bot:user:', **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+        self.prefix = prefix
+
+    async def _load(self, user_id):
+        raw = await self.client.hgetall(f'{self.prefix}{user_id}')
+        return {
+            (k.decode() if isinstance(k, bytes) else k): json.loads(v)
+            for k, v in raw.items()
+        }
+
+    async def _save_many(self, changes):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for user_id, fields in changes.items():
+                pipe.hset(f'{self.prefix}{user_id}', mapping={k: json.dumps(v, ensure_ascii=False) for k, v in fields.items()})
+            await pipe.execute()
+
+    async def _close(self):
+        await self.client.aclose()
+
+
+def create_user_store(backend=USER_STORE_BACKEND):
+    """Создаёт хранилище по имени бэкенда из USER_STORE_BACKEND."""
+    if backend == 'redis':
+        if aioredis is not None and REDIS_URL:
+            return RedisUserStore(aioredis.from_url(REDIS_URL))
+        logger.warning('Redis недоступен (нет пакета redis или REDIS_URL), используется LocalRedis в памяти')
+        return RedisUserStore(LocalRedis())
+    if backend == 'sqlite':
+        return SQLiteUserStore()
+    raise ValueError(f'Неизвестный бэкенд хранилища: {backend}')
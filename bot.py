@@ -1,15 +1,23 @@
 import logging  # Для логирования событий
 import os  # Для работы с файловой системой
-import sqlite3  # Для работы с SQLite (заготовка)
-import subprocess  # Для запуска Scrapy как подпроцесса
+import functools  # Для передачи бота в воркеры очереди
+import time  # Для учёта времени выполнения задач
+import asyncio  # Для неблокирующей работы с очередью задач
+import tempfile  # Для временных файлов с результатами
 import requests  # Для работы с HashiCorp Vault
 from telegram import (
-    Update, InputFile, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+    Update, InputFile, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 )  # Импортируем необходимые классы
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, ContextTypes, ConversationHandler,
     CallbackQueryHandler, MessageHandler, filters
 )  # Для создания бота и обработки команд и диалогов
+from crawl_queue import CrawlScheduler, CrawlJob, DuplicateJobError, QueueFullError  # Очередь задач сбора
+from config_store import ConfigStore  # Хранилище параметров пользователей
+from crawler_service import CrawlerService, CrawlerServiceError  # Долгоживущий процесс Scrapy
+from scrapy_project.profiles import PARAM_HINTS, ProfileError, build_settings, describe, spider_arguments, validate_param  # Профили сбора
+from instrumentation import instrument, start_loop_monitor  # Метрики Prometheus
+import health  # Health-сервер работает в процессе бота
 
 # --- Функция для получения секрета из HashiCorp Vault ---
 def get_secret_from_vault(vault_addr, token, secret_path, key):
@@ -49,12 +57,22 @@ else:
     TELEGRAM_TOKEN = os.environ.get('TELEGRAM_TOKEN', 'ВАШ_ТОКЕН_ТУТ')
 
 DB_PATH = 'config.db'
+# Порт health-сервера (/health, /metrics)
+HEALTH_PORT = int(os.environ.get('HEALTH_PORT', 8000))
 SELECT_PARAM, INPUT_VALUE = range(2)
 
 PARAMS = {
+    'profile': 'Профиль (polite / balanced / fast)',
     'user_agent': 'User-Agent',
     'download_delay': 'Задержка (DOWNLOAD_DELAY)',
+    'concurrency_per_domain': 'Потоков на домен',
+    'autothrottle_target': 'AutoThrottle (целевая параллельность)',
+    'httpcache': 'HTTP-кэш (on / off)',
+    'incremental': 'Только новое (on / off)',
     'proxy': 'Прокси',
+    'seeds': 'Стартовые URL',
+    'max_depth': 'Глубина переходов по ссылкам',
+    'max_items': 'Лимит элементов',
 }
 
 # --- Главное меню ---
@@ -71,48 +89,12 @@ back_keyboard = ReplyKeyboardMarkup(
     [[KeyboardButton('⬅️ В главное меню')]], resize_keyboard=True
 )
 
-# --- Инициализация базы данных ---
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS configs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            param TEXT,
-            value TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def save_param(user_id, param, value):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id FROM configs WHERE user_id=? AND param=?', (user_id, param))
-    row = cursor.fetchone()
-    if row:
-        cursor.execute('UPDATE configs SET value=? WHERE id=?', (value, row[0]))
-    else:
-        cursor.execute('INSERT INTO configs (user_id, param, value) VALUES (?, ?, ?)', (user_id, param, value))
-    conn.commit()
-    conn.close()
-
-def get_param(user_id, param):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT value FROM configs WHERE user_id=? AND param=?', (user_id, param))
-    row = cursor.fetchone()
-    conn.close()
-    return row[0] if row else None
-
-def get_all_params(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT param, value FROM configs WHERE user_id=?', (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return {param: value for param, value in rows}
+# --- Очередь задач сбора данных ---
+crawl_scheduler = CrawlScheduler()
+crawler_service = CrawlerService()
+
+# --- Хранилище параметров пользователей ---
+config_store = ConfigStore(DB_PATH)
 
 # --- Обработчики ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -137,7 +119,7 @@ async def about(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def my_params(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    params = get_all_params(user_id)
+    params = await config_store.get_all(user_id)
     if not params:
         text = 'У вас пока нет сохранённых параметров.'
     else:
@@ -145,6 +127,7 @@ async def my_params(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for key, name in PARAMS.items():
             value = params.get(key, '—')
             text += f'<b>{name}:</b> {value}\n'
+        text += f'\n<b>Итоговые настройки:</b> {describe(build_settings(params))}'
     await update.message.reply_text(text, parse_mode='HTML', reply_markup=main_menu_keyboard)
 
 # --- Диалог настройки параметров ---
@@ -169,48 +152,88 @@ async def select_param(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await main_menu(query, context)
         return ConversationHandler.END
     context.user_data['param_key'] = param_key
-    await query.edit_message_text(f'Введите новое значение для "{PARAMS[param_key]}":', reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton('⬅️ В главное меню', callback_data='back_to_menu')]]))
+    await query.edit_message_text(f'Введите новое значение для "{PARAMS[param_key]}" ({PARAM_HINTS[param_key]}):', reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton('⬅️ В главное меню', callback_data='back_to_menu')]]))
     return INPUT_VALUE
 
+@instrument()
 async def input_value(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     param_key = context.user_data.get('param_key')
-    value = update.message.text.strip()
-    save_param(user_id, param_key, value)
+    try:
+        value = validate_param(param_key, update.message.text)
+    except ProfileError as e:
+        await update.message.reply_text(f'⚠️ Некорректное значение: {e}. Попробуйте ещё раз:')
+        return INPUT_VALUE
+    await config_store.set(user_id, param_key, value)
     await update.message.reply_text(f'Параметр "{PARAMS[param_key]}" сохранён!', reply_markup=main_menu_keyboard)
     return ConversationHandler.END
 
 # --- Запуск Scrapy ---
+@instrument()
 async def run_scrapy(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ставит задачу сбора данных в очередь и сразу отвечает пользователю."""
     user_id = update.effective_user.id
-    await update.message.reply_text('⏳ Запускаю Scrapy... Пожалуйста, подождите.', reply_markup=ReplyKeyboardRemove())
-    output_file = f'result_{user_id}.json'
-    user_agent = get_param(user_id, 'user_agent')
-    download_delay = get_param(user_id, 'download_delay')
-    proxy = get_param(user_id, 'proxy')
-    cmd = [
-        'python', '-m', 'scrapy', 'crawl', 'example',
-        '-o', output_file
-    ]
-    env = os.environ.copy()
-    if user_agent:
-        env['SCRAPY_USER_AGENT'] = user_agent
-    if download_delay:
-        env['SCRAPY_DOWNLOAD_DELAY'] = download_delay
-    if proxy:
-        env['SCRAPY_PROXY'] = proxy
+    params = await config_store.get_all(user_id)
+    try:
+        job = crawl_scheduler.submit(user_id, update.effective_chat.id, params)
+    except DuplicateJobError as e:
+        await update.message.reply_text(f'⚠️ {e}. Дождитесь её завершения.', reply_markup=main_menu_keyboard)
+        return
+    except QueueFullError as e:
+        await update.message.reply_text(f'⚠️ {e}.', reply_markup=main_menu_keyboard)
+        return
+    position = crawl_scheduler.position(job)
+    await update.message.reply_text(
+        f'⏳ Задача #{job.job_id} поставлена в очередь (позиция: {position}, '
+        f'выполняется: {crawl_scheduler.running}/{crawl_scheduler.workers}).',
+        reply_markup=main_menu_keyboard
+    )
+
+def crawl_overrides(params):
+    """Преобразует параметры пользователя в переопределения настроек Scrapy (профиль + параметры)."""
+    return build_settings(params)
+
+def format_batch(job_id, first, items):
+    """Формирует текст сообщения с пачкой собранных элементов."""
+    lines = [f'📦 Задача #{job_id}: элементы {first}–{first + len(items) - 1}']
+    for item in items:
+        lines.append(f'• {item.get("title") or "—"}')
+    text = '\n'.join(lines)
+    # Ограничение Telegram на длину сообщения — 4096 символов
+    return text if len(text) <= 4000 else text[:3997] + '...'
+
+@instrument('crawl_job')
+async def execute_crawl(bot, job: CrawlJob):
+    """Выполняет задачу сбора данных в сервисе Scrapy и присылает результаты по мере сбора."""
+    # Уникальный файл на каждую задачу: параллельные сборы не перезаписывают друг друга
+    fd, output_file = tempfile.mkstemp(prefix=f'result_{job.user_id}_{job.job_id}_', suffix='.jsonl.gz')
+    os.close(fd)
+    overrides = crawl_overrides(job.params)
+    overrides['STREAM_EXPORT_PATH'] = output_file
+    # Индекс инкрементального сбора ведётся отдельно для каждого пользователя
+    overrides['INCREMENTAL_SCOPE'] = str(job.user_id)
+    spider_kwargs = spider_arguments(job.params)
+    await bot.send_message(job.chat_id, f'🚀 Задача #{job.job_id} запущена: {describe(overrides)}.')
+    items = 0
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd=os.getcwd(), env=env)
-        if result.returncode == 0:
-            await update.message.reply_text('✅ Сбор данных завершён! Отправляю файл...', reply_markup=main_menu_keyboard)
-            with open(output_file, 'rb') as f:
-                await update.message.reply_document(document=InputFile(f, filename=output_file))
+        async for kind, payload in crawler_service.crawl(job.job_id, 'example', overrides, **spider_kwargs):
+            if kind == 'batch':
+                await bot.send_message(job.chat_id, format_batch(job.job_id, items + 1, payload))
+                items += len(payload)
+        elapsed = int(time.monotonic() - job.started_at)
+        if not items:
+            await bot.send_message(job.chat_id, f'✅ Задача #{job.job_id} завершена за {elapsed} сек, элементов не найдено.', reply_markup=main_menu_keyboard)
+            return
+        await bot.send_message(job.chat_id, f'✅ Задача #{job.job_id} завершена за {elapsed} сек, элементов: {items}. Отправляю файл...', reply_markup=main_menu_keyboard)
+        with open(output_file, 'rb') as f:
+            await bot.send_document(job.chat_id, document=InputFile(f, filename=f'result_{job.job_id}.jsonl.gz'))
+    except CrawlerServiceError as e:
+        await bot.send_message(job.chat_id, f'❌ Задача #{job.job_id}: ошибка при запуске Scrapy!', reply_markup=main_menu_keyboard)
+        await bot.send_message(job.chat_id, str(e)[-4000:])
+        raise
+    finally:
+        if os.path.exists(output_file):
             os.remove(output_file)
-        else:
-            await update.message.reply_text('❌ Произошла ошибка при запуске Scrapy!', reply_markup=main_menu_keyboard)
-            await update.message.reply_text(result.stderr, reply_markup=main_menu_keyboard)
-    except Exception as e:
-        await update.message.reply_text(f'Ошибка: {e}', reply_markup=main_menu_keyboard)
 
 # --- Обработка текстовых кнопок главного меню ---
 async def handle_menu_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -228,10 +251,22 @@ async def handle_menu_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
     else:
         await update.message.reply_text('Пожалуйста, используйте кнопки меню.', reply_markup=main_menu_keyboard)
 
+# --- Запуск и остановка воркеров вместе с приложением ---
+async def post_init(app):
+    health.serve_in_background(port=HEALTH_PORT)
+    start_loop_monitor()
+    await config_store.init()
+    crawler_service.start()
+    crawl_scheduler.start(functools.partial(execute_crawl, app.bot))
+
+async def post_shutdown(app):
+    await crawl_scheduler.stop()
+    crawler_service.stop()
+    await config_store.close()
+
 # --- Основная функция ---
 async def main():
-    init_db()
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    app = ApplicationBuilder().token(TELEGRAM_TOKEN).post_init(post_init).post_shutdown(post_shutdown).build()
     app.add_handler(CommandHandler('start', start))
     app.add_handler(CommandHandler('menu', main_menu))
     app.add_handler(CommandHandler('about', about))
@@ -250,5 +285,4 @@ async def main():
     await app.run_polling()
 
 if __name__ == '__main__':
-    import asyncio
     asyncio.run(main()) 
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""
+Хранилище пользовательских параметров Scrapy-бота.
+
+Одно постоянное соединение SQLite в режиме WAL обслуживается выделенным
+потоком, поэтому запросы к базе не блокируют event loop. Параметры
+пользователя читаются одним запросом и кэшируются в памяти; запись
+сбрасывает кэш этого пользователя.
+"""
+import asyncio  # Для выполнения запросов вне event loop
+import sqlite3  # Для работы с SQLite
+from collections import OrderedDict  # Для LRU-кэша
+from concurrent.futures import ThreadPoolExecutor  # Для выделенного потока базы
+
+
+class ConfigStore:
+    """
+    Репозиторий параметров пользователей (таблица configs).
+    path: путь к файлу базы SQLite.
+    cache_size: сколько пользователей держать в кэше.
+    """
+
+    def __init__(self, path, cache_size=10000):
+        self.path = path
+        self.cache_size = cache_size
+        self._conn = None
+        self._cache = OrderedDict()  # user_id -> {param: value}
+        # Один поток: соединение SQLite используется строго последовательно
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='config-db')
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # --- Операции, выполняемые в потоке базы ---
+    def _init_db(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS configs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                param TEXT,
+                value TEXT
+            )
+        ''')
+        # В старых базах могли остаться дубликаты: оставляем последнюю запись,
+        # иначе уникальный индекс не создастся
+        conn.execute('''
+            DELETE FROM configs WHERE id NOT IN (
+                SELECT MAX(id) FROM configs GROUP BY user_id, param
+            )
+        ''')
+        conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_configs_user_param ON configs (user_id, param)')
+        conn.commit()
+        self._conn = conn
+
+    def _load_user(self, user_id):
+        rows = self._conn.execute('SELECT param, value FROM configs WHERE user_id=?', (user_id,)).fetchall()
+        return {param: value for param, value in rows}
+
+    def _save(self, user_id, param, value):
+        self._conn.execute(
+            'INSERT INTO configs (user_id, param, value) VALUES (?, ?, ?) '
+            'ON CONFLICT (user_id, param) DO UPDATE SET value=excluded.value',
+            (user_id, param, value)
+        )
+        self._conn.commit()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # --- Асинхронный интерфейс для обработчиков ---
+    async def init(self):
+        """Открывает соединение и создаёт таблицу и индексы."""
+        await self._run(self._init_db)
+
+    async def get_all(self, user_id):
+        """Возвращает все параметры пользователя (копию словаря)."""
+        params = self._cache.get(user_id)
+        if params is None:
+            params = await self._run(self._load_user, user_id)
+            self._cache[user_id] = params
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(user_id)
+        return dict(params)
+
+    async def get(self, user_id, param):
+        """Возвращает значение одного параметра или None."""
+        return (await self.get_all(user_id)).get(param)
+
+    async def set(self, user_id, param, value):
+        """Сохраняет параметр (UPSERT) и сбрасывает кэш пользователя."""
+        await self._run(self._save, user_id, param, value)
+        self._cache.pop(user_id, None)
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
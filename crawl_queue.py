@@ -0,0 +1,138 @@
+"""
+Очередь задач сбора данных для Scrapy-бота.
+
+Задачи складываются в asyncio.Queue и выполняются ограниченным пулом
+воркеров, поэтому один долгий сбор не блокирует обработку сообщений
+остальных пользователей. У каждого пользователя может быть не больше
+одной задачи в очереди или в работе.
+"""
+import asyncio  # Для очереди и воркеров
+import itertools  # Для генерации номеров задач
+import logging  # Для логирования событий
+import os  # Для чтения переменных окружения
+import time  # Для учёта времени выполнения
+from dataclasses import dataclass, field
+
+# Количество одновременно выполняемых сборов (настраивается на каждом хосте)
+CRAWL_WORKERS = int(os.environ.get('CRAWL_WORKERS', os.cpu_count() or 2))
+# Максимальная длина очереди ожидающих задач
+CRAWL_QUEUE_SIZE = int(os.environ.get('CRAWL_QUEUE_SIZE', 100))
+
+logger = logging.getLogger(__name__)
+
+
+class DuplicateJobError(Exception):
+    """У пользователя уже есть задача в очереди или в работе."""
+
+    def __init__(self, job):
+        super().__init__(f'Задача #{job.job_id} уже {job.status_text}')
+        self.job = job
+
+
+class QueueFullError(Exception):
+    """Очередь задач переполнена."""
+
+
+@dataclass
+class CrawlJob:
+    job_id: int
+    user_id: int
+    chat_id: int
+    params: dict = field(default_factory=dict)
+    status: str = 'queued'  # queued -> running -> done | failed
+    created_at: float = field(default_factory=time.monotonic)
+    started_at: float | None = None
+    finished_at: float | None = None
+
+    @property
+    def status_text(self):
+        return {
+            'queued': 'в очереди',
+            'running': 'выполняется',
+            'done': 'завершена',
+            'failed': 'завершилась с ошибкой',
+        }.get(self.status, self.status)
+
+
+class CrawlScheduler:
+    """
+    Планировщик задач сбора данных.
+    workers: количество одновременно работающих воркеров.
+    max_queue: ограничение длины очереди.
+    """
+
+    def __init__(self, workers=CRAWL_WORKERS, max_queue=CRAWL_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._active = {}  # user_id -> CrawlJob
+        self._ids = itertools.count(1)
+        self._tasks = []
+        self._runner = None
+
+    def start(self, runner):
+        """
+        Запускает воркеры. Вызывается из работающего event loop.
+        runner: корутина runner(job), выполняющая одну задачу.
+        """
+        self._runner = runner
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i), name=f'crawl-worker-{i}'))
+        logger.info('Запущено воркеров сбора данных: %s', self.workers)
+
+    async def stop(self):
+        """Останавливает воркеры; выполняющиеся задачи отменяются."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def submit(self, user_id, chat_id, params=None):
+        """
+        Ставит задачу в очередь и возвращает её.
+        Бросает DuplicateJobError, если у пользователя уже есть активная задача,
+        и QueueFullError, если очередь заполнена.
+        """
+        current = self._active.get(user_id)
+        if current is not None:
+            raise DuplicateJobError(current)
+        job = CrawlJob(job_id=next(self._ids), user_id=user_id, chat_id=chat_id, params=params or {})
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError('Очередь задач переполнена, попробуйте позже') from None
+        self._active[user_id] = job
+        return job
+
+    def get_job(self, user_id):
+        """Возвращает активную задачу пользователя или None."""
+        return self._active.get(user_id)
+
+    def position(self, job):
+        """Позиция задачи в очереди (1 — следующая), 0 — если уже выполняется."""
+        if job.status != 'queued':
+            return 0
+        queued = [j for j in self._active.values() if j.status == 'queued']
+        return sum(1 for j in queued if j.job_id <= job.job_id)
+
+    @property
+    def running(self):
+        return sum(1 for j in self._active.values() if j.status == 'running')
+
+    async def _worker(self, index):
+        while True:
+            job = await self._queue.get()
+            job.status = 'running'
+            job.started_at = time.monotonic()
+            try:
+                await self._runner(job)
+                job.status = 'done'
+            except asyncio.CancelledError:
+                job.status = 'failed'
+                raise
+            except Exception:
+                job.status = 'failed'
+                logger.exception('Воркер %s: ошибка при выполнении задачи #%s', index, job.job_id)
+            finally:
+                job.finished_at = time.monotonic()
+                self._active.pop(job.user_id, None)
+                self._queue.task_done()
@@ -0,0 +1,240 @@
+"""
+Долгоживущий сервис Scrapy для бота.
+
+Scrapy, Twisted и настройки проекта загружаются один раз в отдельном
+процессе, где постоянно работает реактор с CrawlerRunner. Бот отправляет
+туда задачи (имя паука + переопределения настроек пользователя) и получает
+обратно поток событий: пачки собранных элементов, итоговую статистику или ошибку.
+Так каждый новый сбор начинается без запуска интерпретатора и импорта Scrapy.
+"""
+import asyncio  # Для доставки событий в event loop бота
+import logging  # Для логирования событий
+import multiprocessing  # Для отдельного процесса с реактором
+import os  # Для переменных окружения
+import queue  # Для таймаутов при чтении событий
+import threading  # Для потоков-читателей очередей
+
+# Модуль настроек Scrapy-проекта (scrapy.cfg в репозитории нет)
+SCRAPY_SETTINGS_MODULE = os.environ.get('SCRAPY_SETTINGS_MODULE', 'scrapy_project.settings')
+# Middleware, которая применяет прокси пользователя (настройка PROXY)
+PROXY_MIDDLEWARE = 'scrapy_project.middlewares.ProxyPoolMiddleware'
+
+logger = logging.getLogger(__name__)
+
+
+# --- Код, выполняющийся в процессе сервиса ---
+def _to_plain(value):
+    """Приводит значения статистики к типам, которые можно безопасно передать между процессами."""
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def _worker_main(jobs, events):
+    """Точка входа процесса сервиса: поднимает реактор и выполняет задачи из очереди."""
+    os.environ.setdefault('SCRAPY_SETTINGS_MODULE', SCRAPY_SETTINGS_MODULE)
+    from scrapy.crawler import Crawler, CrawlerRunner
+    from scrapy.utils.log import configure_logging
+    from scrapy.utils.project import get_project_settings
+    from scrapy.utils.reactor import install_reactor
+    from scrapy_project.pipelines import batch_ready
+
+    settings = get_project_settings()
+    configure_logging(settings)
+    if settings.get('TWISTED_REACTOR'):
+        install_reactor(settings['TWISTED_REACTOR'])
+    from twisted.internet import reactor
+
+    runner = CrawlerRunner(settings)
+    crawlers = {}  # job_id -> Crawler
+
+    def start_crawl(job_id, spider_name, overrides, spider_kwargs):
+        try:
+            job_settings = settings.copy()
+            job_settings.setdict(overrides or {}, priority='cmdline')
+            # Прокси пользователя применяет ProxyPoolMiddleware: без неё сбор шёл бы
+            # напрямую, молча игнорируя прокси, поэтому такую задачу не запускаем
+            middlewares = job_settings.getwithbase('DOWNLOADER_MIDDLEWARES')
+            if job_settings.get('PROXY') and not middlewares.get(PROXY_MIDDLEWARE):
+                raise RuntimeError(f'прокси задан, но {PROXY_MIDDLEWARE} отключена')
+            crawler = Crawler(runner.spider_loader.load(spider_name), job_settings)
+        except Exception as e:
+            events.put(('error', job_id, f'{type(e).__name__}: {e}'))
+            return
+
+        def on_batch(items, spider):
+            events.put(('batch', job_id, items))
+
+        # weak=False: иначе локальный обработчик будет удалён сборщиком мусора
+        crawler.signals.connect(on_batch, signal=batch_ready, weak=False)
+        crawlers[job_id] = crawler
+
+        def on_done(_):
+            stats = {k: _to_plain(v) for k, v in (crawler.stats.get_stats() or {}).items()}
+            events.put(('done', job_id, stats))
+
+        def on_error(failure):
+            events.put(('error', job_id, failure.getErrorMessage()))
+
+        d = runner.crawl(crawler, **(spider_kwargs or {}))
+        d.addCallbacks(on_done, on_error)
+        d.addBoth(lambda _: crawlers.pop(job_id, None))
+
+    def stop_crawl(job_id):
+        crawler = crawlers.get(job_id)
+        if crawler is not None:
+            crawler.stop()
+
+    def read_jobs():
+        while True:
+            message = jobs.get()
+            if message is None:
+                reactor.callFromThread(reactor.stop)
+                return
+            command, *args = message
+            if command == 'crawl':
+                reactor.callFromThread(start_crawl, *args)
+            elif command == 'stop':
+                reactor.callFromThread(stop_crawl, *args)
+
+    threading.Thread(target=read_jobs, name='crawler-jobs', daemon=True).start()
+    reactor.callWhenRunning(events.put, ('ready', None, None))
+    reactor.run(installSignalHandlers=False)
+
+
+# --- Клиент сервиса в процессе бота ---
+class CrawlerServiceError(Exception):
+    """Сбор данных завершился ошибкой или процесс сервиса упал."""
+
+
+class CrawlerService:
+    """
+    Управляет процессом сервиса Scrapy и раздаёт события по задачам.
+    Процесс запускается при start() и перезапускается, если он упал.
+    """
+
+    def __init__(self):
+        self._ctx = multiprocessing.get_context('spawn')
+        self._process = None
+        self._jobs = None
+        self._events = None
+        self._streams = {}  # job_id -> (процесс сервиса, asyncio.Queue)
+        self._loop = None
+        self._ready = None
+        self._reader = None
+        self._reader_stop = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Запускает процесс сервиса. Вызывается из работающего event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._spawn()
+
+    def _spawn(self):
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                return
+            self._jobs = self._ctx.Queue()
+            self._events = self._ctx.Queue()
+            self._ready = self._loop.create_future()
+            self._process = self._ctx.Process(
+                target=_worker_main, args=(self._jobs, self._events),
+                name='crawler-service', daemon=True
+            )
+            self._process.start()
+            # Читатель привязан к своему процессу: после перезапуска старый
+            # читатель сообщает только о своём процессе и его задачах
+            self._reader_stop = threading.Event()
+            self._reader = threading.Thread(
+                target=self._read_events, args=(self._process, self._events, self._ready, self._reader_stop),
+                name='crawler-events', daemon=True
+            )
+            self._reader.start()
+            logger.info('Процесс сервиса Scrapy запущен (pid %s)', self._process.pid)
+
+    def stop(self):
+        """Останавливает процесс сервиса и поток-читатель его событий."""
+        process = self._process
+        if process is None:
+            return
+        self._reader_stop.set()
+        if process.is_alive():
+            self._jobs.put(None)
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._reader.join(timeout=2)
+        self._process = None
+        self._fail(process, self._ready, 'сервис Scrapy остановлен')
+
+    def _post(self, callback, *args):
+        """Передаёт вызов в event loop; False, если loop уже закрыт."""
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+            return True
+        except RuntimeError:
+            return False
+
+    def _read_events(self, process, events, ready, stop):
+        """Поток-читатель: переносит события процесса сервиса в event loop."""
+        while not stop.is_set():
+            try:
+                kind, job_id, payload = events.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    if not stop.is_set():
+                        self._post(self._on_crash, process, ready, process.exitcode)
+                    return
+                continue
+            if not self._post(self._dispatch, ready, kind, job_id, payload):
+                return
+
+    def _dispatch(self, ready, kind, job_id, payload):
+        if kind == 'ready':
+            if not ready.done():
+                ready.set_result(True)
+            return
+        entry = self._streams.get(job_id)
+        if entry is not None:
+            entry[1].put_nowait((kind, payload))
+
+    def _on_crash(self, process, ready, exitcode):
+        logger.error('Процесс сервиса Scrapy завершился (код %s)', exitcode)
+        self._fail(process, ready, f'процесс сервиса Scrapy упал (код {exitcode})')
+
+    def _fail(self, process, ready, message):
+        """Завершает ошибкой ожидание запуска и задачи указанного процесса; задачи нового процесса не трогает."""
+        if not ready.done():
+            ready.set_exception(CrawlerServiceError(message))
+        for owner, stream in self._streams.values():
+            if owner is process:
+                stream.put_nowait(('error', message))
+
+    async def crawl(self, job_id, spider_name, overrides=None, **spider_kwargs):
+        """
+        Запускает паука и асинхронно отдаёт события задачи:
+        ('batch', [dict, ...]) для каждой пачки элементов и ('done', stats) в конце.
+        При ошибке бросает CrawlerServiceError.
+        """
+        if self._process is None or not self._process.is_alive():
+            self._spawn()
+        process, jobs, ready = self._process, self._jobs, self._ready
+        await ready
+        if not process.is_alive():
+            raise CrawlerServiceError(f'процесс сервиса Scrapy упал (код {process.exitcode})')
+        stream = asyncio.Queue()
+        self._streams[job_id] = (process, stream)
+        jobs.put(('crawl', job_id, spider_name, overrides or {}, spider_kwargs))
+        try:
+            while True:
+                kind, payload = await stream.get()
+                if kind == 'error':
+                    raise CrawlerServiceError(payload)
+                yield kind, payload
+                if kind == 'done':
+                    return
+        finally:
+            self._streams.pop(job_id, None)
+            if process.is_alive():
+                # Если потребитель прервал чтение раньше времени, останавливаем паука
+                jobs.put(('stop', job_id))
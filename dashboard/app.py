@@ -1,9 +1,12 @@
 import os
 import asyncio
+import json
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-import httpx
+from collector import HealthCollector
+from timeseries import TimeSeriesStore
 
 def get_secret(path, default=None):
     try:
@@ -19,38 +22,70 @@ SERVICES = {
     'scrapy-bot': os.environ.get('SCRAPY_BOT_URL', 'http://scrapy-bot:8000/health'),
     'kafka-bot': os.environ.get('KAFKA_BOT_URL', 'http://kafka-bot:8000/health'),
     'ai-bot': os.environ.get('AI_BOT_URL', 'http://ai-bot:8000/health'),
-    'wp-publisher': os.environ.get('WP_PUBLISHER_URL', 'http://wp-publisher:8081/docs'),
+    'wp-publisher': os.environ.get('WP_PUBLISHER_URL', 'http://wp-publisher:8081/health'),
 }
 
-app = FastAPI()
+# Интервал пустых сообщений, которые держат SSE-соединение открытым через прокси
+SSE_KEEPALIVE = float(os.environ.get('SSE_KEEPALIVE', 15))
+
+# Фоновый сборщик: опрашивает сервисы по расписанию, страницы отдают готовый снимок
+series = TimeSeriesStore(SERVICES)
+collector = HealthCollector(SERVICES, series=series)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    series.load()
+    await collector.start()
+    yield
+    await collector.stop()
+    # Сохранение, начатое последним опросом, могло ещё идти в потоке: save() дождётся его
+    await asyncio.to_thread(series.save)
+    await asyncio.to_thread(series.close)
+
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
 
-# Асинхронно опрашиваем все сервисы
-async def get_statuses():
-    statuses = {}
-    async with httpx.AsyncClient(timeout=2) as client:
-        for name, url in SERVICES.items():
-            try:
-                resp = await client.get(url)
-                if resp.status_code == 200:
-                    data = resp.json() if resp.headers.get('content-type','').startswith('application/json') else {}
-                    statuses[name] = {
-                        'status': '🟢 OK',
-                        'uptime': data.get('uptime', '—'),
-                        'details': data.get('details', resp.text)
-                    }
-                else:
-                    statuses[name] = {'status': '🔴 DOWN', 'uptime': '—', 'details': f'HTTP {resp.status_code}'}
-            except Exception as e:
-                statuses[name] = {'status': '🔴 DOWN', 'uptime': '—', 'details': str(e)}
-    return statuses
+# Последние статусы всех сервисов (без сетевых запросов)
+def get_statuses():
+    return collector.statuses
 
 @app.get('/', response_class=HTMLResponse)
 async def dashboard(request: Request):
-    statuses = await get_statuses()
+    statuses = get_statuses()
     return templates.TemplateResponse('index.html', {"request": request, "statuses": statuses})
 
 @app.get('/api/status', response_class=JSONResponse)
 async def api_status():
-    statuses = await get_statuses()
-    return statuses 
\ No newline at end of file
+    statuses = get_statuses()
+    return statuses
+
+# Push-канал (Server-Sent Events): сначала полный снимок, затем только изменения статусов.
+# Все браузеры слушают один общий сборщик, поэтому число зрителей не влияет на нагрузку на сервисы.
+@app.get('/api/stream')
+async def api_stream(request: Request):
+    async def events():
+        queue = collector.subscribe()
+        try:
+            yield f"event: snapshot\ndata: {json.dumps(get_statuses(), ensure_ascii=False)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    delta = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: delta\ndata: {json.dumps(delta, ensure_ascii=False)}\n\n"
+        finally:
+            collector.unsubscribe(queue)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return StreamingResponse(events(), media_type='text/event-stream', headers=headers)
+
+# История последних проверок по каждому сервису
+@app.get('/api/history', response_class=JSONResponse)
+async def api_history():
+    return {name: list(items) for name, items in collector.history.items()}
+
+# Перцентили задержки и доступность за 5m/1h/24h и поминутные точки для графиков
+@app.get('/api/metrics', response_class=JSONResponse)
+async def api_metrics(minutes: int = 60):
+    return series.summary(chart_minutes=max(1, min(minutes, 24 * 60)))
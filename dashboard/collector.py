@@ -0,0 +1,136 @@
+"""
+Фоновый сборщик статусов сервисов для дашборда.
+
+Все сервисы опрашиваются одновременно раз в POLL_INTERVAL секунд общим
+HTTP-клиентом. Последний результат и кольцевой буфер истории по каждому
+сервису хранятся в памяти, а страницы и API отдают готовый снимок — время
+ответа не зависит от того, сколько сервисов недоступно и сколько людей
+смотрят дашборд.
+"""
+import asyncio  # Для параллельного опроса
+import logging  # Для логирования событий
+import os  # Для чтения переменных окружения
+import time  # Для отметок времени
+from collections import deque  # Кольцевой буфер истории
+import httpx
+
+# Интервал опроса сервисов в секундах
+POLL_INTERVAL = float(os.environ.get('POLL_INTERVAL', 5))
+# Таймаут одной проверки в секундах
+PROBE_TIMEOUT = float(os.environ.get('PROBE_TIMEOUT', 2))
+# Сколько последних проверок хранить по каждому сервису
+HISTORY_SIZE = int(os.environ.get('HISTORY_SIZE', 120))
+# Размер очереди обновлений одного подписчика (медленный клиент получит полный снимок)
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get('SUBSCRIBER_QUEUE_SIZE', 16))
+
+# Поля статуса, изменение которых рассылается подписчикам
+DELTA_FIELDS = ('status', 'uptime', 'details')
+
+logger = logging.getLogger(__name__)
+
+
+class HealthCollector:
+    """Опрашивает сервисы по расписанию и хранит последние результаты."""
+
+    def __init__(self, services, interval=POLL_INTERVAL, timeout=PROBE_TIMEOUT, history_size=HISTORY_SIZE,
+                 series=None):
+        self.services = services
+        self.series = series  # TimeSeriesStore для задержек и доступности (необязательно)
+        self.interval = interval
+        self.timeout = timeout
+        self.statuses = {name: {'status': '⏳ ...', 'uptime': '—', 'details': 'Ожидание первой проверки'} for name in services}
+        self.history = {name: deque(maxlen=history_size) for name in services}
+        self.updated_at = None
+        self._subscribers = set()
+        self._client = None
+        self._task = None
+
+    async def probe(self, name, url):
+        """Проверяет один сервис и возвращает его статус."""
+        started = time.perf_counter()
+        try:
+            resp = await self._client.get(url)
+            latency = time.perf_counter() - started
+            if resp.status_code == 200:
+                data = resp.json() if resp.headers.get('content-type', '').startswith('application/json') else {}
+                status = {
+                    'status': '🟢 OK',
+                    'uptime': data.get('uptime', '—'),
+                    'details': data.get('details', resp.text)
+                }
+            else:
+                status = {'status': '🔴 DOWN', 'uptime': '—', 'details': f'HTTP {resp.status_code}'}
+        except Exception as e:
+            latency = time.perf_counter() - started
+            status = {'status': '🔴 DOWN', 'uptime': '—', 'details': str(e) or type(e).__name__}
+        status['ok'] = status['status'] == '🟢 OK'
+        status['latency_ms'] = round(latency * 1000, 1)
+        status['checked_at'] = time.time()
+        return name, status
+
+    async def poll_once(self):
+        """Опрашивает все сервисы одновременно и обновляет снимок."""
+        results = await asyncio.gather(*(self.probe(name, url) for name, url in self.services.items()))
+        previous = self.statuses
+        statuses = dict(previous)
+        for name, status in results:
+            statuses[name] = status
+            self.history[name].append(status)
+            if self.series is not None:
+                self.series.add(name, status['checked_at'], status['latency_ms'], status['ok'])
+        # Снимок заменяется целиком: читатели никогда не видят его наполовину обновлённым
+        self.statuses = statuses
+        self.updated_at = time.time()
+        delta = {
+            name: status for name, status in statuses.items()
+            if any(status.get(f) != previous[name].get(f) for f in DELTA_FIELDS)
+        }
+        if delta:
+            self.publish(delta)
+        if self.series is not None:
+            await asyncio.to_thread(self.series.save)
+
+    # --- Подписки на изменения (для push-обновлений) ---
+    def subscribe(self):
+        """Регистрирует подписчика и возвращает его очередь обновлений."""
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    @property
+    def subscribers(self):
+        return len(self._subscribers)
+
+    def publish(self, delta):
+        """Рассылает изменившиеся статусы всем подписчикам без ожидания."""
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(delta)
+            except asyncio.QueueFull:
+                # Клиент не успевает: сбрасываем накопленное и отправляем полный снимок
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.statuses)
+
+    async def _loop(self):
+        while True:
+            started = time.monotonic()
+            try:
+                await self.poll_once()
+            except Exception:
+                logger.exception('Ошибка при опросе сервисов')
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    async def start(self):
+        self._client = httpx.AsyncClient(timeout=self.timeout)
+        self._task = asyncio.create_task(self._loop(), name='health-collector')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
@@ -0,0 +1,285 @@
+"""
+Временные ряды задержки и доступности сервисов для дашборда.
+
+Для каждого сервиса хранятся два кольцевых буфера фиксированного размера:
+- сырые проверки за последний час (время, задержка, успех) — по ним
+  считаются точные перцентили для окон 5m и 1h;
+- поминутные корзины за сутки: число проверок, число успешных и гистограмма
+  задержек по фиксированным границам — по ним считается окно 24h.
+Память не растёт со временем работы. Если задан METRICS_DB, минутные
+корзины после каждого опроса сохраняются в SQLite и подгружаются при перезапуске.
+"""
+import logging  # Для логирования событий
+import math  # Для интерполяции перцентилей
+import os  # Для чтения переменных окружения
+import sqlite3  # Для сохранения корзин между перезапусками
+import threading  # Для последовательных сохранений из разных потоков
+import time  # Для отметок времени
+from array import array  # Компактные массивы фиксированного размера
+
+# Путь к SQLite для сохранения поминутных корзин (пусто — только в памяти)
+METRICS_DB = os.environ.get('METRICS_DB', '')
+# Сколько сырых проверок хранить по каждому сервису (час при опросе раз в 5 секунд)
+RAW_SAMPLES = int(os.environ.get('METRICS_RAW_SAMPLES', 720))
+
+MINUTES = 24 * 60
+# Верхние границы корзин гистограммы задержек в миллисекундах
+LATENCY_BOUNDS = (5, 10, 25, 50, 75, 100, 150, 250, 400, 600, 1000, 1500, 2500, 4000, math.inf)
+# Окна для статистики (название: длительность в секундах)
+WINDOWS = {'5m': 300, '1h': 3600, '24h': 86400}
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(sorted_values, q):
+    """Перцентиль q (0..100) по отсортированному списку с линейной интерполяцией."""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * q / 100
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def histogram_percentile(counts, q):
+    """Перцентиль q по гистограмме: интерполяция внутри найденной корзины."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = total * q / 100
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= rank:
+            lower = LATENCY_BOUNDS[i - 1] if i else 0
+            upper = LATENCY_BOUNDS[i]
+            if math.isinf(upper):
+                return float(lower)
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return float(LATENCY_BOUNDS[-2])
+
+
+class ServiceSeries:
+    """Кольцевые буферы одного сервиса."""
+
+    def __init__(self, raw_size=RAW_SAMPLES):
+        self.raw_size = raw_size
+        self.raw_ts = array('d', [0.0]) * raw_size
+        self.raw_latency = array('f', [0.0]) * raw_size
+        self.raw_ok = array('b', [0]) * raw_size
+        self.raw_pos = 0
+        self.raw_count = 0
+
+        bins = len(LATENCY_BOUNDS)
+        self.minute_id = array('q', [-1]) * MINUTES  # Номер минуты, которой принадлежит слот
+        self.minute_total = array('q', [0]) * MINUTES
+        self.minute_ok = array('q', [0]) * MINUTES
+        self.minute_hist = array('q', [0]) * (MINUTES * bins)
+        self.dirty = set()  # Минуты, изменённые после последнего сохранения
+
+    def _slot(self, minute):
+        """Слот корзины для минуты; устаревший слот очищается."""
+        slot = minute % MINUTES
+        if self.minute_id[slot] != minute:
+            bins = len(LATENCY_BOUNDS)
+            self.minute_id[slot] = minute
+            self.minute_total[slot] = 0
+            self.minute_ok[slot] = 0
+            for i in range(slot * bins, (slot + 1) * bins):
+                self.minute_hist[i] = 0
+        return slot
+
+    def add(self, ts, latency_ms, ok):
+        pos = self.raw_pos
+        self.raw_ts[pos] = ts
+        self.raw_latency[pos] = latency_ms
+        self.raw_ok[pos] = 1 if ok else 0
+        self.raw_pos = (pos + 1) % self.raw_size
+        self.raw_count = min(self.raw_count + 1, self.raw_size)
+
+        minute = int(ts // 60)
+        slot = self._slot(minute)
+        self.minute_total[slot] += 1
+        if ok:
+            self.minute_ok[slot] += 1
+            bin_index = next(i for i, bound in enumerate(LATENCY_BOUNDS) if latency_ms <= bound)
+            self.minute_hist[slot * len(LATENCY_BOUNDS) + bin_index] += 1
+        self.dirty.add(minute)
+
+    def raw_since(self, since):
+        """Сырые проверки новее since: списки задержек успешных проверок и число успешных/всех."""
+        latencies, ok, total = [], 0, 0
+        for i in range(self.raw_count):
+            if self.raw_ts[i] >= since:
+                total += 1
+                if self.raw_ok[i]:
+                    ok += 1
+                    latencies.append(self.raw_latency[i])
+        return latencies, ok, total
+
+    def minutes_since(self, since_minute):
+        """Суммарная гистограмма и счётчики по минутным корзинам начиная с since_minute."""
+        bins = len(LATENCY_BOUNDS)
+        hist, ok, total = [0] * bins, 0, 0
+        for slot in range(MINUTES):
+            if self.minute_id[slot] >= since_minute:
+                total += self.minute_total[slot]
+                ok += self.minute_ok[slot]
+                base = slot * bins
+                for i in range(bins):
+                    hist[i] += self.minute_hist[base + i]
+        return hist, ok, total
+
+    def minute_row(self, minute):
+        slot = minute % MINUTES
+        if self.minute_id[slot] != minute:
+            return None
+        bins = len(LATENCY_BOUNDS)
+        return (self.minute_total[slot], self.minute_ok[slot],
+                self.minute_hist[slot * bins:(slot + 1) * bins].tobytes())
+
+    def load_minute(self, minute, total, ok, hist):
+        slot = self._slot(minute)
+        bins = len(LATENCY_BOUNDS)
+        self.minute_total[slot] = total
+        self.minute_ok[slot] = ok
+        values = array('q')
+        values.frombytes(hist)
+        self.minute_hist[slot * bins:(slot + 1) * bins] = values[:bins]
+
+
+class TimeSeriesStore:
+    """Временные ряды всех сервисов с расчётом перцентилей и доступности."""
+
+    def __init__(self, services, db_path=METRICS_DB, raw_size=RAW_SAMPLES):
+        self.series = {name: ServiceSeries(raw_size) for name in services}
+        self.db_path = db_path
+        self._conn = None
+        # save() вызывается из пула потоков и при остановке: сохранения и закрытие идут по очереди
+        self._save_lock = threading.Lock()
+        # Кэш summary(): пересчёт только после новых проверок (или смены минуты)
+        self._version = 0
+        self._summaries = {}  # (chart_minutes, версия, минута) -> результат
+
+    # --- Сохранение в SQLite ---
+    def load(self):
+        """Открывает базу и подгружает корзины за последние сутки."""
+        if not self.db_path:
+            return
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS minute_buckets (
+                service TEXT NOT NULL,
+                minute INTEGER NOT NULL,
+                total INTEGER NOT NULL,
+                ok INTEGER NOT NULL,
+                hist BLOB NOT NULL,
+                PRIMARY KEY (service, minute)
+            )
+        ''')
+        since = int(time.time() // 60) - MINUTES + 1
+        self._conn.execute('DELETE FROM minute_buckets WHERE minute < ?', (since,))
+        self._conn.commit()
+        rows = self._conn.execute(
+            'SELECT service, minute, total, ok, hist FROM minute_buckets WHERE minute >= ?', (since,)
+        ).fetchall()
+        for service, minute, total, ok, hist in rows:
+            if service in self.series:
+                self.series[service].load_minute(minute, total, ok, hist)
+        logger.info('Загружено %d минутных корзин из %s', len(rows), self.db_path)
+
+    def save(self):
+        """Сохраняет изменённые корзины (блокирующая функция; ждёт начатого сохранения)."""
+        with self._save_lock:
+            if self._conn is None:
+                return
+            rows = []
+            for name, series in self.series.items():
+                # Множество подменяется целиком: опрос в event loop дописывает минуты уже в новое
+                dirty, series.dirty = series.dirty, set()
+                for minute in dirty:
+                    row = series.minute_row(minute)
+                    if row is not None:
+                        rows.append((name, minute, *row))
+            if not rows:
+                return
+            self._conn.executemany('''
+                INSERT INTO minute_buckets (service, minute, total, ok, hist) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(service, minute) DO UPDATE SET total = excluded.total, ok = excluded.ok, hist = excluded.hist
+            ''', rows)
+            self._conn.execute('DELETE FROM minute_buckets WHERE minute < ?', (int(time.time() // 60) - MINUTES + 1,))
+            self._conn.commit()
+
+    def close(self):
+        with self._save_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # --- Запись и расчёт ---
+    def add(self, name, ts, latency_ms, ok):
+        self.series[name].add(ts, latency_ms, ok)
+        self._version += 1
+
+    def window_stats(self, name, seconds, now=None):
+        """p50/p95/p99 (мс) и доступность (%) сервиса за окно."""
+        series = self.series[name]
+        now = now or time.time()
+        if seconds <= 3600:
+            latencies, ok, total = series.raw_since(now - seconds)
+            latencies.sort()
+            p = {q: percentile(latencies, q) for q in (50, 95, 99)}
+        else:
+            hist, ok, total = series.minutes_since(int((now - seconds) // 60) + 1)
+            p = {q: histogram_percentile(hist, q) for q in (50, 95, 99)}
+        return {
+            'p50': round(p[50], 1) if p[50] is not None else None,
+            'p95': round(p[95], 1) if p[95] is not None else None,
+            'p99': round(p[99], 1) if p[99] is not None else None,
+            'availability': round(100 * ok / total, 2) if total else None,
+            'samples': total,
+        }
+
+    def chart(self, name, minutes=60, now=None):
+        """Поминутные точки для графика: метка времени, p95 и доступность."""
+        series = self.series[name]
+        current = int((now or time.time()) // 60)
+        bins = len(LATENCY_BOUNDS)
+        points = []
+        for minute in range(current - minutes + 1, current + 1):
+            slot = minute % MINUTES
+            if series.minute_id[slot] != minute or not series.minute_total[slot]:
+                points.append({'t': minute * 60, 'p95': None, 'availability': None})
+                continue
+            hist = series.minute_hist[slot * bins:(slot + 1) * bins].tolist()
+            p95 = histogram_percentile(hist, 95)
+            points.append({
+                't': minute * 60,
+                'p95': round(p95, 1) if p95 is not None else None,
+                'availability': round(100 * series.minute_ok[slot] / series.minute_total[slot], 2),
+            })
+        return points
+
+    def summary(self, chart_minutes=60):
+        """
+        Статистика и графики всех сервисов. Результат кэшируется до следующего
+        опроса: сколько бы клиентов ни открыло дашборд, сортировка и перцентили
+        считаются один раз за интервал опроса на каждое значение chart_minutes.
+        """
+        now = time.time()
+        key = (chart_minutes, self._version, int(now // 60))
+        cached = self._summaries.get(key)
+        if cached is None:
+            if any(k[1:] != key[1:] for k in self._summaries):
+                self._summaries.clear()  # Данные изменились: старые результаты не нужны
+            cached = self._summaries[key] = self._compute_summary(chart_minutes, now)
+        return cached
+
+    def _compute_summary(self, chart_minutes, now):
+        return {
+            name: {
+                'windows': {label: self.window_stats(name, seconds, now) for label, seconds in WINDOWS.items()},
+                'chart': self.chart(name, chart_minutes, now),
+            }
+            for name in self.series
+        }
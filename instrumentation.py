@@ -0,0 +1,134 @@
+"""
+Метрики сервиса в формате Prometheus.
+
+Общий модуль для всех сервисов: единственная копия лежит в корне репозитория,
+Dockerfile сервисов копируют его в образ. Считает вызовы и время выполнения обработчиков, задержки и
+ошибки исходящих вызовов (LLM, Kafka, WordPress, Scrapy) и задержку
+event loop. Метрики отдаются health-сервером на /metrics, поэтому
+health-сервер должен работать в том же процессе, что и бот.
+"""
+import asyncio  # Для измерения задержки event loop
+import functools  # Для декораторов
+import logging  # Для логирования событий
+import os  # Для чтения переменных окружения
+import time  # Для замеров времени
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Как часто проверять задержку event loop (секунды)
+LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL', 0.5))
+
+# Границы гистограмм задержки в секундах: от быстрых обработчиков до генерации и сбора
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+HANDLER_CALLS = Counter('bot_handler_calls_total', 'Вызовы обработчиков', ['handler', 'outcome'])
+HANDLER_LATENCY = Histogram('bot_handler_latency_seconds', 'Время выполнения обработчиков',
+                            ['handler'], buckets=LATENCY_BUCKETS)
+HANDLER_IN_PROGRESS = Gauge('bot_handler_in_progress', 'Обработчики, выполняющиеся сейчас', ['handler'])
+OUTBOUND_LATENCY = Histogram('bot_outbound_latency_seconds', 'Время исходящих вызовов',
+                             ['target'], buckets=LATENCY_BUCKETS)
+OUTBOUND_ERRORS = Counter('bot_outbound_errors_total', 'Ошибки исходящих вызовов', ['target', 'error'])
+LOOP_LAG = Histogram('bot_event_loop_lag_seconds', 'Задержка event loop относительно расписания',
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+LOOP_LAG_LAST = Gauge('bot_event_loop_lag_last_seconds', 'Последняя измеренная задержка event loop')
+
+logger = logging.getLogger(__name__)
+
+
+# --- Обработчики ---
+def instrument(name=None):
+    """
+    Декоратор обработчика: считает вызовы (outcome=ok/error) и время выполнения.
+    Подходит и для корутин, и для обычных функций.
+    """
+    def decorator(func):
+        handler = name or func.__name__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                outcome = 'error'
+                started = time.perf_counter()
+                HANDLER_IN_PROGRESS.labels(handler).inc()
+                try:
+                    result = await func(*args, **kwargs)
+                    outcome = 'ok'
+                    return result
+                finally:
+                    HANDLER_IN_PROGRESS.labels(handler).dec()
+                    HANDLER_LATENCY.labels(handler).observe(time.perf_counter() - started)
+                    HANDLER_CALLS.labels(handler, outcome).inc()
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            outcome = 'error'
+            started = time.perf_counter()
+            HANDLER_IN_PROGRESS.labels(handler).inc()
+            try:
+                result = func(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                HANDLER_IN_PROGRESS.labels(handler).dec()
+                HANDLER_LATENCY.labels(handler).observe(time.perf_counter() - started)
+                HANDLER_CALLS.labels(handler, outcome).inc()
+        return wrapper
+    return decorator
+
+
+# --- Исходящие вызовы ---
+class OutboundCall:
+    """Результат исходящего вызова: позволяет отметить ошибку без исключения (например, HTTP 5xx)."""
+
+    def __init__(self, target):
+        self.target = target
+        self.failed = False
+
+    def fail(self, error):
+        if not self.failed:
+            self.failed = True
+            OUTBOUND_ERRORS.labels(self.target, str(error)).inc()
+
+
+@contextmanager
+def outbound(target):
+    """
+    Замеряет исходящий вызов к target; исключение считается ошибкой
+    с меткой error=<имя класса исключения>.
+    """
+    call = OutboundCall(target)
+    started = time.perf_counter()
+    try:
+        yield call
+    except BaseException as e:
+        if not isinstance(e, (GeneratorExit, asyncio.CancelledError)):
+            call.fail(type(e).__name__)
+        raise
+    finally:
+        OUTBOUND_LATENCY.labels(target).observe(time.perf_counter() - started)
+
+
+# --- Event loop ---
+async def _watch_loop_lag(interval):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        LOOP_LAG.observe(lag)
+        LOOP_LAG_LAST.set(lag)
+        if lag > 1:
+            logger.warning('Event loop был заблокирован на %.2f с', lag)
+
+
+def start_loop_monitor(interval=LOOP_LAG_INTERVAL):
+    """Запускает измерение задержки текущего event loop; возвращает задачу."""
+    return asyncio.create_task(_watch_loop_lag(interval), name='loop-lag-monitor')
+
+
+# --- Экспорт ---
+def render():
+    """Тело ответа /metrics и его Content-Type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,8 +1,17 @@
+import asyncio
 import logging
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
-from kafka import KafkaAdminClient, KafkaProducer, KafkaConsumer
-from kafka.admin import NewTopic
+import re
+import tempfile
+import time
+from datetime import datetime, timezone
+from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.ext import ApplicationBuilder, BaseUpdateProcessor, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
+from kafka_clients import KafkaClients  # Общие admin- и producer-клиенты
+from tail_reader import TopicBrowser  # Чтение хвоста топика через seek
+from bulk_publish import parse_options, publish_file  # Массовая загрузка из файла
+from kafka_metrics import KafkaMetricsCollector  # Кэш метрик топиков и групп
+import health  # Health-сервер работает в процессе бота
+from instrumentation import instrument, outbound, start_loop_monitor  # Метрики Prometheus
 import os
 
 def get_secret(path, default=None):
@@ -19,12 +28,22 @@ logging.basicConfig(level=logging.INFO)
 
 # Конфиг Kafka
 KAFKA_BOOTSTRAP_SERVERS = os.environ.get('KAFKA_BOOTSTRAP_SERVERS', 'kafka:9092')
+kafka = KafkaClients(KAFKA_BOOTSTRAP_SERVERS)
+browser = TopicBrowser(KAFKA_BOOTSTRAP_SERVERS)
+metrics = KafkaMetricsCollector(kafka)
+
+# Порт health-сервера (/health, /stats, /metrics)
+HEALTH_PORT = int(os.environ.get('HEALTH_PORT', 8000))
+
+# Сколько обновлений Telegram обрабатывается одновременно
+BOT_CONCURRENT_UPDATES = int(os.environ.get('BOT_CONCURRENT_UPDATES', 64))
 
 # Главное меню
 main_menu = ReplyKeyboardMarkup([
     [KeyboardButton('📋 Список топиков')],
     [KeyboardButton('➕ Создать топик'), KeyboardButton('➖ Удалить топик')],
     [KeyboardButton('👁️‍🗨️ Просмотреть сообщения'), KeyboardButton('✉️ Отправить сообщение')],
+    [KeyboardButton('📦 Массовая загрузка')],
 ], resize_keyboard=True)
 
 # Команда /start
@@ -51,6 +70,9 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif text == '✉️ Отправить сообщение':
         await update.message.reply_text('Введите имя топика для отправки сообщения:')
         context.user_data['action'] = 'send_message_topic'
+    elif text == '📦 Массовая загрузка':
+        await update.message.reply_text('Введите имя топика для загрузки:')
+        context.user_data['action'] = 'bulk_topic'
     else:
         # Обработка ввода для действий
         action = context.user_data.get('action')
@@ -61,12 +83,27 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await delete_topic(update, text)
             context.user_data['action'] = None
         elif action == 'view_messages':
-            await view_messages(update, text)
+            await view_messages(update, context, text)
             context.user_data['action'] = None
+        elif action == 'browse_time':
+            context.user_data['action'] = None
+            try:
+                moment = parse_moment(text)
+            except ValueError:
+                await update.message.reply_text('Не удалось разобрать время.', reply_markup=main_menu)
+                return
+            await show_page(update, context, browser.at_time, moment)
         elif action == 'send_message_topic':
             context.user_data['send_topic'] = text
             await update.message.reply_text('Введите текст сообщения:')
             context.user_data['action'] = 'send_message_text'
+        elif action == 'bulk_topic':
+            context.user_data['bulk_topic'] = text
+            context.user_data['action'] = 'bulk_file'
+            await update.message.reply_text(
+                'Отправьте файл JSON Lines (.jsonl) или CSV (.csv), можно сжатый gzip (.gz).\n'
+                'В подписи к файлу можно указать поле ключа и партицию: "key=id partition=0".'
+            )
         elif action == 'send_message_text':
             topic = context.user_data.get('send_topic')
             await send_message(update, topic, text)
@@ -76,62 +113,238 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text('Пожалуйста, используйте кнопки меню.', reply_markup=main_menu)
 
 # Список топиков
+@instrument()
 async def list_topics(update: Update):
-    admin = KafkaAdminClient(bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS)
-    topics = admin.list_topics()
-    await update.message.reply_text('Топики Kafka:\n' + '\n'.join(topics), reply_markup=main_menu)
-    admin.close()
+    try:
+        topics = await kafka.list_topics()
+        await update.message.reply_text('Топики Kafka:\n' + '\n'.join(topics), reply_markup=main_menu)
+    except Exception as e:
+        await update.message.reply_text(f'Ошибка: {e}', reply_markup=main_menu)
 
 # Создать топик
+@instrument()
 async def create_topic(update: Update, topic_name: str):
-    admin = KafkaAdminClient(bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS)
     try:
-        admin.create_topics([NewTopic(name=topic_name, num_partitions=1, replication_factor=1)])
+        await kafka.create_topic(topic_name)
         await update.message.reply_text(f'Топик "{topic_name}" создан.', reply_markup=main_menu)
     except Exception as e:
         await update.message.reply_text(f'Ошибка: {e}', reply_markup=main_menu)
-    admin.close()
 
 # Удалить топик
+@instrument()
 async def delete_topic(update: Update, topic_name: str):
-    admin = KafkaAdminClient(bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS)
     try:
-        admin.delete_topics([topic_name])
+        await kafka.delete_topic(topic_name)
         await update.message.reply_text(f'Топик "{topic_name}" удалён.', reply_markup=main_menu)
     except Exception as e:
         await update.message.reply_text(f'Ошибка: {e}', reply_markup=main_menu)
-    admin.close()
 
 # Просмотреть сообщения
-async def view_messages(update: Update, topic_name: str):
+browse_keyboard = InlineKeyboardMarkup([
+    [InlineKeyboardButton('⬅️ Раньше', callback_data='browse_older'), InlineKeyboardButton('Позже ➡️', callback_data='browse_newer')],
+    [InlineKeyboardButton('🕒 С момента времени', callback_data='browse_time')],
+])
+
+def format_page(topic_name: str, page):
+    """Текст страницы сообщений (с учётом лимита Telegram на длину)."""
+    if not page.records:
+        return f'Топик "{topic_name}": сообщений в этом направлении нет.'
+    lines = [f'Сообщения топика "{topic_name}":']
+    for r in page.records:
+        moment = datetime.fromtimestamp(r.timestamp / 1000, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        value = r.value if len(r.value) <= 300 else r.value[:300] + '…'
+        lines.append(f'[{r.partition}:{r.offset} {moment}] {value}')
+    text = '\n'.join(lines)
+    return text if len(text) <= 4000 else text[:3997] + '...'
+
+def parse_moment(text: str):
+    """Переводит "-15m", "-2h", "-1d" или ISO-дату (UTC) в миллисекунды с начала эпохи."""
+    text = text.strip()
+    match = re.fullmatch(r'-(\d+)([smhd])', text)
+    if match:
+        seconds = int(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+        return int((time.time() - seconds) * 1000)
+    moment = datetime.fromisoformat(text)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+async def show_page(update: Update, context: ContextTypes.DEFAULT_TYPE, loader, *args):
+    """Загружает страницу в пуле потоков Kafka и показывает (или обновляет) её."""
+    browse = context.user_data['browse']
     try:
-        consumer = KafkaConsumer(topic_name, bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS, auto_offset_reset='earliest', consumer_timeout_ms=2000)
-        messages = [msg.value.decode('utf-8') for msg in consumer]
-        if messages:
-            await update.message.reply_text('Сообщения:\n' + '\n'.join(messages[-10:]), reply_markup=main_menu)
-        else:
-            await update.message.reply_text('Нет сообщений в топике.', reply_markup=main_menu)
-        consumer.close()
+        with outbound('kafka_browse'):
+            page = await kafka.run(loader, browse['topic'], *args)
     except Exception as e:
-        await update.message.reply_text(f'Ошибка: {e}', reply_markup=main_menu)
+        await update.effective_message.reply_text(f'Ошибка: {e}', reply_markup=main_menu)
+        return
+    # Курсоры сдвигаем только если что-то показали, иначе остаёмся на месте
+    if page.records:
+        browse['before'], browse['after'] = page.before, page.after
+    text = format_page(browse['topic'], page)
+    if update.callback_query:
+        if text != update.callback_query.message.text:
+            await update.callback_query.edit_message_text(text, reply_markup=browse_keyboard)
+    else:
+        await update.message.reply_text(text, reply_markup=browse_keyboard)
+
+@instrument()
+async def view_messages(update: Update, context: ContextTypes.DEFAULT_TYPE, topic_name: str):
+    context.user_data['browse'] = {'topic': topic_name, 'before': {}, 'after': {}}
+    await show_page(update, context, browser.tail)
+
+@instrument()
+async def browse_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    browse = context.user_data.get('browse')
+    if not browse:
+        await query.edit_message_text('Сначала выберите топик для просмотра.')
+        return
+    if query.data == 'browse_older':
+        await show_page(update, context, browser.older, browse['before'])
+    elif query.data == 'browse_newer':
+        await show_page(update, context, browser.newer, browse['after'])
+    elif query.data == 'browse_time':
+        context.user_data['action'] = 'browse_time'
+        await query.message.reply_text('Введите момент времени: "-15m", "-2h", "-1d" или дату "2024-05-01 12:00" (UTC):')
 
 # Отправить сообщение
+@instrument()
 async def send_message(update: Update, topic_name: str, text: str):
     try:
-        producer = KafkaProducer(bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS)
-        producer.send(topic_name, text.encode('utf-8'))
-        producer.flush()
+        await kafka.send(topic_name, text.encode('utf-8'))
         await update.message.reply_text(f'Сообщение отправлено в "{topic_name}".', reply_markup=main_menu)
     except Exception as e:
         await update.message.reply_text(f'Ошибка: {e}', reply_markup=main_menu)
 
+# Массовая загрузка из файла
+@instrument()
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.user_data.get('action') != 'bulk_file':
+        await update.message.reply_text('Чтобы загрузить файл, выберите «📦 Массовая загрузка».', reply_markup=main_menu)
+        return
+    topic_name = context.user_data.get('bulk_topic')
+    context.user_data['action'] = None
+    document = update.message.document
+    try:
+        options = parse_options(update.message.caption)
+    except ValueError:
+        await update.message.reply_text('Некорректная подпись: номер партиции должен быть числом.', reply_markup=main_menu)
+        return
+    await update.message.reply_text(f'⏳ Загружаю "{document.file_name}" в топик "{topic_name}"...')
+    fd, path = tempfile.mkstemp(suffix='_' + os.path.basename(document.file_name or 'upload'))
+    os.close(fd)
+    try:
+        file = await context.bot.get_file(document.file_id)
+        await file.download_to_drive(path)
+        # Загрузка длительная: выполняем её в отдельном потоке, не занимая пул клиентов Kafka
+        producer = await kafka.run(kafka.producer)
+        with outbound('kafka_bulk'):
+            report = await asyncio.to_thread(
+                publish_file, producer, topic_name, path, document.file_name or '',
+                options.get('key'), options.get('partition')
+            )
+        await update.message.reply_text(f'✅ Загрузка в "{topic_name}" завершена.\n{report}', reply_markup=main_menu)
+    except Exception as e:
+        await update.message.reply_text(f'Ошибка: {e}', reply_markup=main_menu)
+    finally:
+        os.remove(path)
+
+# Метрики топиков и групп (из кэша сборщика)
+@instrument()
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    snapshot = metrics.snapshot
+    if not snapshot:
+        error = f'\nПоследняя ошибка: {metrics.last_error}' if metrics.last_error else ''
+        await update.message.reply_text(f'Метрики ещё не собраны.{error}', reply_markup=main_menu)
+        return
+    if context.args:
+        topic_name = context.args[0]
+        topic = snapshot['topics'].get(topic_name)
+        if topic is None:
+            await update.message.reply_text(f'Топик "{topic_name}" не найден.', reply_markup=main_menu)
+            return
+        lines = [f'Топик "{topic_name}": партиций {topic["partitions"]}, сообщений {topic["messages"]}']
+        lines += [f'  партиция {p}: конечное смещение {offset}' for p, offset in sorted(topic['end_offsets'].items())]
+        lines += [
+            f'Группа "{group_id}": lag {group["topics"][topic_name]}'
+            for group_id, group in sorted(snapshot['groups'].items()) if topic_name in group['topics']
+        ]
+    else:
+        lines = ['Топики (партиций / сообщений):']
+        lines += [f'  {name}: {t["partitions"]} / {t["messages"]}' for name, t in snapshot['topics'].items()]
+        lines.append('Группы потребителей (lag):')
+        lines += [f'  {group_id}: {g["lag"]}' for group_id, g in sorted(snapshot['groups'].items())] or ['  нет']
+    lines.append(f'Обновлено: {snapshot["updated_at"]}')
+    text = '\n'.join(lines)
+    await update.message.reply_text(text if len(text) <= 4000 else text[:3997] + '...', reply_markup=main_menu)
+
+# Запуск фоновых задач и health-сервера
+async def post_init(app):
+    health.metrics = metrics
+    health.kafka = kafka
+    health.serve_in_background(port=HEALTH_PORT)
+    start_loop_monitor()
+    metrics.start()
+
+# Закрытие клиентов Kafka при остановке
+async def post_shutdown(app):
+    await metrics.stop()
+    await kafka.run(browser.close)
+    await kafka.close()
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обновления разных пользователей обрабатываются параллельно (не больше
+    max_concurrent_updates одновременно), а обновления одного пользователя —
+    строго по очереди, поэтому шаги меню в context.user_data (action,
+    send_topic, bulk_topic) не перемешиваются.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # id пользователя (или чата) -> [Lock, число ожидающих]
+
+    async def do_process_update(self, update, coroutine):
+        key = None
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                key = update.effective_user.id
+            elif update.effective_chat is not None:
+                key = update.effective_chat.id
+        if key is None:
+            await coroutine
+            return
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
 # Основная функция
 async def main():
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    # Обновления разных пользователей обрабатываются параллельно, одного — по порядку
+    app = (
+        ApplicationBuilder().token(TELEGRAM_TOKEN).concurrent_updates(PerUserUpdateProcessor(BOT_CONCURRENT_UPDATES))
+        .post_init(post_init).post_shutdown(post_shutdown).build()
+    )
     app.add_handler(CommandHandler('start', start))
+    app.add_handler(CommandHandler('stats', stats_command))
+    app.add_handler(CallbackQueryHandler(browse_callback, pattern='^browse_'))
+    app.add_handler(MessageHandler(filters.Document.ALL, handle_document))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_menu))
     await app.run_polling()
 
 if __name__ == '__main__':
-    import asyncio
     asyncio.run(main()) 
\ No newline at end of file
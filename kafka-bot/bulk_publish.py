@@ -0,0 +1,134 @@
+"""
+Массовая публикация сообщений из файла в топик Kafka.
+
+Файл (JSON Lines или CSV, можно сжатый gzip) читается построчно и сразу
+отправляется в общий продюсер, который сам собирает пачки и сжимает их.
+Число неподтверждённых сообщений ограничено семафором, поэтому память не
+растёт вместе с размером файла. В конце возвращается отчёт о скорости.
+"""
+import csv  # Для чтения CSV
+import gzip  # Для сжатых файлов
+import io  # Для текстовой обёртки над бинарным потоком
+import json  # Для JSON Lines
+import logging  # Для логирования событий
+import os  # Для чтения переменных окружения
+import threading  # Для ограничения сообщений "в полёте"
+import time  # Для замера скорости
+from dataclasses import dataclass
+
+# Максимум отправленных, но ещё не подтверждённых сообщений
+KAFKA_BULK_MAX_IN_FLIGHT = int(os.environ.get('KAFKA_BULK_MAX_IN_FLIGHT', 10000))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BulkReport:
+    sent: int = 0
+    failed: int = 0
+    skipped: int = 0
+    bytes: int = 0
+    elapsed: float = 0.0
+    first_error: str = ''
+
+    @property
+    def rate(self):
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        text = (
+            f'Отправлено: {self.sent}\n'
+            f'Ошибок: {self.failed}\n'
+            f'Пропущено строк: {self.skipped}\n'
+            f'Объём: {self.bytes / 1024 / 1024:.2f} МБ\n'
+            f'Время: {self.elapsed:.1f} с\n'
+            f'Скорость: {self.rate:.0f} сообщ/с'
+        )
+        if self.first_error:
+            text += f'\nПервая ошибка: {self.first_error}'
+        return text
+
+
+def parse_options(caption: str):
+    """Разбирает подпись к файлу вида "key=id partition=0"."""
+    options = {}
+    for part in (caption or '').split():
+        name, sep, value = part.partition('=')
+        if sep and name in ('key', 'partition'):
+            options[name] = int(value) if name == 'partition' else value
+    return options
+
+
+def _open_text(path):
+    """Открывает файл как текст, распаковывая gzip по сигнатуре."""
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8')
+    return open(path, encoding='utf-8', newline='')
+
+
+def iter_records(path, filename, key_field=None):
+    """
+    Отдаёт пары (key: bytes | None, value: bytes) из файла.
+    Некорректные строки отдаются как (None, None) и считаются пропущенными.
+    """
+    name = filename.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    with _open_text(path) as f:
+        if name.endswith('.csv'):
+            for row in csv.DictReader(f):
+                key = row.get(key_field) if key_field else None
+                yield (key.encode('utf-8') if key else None), json.dumps(row, ensure_ascii=False).encode('utf-8')
+            return
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                yield None, None
+                continue
+            key = data.get(key_field) if key_field and isinstance(data, dict) else None
+            yield (str(key).encode('utf-8') if key is not None else None), line.encode('utf-8')
+
+
+def publish_file(producer, topic, path, filename, key_field=None, partition=None,
+                 max_in_flight=KAFKA_BULK_MAX_IN_FLIGHT):
+    """Публикует файл в топик (блокирующая функция) и возвращает BulkReport."""
+    report = BulkReport()
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    lock = threading.Lock()
+
+    def on_success(_):
+        with lock:
+            report.sent += 1
+        in_flight.release()
+
+    def on_error(exc):
+        with lock:
+            report.failed += 1
+            if not report.first_error:
+                report.first_error = str(exc)
+        in_flight.release()
+
+    started = time.perf_counter()
+    for key, value in iter_records(path, filename, key_field):
+        if value is None:
+            report.skipped += 1
+            continue
+        in_flight.acquire()
+        try:
+            future = producer.send(topic, value=value, key=key, partition=partition)
+        except Exception as e:
+            on_error(e)
+            continue
+        future.add_callback(on_success)
+        future.add_errback(on_error)
+        report.bytes += len(value)
+    producer.flush()
+    report.elapsed = time.perf_counter() - started
+    logger.info('Массовая загрузка в %s: %s', topic, report.__dict__)
+    return report
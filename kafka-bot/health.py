@@ -1,15 +1,46 @@
+import threading
 import time
+import uvicorn
 from fastapi import FastAPI
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+import instrumentation
 
 start_time = time.time()
 app = FastAPI()
 
+# Сборщик метрик Kafka (kafka_metrics.KafkaMetricsCollector) и клиенты Kafka
+# (kafka_clients.KafkaClients); подключаются ботом, так как health-сервер работает в процессе бота
+metrics = None
+kafka = None
+
 @app.get("/health")
 def health():
     uptime = int(time.time() - start_time)
+    # None — к Kafka ещё не обращались, это не ошибка
+    connected = kafka.healthy() if kafka is not None else None
     return JSONResponse({
-        "status": "ok",
+        "status": "error" if connected is False else "ok",
         "uptime": f"{uptime // 60} мин {uptime % 60} сек",
-        "details": "Kafka Telegram Bot работает"
-    }) 
\ No newline at end of file
+        "kafka": {True: "connected", False: "disconnected", None: "unknown"}[connected],
+        "details": "Kafka Telegram Bot работает" if connected is not False else f"Нет соединения с Kafka: {kafka.last_error}"
+    }, status_code=503 if connected is False else 200)
+
+@app.get("/stats")
+def stats():
+    # Отдаём последний снимок из памяти, к брокерам не обращаемся
+    if metrics is None or not metrics.snapshot:
+        return JSONResponse({"status": "unavailable", "error": getattr(metrics, "last_error", None)}, status_code=503)
+    return JSONResponse(metrics.as_dict())
+
+@app.get("/metrics")
+def prometheus_metrics():
+    # Метрики процесса в формате Prometheus
+    body, content_type = instrumentation.render()
+    return Response(body, media_type=content_type)
+
+def serve_in_background(host="0.0.0.0", port=8000):
+    """Запускает health-сервер в отдельном потоке процесса бота."""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="health-server", daemon=True)
+    thread.start()
+    return server
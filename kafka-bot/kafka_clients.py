@@ -0,0 +1,157 @@
+"""
+Общие клиенты Kafka для бота.
+
+KafkaAdminClient и KafkaProducer создаются один раз и используются всеми
+обработчиками, поэтому bootstrap, получение метаданных и установка
+соединений не повторяются на каждое нажатие кнопки. Блокирующие вызовы
+kafka-python выполняются в пуле потоков, чтобы не останавливать event loop.
+При потере соединения клиент пересоздаётся и вызов повторяется один раз;
+неидемпотентные вызовы (отправка, создание и удаление топика) повторяются
+только если запрос заведомо не дошёл до брокера.
+"""
+import asyncio  # Для выполнения вызовов вне event loop
+import logging  # Для логирования событий
+import os  # Для чтения переменных окружения
+import threading  # Для ленивого создания клиентов
+from concurrent.futures import ThreadPoolExecutor  # Пул потоков для kafka-python
+
+from kafka import KafkaAdminClient, KafkaProducer
+from kafka.admin import NewTopic
+from kafka.errors import KafkaConnectionError, KafkaTimeoutError, NoBrokersAvailable, NodeNotReadyError
+
+from instrumentation import outbound  # Задержки и ошибки вызовов Kafka
+
+# Настройки продюсера: задержка накопления пачки, размер пачки и сжатие
+KAFKA_LINGER_MS = int(os.environ.get('KAFKA_LINGER_MS', 5))
+KAFKA_BATCH_SIZE = int(os.environ.get('KAFKA_BATCH_SIZE', 64 * 1024))
+KAFKA_COMPRESSION = os.environ.get('KAFKA_COMPRESSION', 'gzip')  # none, gzip, snappy, lz4, zstd
+# Таймаут ожидания подтверждения отправки в секундах
+KAFKA_SEND_TIMEOUT = float(os.environ.get('KAFKA_SEND_TIMEOUT', 10))
+# Размер пула потоков для блокирующих вызовов
+KAFKA_CLIENT_THREADS = int(os.environ.get('KAFKA_CLIENT_THREADS', 4))
+
+# Ошибки, после которых клиент пересоздаётся
+CONNECTION_ERRORS = (KafkaConnectionError, KafkaTimeoutError, NoBrokersAvailable, NodeNotReadyError)
+# Ошибки, при которых запрос не был отправлен: повтор безопасен для любого вызова.
+# После таймаута или обрыва запрос мог уже выполниться — повтор дал бы дубль
+NOT_SENT_ERRORS = (NoBrokersAvailable, NodeNotReadyError)
+
+logger = logging.getLogger(__name__)
+
+
+class KafkaClients:
+    """Долгоживущие admin- и producer-клиенты Kafka с асинхронным интерфейсом."""
+
+    def __init__(self, bootstrap_servers):
+        self.bootstrap_servers = bootstrap_servers
+        self._admin = None
+        self._producer = None
+        self._last_ok = None  # Итог последнего обращения к Kafka (см. record)
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=KAFKA_CLIENT_THREADS, thread_name_prefix='kafka')
+
+    # --- Ленивое создание и пересоздание клиентов ---
+    def admin(self):
+        with self._lock:
+            if self._admin is None:
+                self._admin = KafkaAdminClient(bootstrap_servers=self.bootstrap_servers, client_id='kafka-bot-admin')
+            return self._admin
+
+    def producer(self):
+        with self._lock:
+            if self._producer is None:
+                self._producer = KafkaProducer(
+                    bootstrap_servers=self.bootstrap_servers,
+                    client_id='kafka-bot-producer',
+                    linger_ms=KAFKA_LINGER_MS,
+                    batch_size=KAFKA_BATCH_SIZE,
+                    compression_type=None if KAFKA_COMPRESSION == 'none' else KAFKA_COMPRESSION,
+                    acks=1
+                )
+            return self._producer
+
+    def _reset(self, name):
+        with self._lock:
+            client = getattr(self, f'_{name}')
+            setattr(self, f'_{name}', None)
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                logger.exception('Ошибка при закрытии клиента Kafka (%s)', name)
+
+    async def run(self, func, *args):
+        """Выполняет блокирующую функцию в пуле потоков Kafka."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def _call(self, name, func, idempotent=True):
+        """
+        Вызывает func(client); при обрыве соединения пересоздаёт клиент и повторяет.
+        Неидемпотентный вызов повторяется только при ошибках из NOT_SENT_ERRORS.
+        Итог вызова запоминается для /health (см. record).
+        """
+        getter = getattr(self, name)
+        try:
+            with outbound(f'kafka_{name}'):
+                result = await self.run(lambda: func(getter()))
+        except CONNECTION_ERRORS as e:
+            self._reset(name)
+            if not idempotent and not isinstance(e, NOT_SENT_ERRORS):
+                logger.warning('Соединение с Kafka (%s) потеряно: %s, результат вызова неизвестен, не повторяю', name, e)
+                self.record(e)
+                raise
+            logger.warning('Соединение с Kafka (%s) потеряно: %s, переподключаюсь', name, e)
+            try:
+                with outbound(f'kafka_{name}'):
+                    result = await self.run(lambda: func(getter()))
+            except CONNECTION_ERRORS as retry_error:
+                self.record(retry_error)
+                raise
+            except Exception:
+                self.record()  # Брокер ответил ошибкой, но соединение есть
+                raise
+        except Exception:
+            self.record()
+            raise
+        self.record()
+        return result
+
+    # --- Операции ---
+    async def list_topics(self):
+        return await self._call('admin', lambda admin: sorted(admin.list_topics()))
+
+    async def create_topic(self, name, num_partitions=1, replication_factor=1):
+        topic = NewTopic(name=name, num_partitions=num_partitions, replication_factor=replication_factor)
+        return await self._call('admin', lambda admin: admin.create_topics([topic]), idempotent=False)
+
+    async def delete_topic(self, name):
+        return await self._call('admin', lambda admin: admin.delete_topics([name]), idempotent=False)
+
+    async def send(self, topic, value: bytes, key: bytes = None):
+        """Отправляет сообщение и ждёт подтверждения брокера (без flush всего продюсера)."""
+        return await self._call(
+            'producer', lambda producer: producer.send(topic, value=value, key=key).get(timeout=KAFKA_SEND_TIMEOUT),
+            idempotent=False
+        )
+
+    def record(self, error=None):
+        """
+        Запоминает итог обращения к Kafka: error — ошибка соединения, None — брокер ответил.
+        Вызывается из _call и из фонового сбора метрик, который обращается к брокерам регулярно.
+        """
+        self._last_ok = error is None
+        self.last_error = None if error is None else str(error)
+
+    def healthy(self):
+        """
+        Удалось ли последнее обращение к Kafka; None, если обращений ещё не было.
+        К брокеру не обращается, поэтому вызов безопасен из /health.
+        """
+        return self._last_ok
+
+    async def close(self):
+        await self.run(self._reset, 'producer')
+        await self.run(self._reset, 'admin')
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,109 @@
+"""
+Метрики топиков и групп потребителей Kafka.
+
+Фоновая задача раз в KAFKA_METRICS_INTERVAL секунд снимает снимок:
+партиции и число сообщений в топиках (по начальным и конечным смещениям),
+закоммиченные смещения групп и их отставание (lag). Команда /stats и
+HTTP-эндпоинт /stats отдают последний снимок из памяти и не обращаются
+к брокерам на каждый запрос.
+"""
+import asyncio  # Для периодического сбора
+import logging  # Для логирования событий
+import os  # Для чтения переменных окружения
+import time  # Для времени снимка
+from datetime import datetime, timezone
+
+from kafka import KafkaConsumer, TopicPartition
+
+from kafka_clients import CONNECTION_ERRORS
+
+# Как часто снимать метрики (секунды)
+KAFKA_METRICS_INTERVAL = float(os.environ.get('KAFKA_METRICS_INTERVAL', 30))
+
+logger = logging.getLogger(__name__)
+
+
+class KafkaMetricsCollector:
+    """Периодически собирает метрики через общие клиенты и хранит последний снимок."""
+
+    def __init__(self, clients, interval=KAFKA_METRICS_INTERVAL):
+        self.clients = clients
+        self.interval = interval
+        self.snapshot = {}  # Заменяется целиком, поэтому его безопасно читать из других потоков
+        self.last_error = None
+        self._consumer = None
+        self._task = None
+
+    def _get_consumer(self):
+        if self._consumer is None:
+            self._consumer = KafkaConsumer(
+                bootstrap_servers=self.clients.bootstrap_servers,
+                client_id='kafka-bot-metrics',
+                group_id=None,
+                enable_auto_commit=False
+            )
+        return self._consumer
+
+    def collect(self):
+        """Снимает снимок метрик (блокирующая функция)."""
+        started = time.monotonic()
+        admin = self.clients.admin()
+        consumer = self._get_consumer()
+        topics = sorted(t for t in admin.list_topics() if not t.startswith('__'))
+        tps = [TopicPartition(t, p) for t in topics for p in sorted(consumer.partitions_for_topic(t) or ())]
+        begin = consumer.beginning_offsets(tps) if tps else {}
+        end = consumer.end_offsets(tps) if tps else {}
+
+        topic_stats = {}
+        for tp in tps:
+            stats = topic_stats.setdefault(tp.topic, {'partitions': 0, 'messages': 0, 'end_offsets': {}})
+            stats['partitions'] += 1
+            stats['messages'] += end[tp] - begin[tp]
+            stats['end_offsets'][tp.partition] = end[tp]
+
+        group_stats = {}
+        for group_id, _ in admin.list_consumer_groups():
+            committed = admin.list_consumer_group_offsets(group_id)
+            lag_by_topic = {}
+            for tp, meta in committed.items():
+                if meta.offset < 0 or tp not in end:
+                    continue
+                lag_by_topic[tp.topic] = lag_by_topic.get(tp.topic, 0) + max(0, end[tp] - meta.offset)
+            group_stats[group_id] = {'lag': sum(lag_by_topic.values()), 'topics': lag_by_topic}
+
+        return {
+            'updated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'duration_ms': int((time.monotonic() - started) * 1000),
+            'topics': topic_stats,
+            'groups': group_stats,
+        }
+
+    async def refresh(self):
+        try:
+            self.snapshot = await self.clients.run(self.collect)
+            self.last_error = None
+            self.clients.record()
+        except Exception as e:
+            self.last_error = str(e)
+            self.clients.record(e if isinstance(e, CONNECTION_ERRORS) else None)
+            logger.warning('Не удалось собрать метрики Kafka: %s', e)
+
+    async def _loop(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop(), name='kafka-metrics')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._consumer is not None:
+            await self.clients.run(self._consumer.close)
+            self._consumer = None
+
+    def as_dict(self):
+        """Снимок для JSON-эндпоинта."""
+        return {**self.snapshot, 'error': self.last_error}
@@ -0,0 +1,169 @@
+"""
+Просмотр хвоста топика Kafka без чтения всего топика.
+
+Партиции назначаются консьюмеру напрямую (без группы), для каждой партиции
+вычисляется окно смещений, консьюмер переходит (seek) к его началу и читает
+только это окно. Поэтому стоимость просмотра зависит от размера страницы,
+а не от размера топика. Поддерживается листание назад и вперёд и переход
+к моменту времени через offsets_for_times.
+"""
+import logging  # Для логирования событий
+import os  # Для чтения переменных окружения
+import threading  # Консьюмер не потокобезопасен
+import time  # Для таймаута чтения
+from dataclasses import dataclass, field
+
+from kafka import KafkaConsumer, TopicPartition
+
+# Сколько сообщений показывать на странице
+BROWSE_PAGE_SIZE = int(os.environ.get('BROWSE_PAGE_SIZE', 10))
+# Максимальное время чтения одной страницы в секундах
+BROWSE_FETCH_TIMEOUT = float(os.environ.get('BROWSE_FETCH_TIMEOUT', 5))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Record:
+    partition: int
+    offset: int
+    timestamp: int
+    value: str
+
+
+@dataclass
+class Page:
+    """
+    Страница сообщений и курсоры для листания:
+    before — для каждой партиции смещение самого раннего показанного сообщения,
+    after — смещение, следующее за последним показанным.
+    """
+    records: list = field(default_factory=list)
+    before: dict = field(default_factory=dict)
+    after: dict = field(default_factory=dict)
+
+
+class TopicBrowser:
+    """Чтение окон сообщений топика через assign/seek. Все методы блокирующие."""
+
+    def __init__(self, bootstrap_servers):
+        self.bootstrap_servers = bootstrap_servers
+        self._consumer = None
+        self._lock = threading.Lock()
+
+    def _get_consumer(self):
+        if self._consumer is None:
+            self._consumer = KafkaConsumer(
+                bootstrap_servers=self.bootstrap_servers,
+                client_id='kafka-bot-browser',
+                group_id=None,
+                enable_auto_commit=False
+            )
+        return self._consumer
+
+    def close(self):
+        with self._lock:
+            if self._consumer is not None:
+                self._consumer.close()
+                self._consumer = None
+
+    def _topic_partitions(self, consumer, topic):
+        partitions = consumer.partitions_for_topic(topic)
+        if not partitions:
+            raise ValueError(f'Топик "{topic}" не найден')
+        return [TopicPartition(topic, p) for p in sorted(partitions)]
+
+    def _bounds(self, consumer, tps):
+        return consumer.beginning_offsets(tps), consumer.end_offsets(tps)
+
+    def _read(self, consumer, windows):
+        """Читает сообщения в окнах {TopicPartition: (start, end)}; end не включается."""
+        windows = {tp: w for tp, w in windows.items() if w[0] < w[1]}
+        if not windows:
+            return []
+        consumer.assign(list(windows))
+        for tp, (start, _) in windows.items():
+            consumer.seek(tp, start)
+        records = []
+        remaining = set(windows)
+        deadline = time.monotonic() + BROWSE_FETCH_TIMEOUT
+        while remaining and time.monotonic() < deadline:
+            batch = consumer.poll(timeout_ms=500)
+            for tp, messages in batch.items():
+                end = windows[tp][1]
+                for msg in messages:
+                    if msg.offset < end:
+                        value = msg.value.decode('utf-8', errors='replace') if msg.value is not None else ''
+                        records.append(Record(tp.partition, msg.offset, msg.timestamp, value))
+            for tp in list(remaining):
+                # Позиция может перепрыгнуть конец окна (компактизация, маркеры транзакций)
+                if consumer.position(tp) >= windows[tp][1]:
+                    remaining.discard(tp)
+                    consumer.pause(tp)
+        if remaining:
+            logger.warning('Не дочитаны партиции за %s с: %s', BROWSE_FETCH_TIMEOUT, remaining)
+        consumer.unsubscribe()
+        return sorted(records, key=lambda r: (r.timestamp, r.partition, r.offset))
+
+    @staticmethod
+    def _page(records, before, after):
+        page = Page(records=records, before=dict(before), after=dict(after))
+        for r in records:
+            page.before[r.partition] = min(page.before.get(r.partition, r.offset), r.offset)
+            page.after[r.partition] = max(page.after.get(r.partition, 0), r.offset + 1)
+        return page
+
+    def tail(self, topic, n=BROWSE_PAGE_SIZE):
+        """Последние n сообщений топика (по всем партициям)."""
+        with self._lock:
+            consumer = self._get_consumer()
+            tps = self._topic_partitions(consumer, topic)
+            begin, end = self._bounds(consumer, tps)
+            windows = {tp: (max(begin[tp], end[tp] - n), end[tp]) for tp in tps}
+            records = self._read(consumer, windows)[-n:]
+            return self._page(
+                records,
+                before={tp.partition: end[tp] for tp in tps},
+                after={tp.partition: end[tp] for tp in tps}
+            )
+
+    def older(self, topic, before, n=BROWSE_PAGE_SIZE):
+        """n сообщений, предшествующих курсору before."""
+        with self._lock:
+            consumer = self._get_consumer()
+            tps = self._topic_partitions(consumer, topic)
+            begin, end = self._bounds(consumer, tps)
+            cursor = {tp: before.get(tp.partition, end[tp]) for tp in tps}
+            windows = {tp: (max(begin[tp], cursor[tp] - n), cursor[tp]) for tp in tps}
+            records = self._read(consumer, windows)[-n:]
+            page = self._page(records, before={tp.partition: cursor[tp] for tp in tps}, after={})
+            # Курсор "позже" для страницы назад — сразу после последнего показанного сообщения
+            page.after = {r.partition: r.offset + 1 for r in records}
+            for tp in tps:
+                page.after.setdefault(tp.partition, cursor[tp])
+            return page
+
+    def newer(self, topic, after, n=BROWSE_PAGE_SIZE):
+        """n сообщений, следующих за курсором after."""
+        with self._lock:
+            consumer = self._get_consumer()
+            tps = self._topic_partitions(consumer, topic)
+            begin, end = self._bounds(consumer, tps)
+            cursor = {tp: max(begin[tp], after.get(tp.partition, end[tp])) for tp in tps}
+            windows = {tp: (cursor[tp], min(end[tp], cursor[tp] + n)) for tp in tps}
+            records = self._read(consumer, windows)[:n]
+            return self._page(
+                records,
+                before={tp.partition: cursor[tp] for tp in tps},
+                after={tp.partition: cursor[tp] for tp in tps}
+            )
+
+    def at_time(self, topic, timestamp_ms, n=BROWSE_PAGE_SIZE):
+        """n сообщений, начиная с момента timestamp_ms (мс с начала эпохи)."""
+        with self._lock:
+            consumer = self._get_consumer()
+            tps = self._topic_partitions(consumer, topic)
+            _, end = self._bounds(consumer, tps)
+            found = consumer.offsets_for_times({tp: timestamp_ms for tp in tps})
+        after = {tp.partition: (found[tp].offset if found.get(tp) else end[tp]) for tp in tps}
+        return self.newer(topic, after, n)
@@ -0,0 +1,124 @@
+"""
+Постоянный индекс для инкрементального сбора.
+
+Для каждой пары (область, паук) хранятся загруженные страницы — ETag,
+Last-Modified, хэш содержимого и, при необходимости, сжатое тело —
+и хэши уже выданных элементов. Область (INCREMENTAL_SCOPE) бот задаёт
+по пользователю, поэтому «новое» считается относительно прошлого сбора
+этого пользователя. Соединение работает в режиме автокоммита: несколько
+сборов в одном процессе пишут в один файл и не держат блокировку записи.
+Хэши элементов записываются одной транзакцией после успешного сбора.
+"""
+import hashlib  # Для хэшей содержимого и элементов
+import json  # Для хэша элемента
+import sqlite3  # Для хранения индекса
+import time  # Для времени загрузки
+import zlib  # Для сжатия сохранённых тел страниц
+
+
+def content_hash(data: bytes):
+    return hashlib.sha1(data).hexdigest()
+
+
+def item_hash(data: dict):
+    return hashlib.sha1(json.dumps(data, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+class CrawlIndex:
+    """Индекс страниц и элементов в SQLite."""
+
+    def __init__(self, path, scope, spider):
+        self.scope = scope
+        self.spider = spider
+        # Автокоммит: каждая запись — короткая транзакция (в WAL без fsync).
+        # Индекс может обслуживаться выделенным потоком, но не несколькими сразу
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                scope TEXT NOT NULL,
+                spider TEXT NOT NULL,
+                url TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_type TEXT,
+                content_hash TEXT NOT NULL,
+                body BLOB,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (scope, spider, url)
+            )
+        ''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS items (
+                scope TEXT NOT NULL,
+                spider TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                seen_at REAL NOT NULL,
+                PRIMARY KEY (scope, spider, hash)
+            )
+        ''')
+
+    def close(self):
+        self._conn.close()
+
+    # --- Страницы ---
+    def get_page(self, url):
+        """Запись о странице: dict с etag, last_modified, content_type, content_hash, body или None."""
+        row = self._conn.execute(
+            'SELECT etag, last_modified, content_type, content_hash, body FROM pages '
+            'WHERE scope=? AND spider=? AND url=?', (self.scope, self.spider, url)
+        ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, content_type, digest, body = row
+        return {
+            'etag': etag,
+            'last_modified': last_modified,
+            'content_type': content_type,
+            'content_hash': digest,
+            'body': zlib.decompress(body) if body is not None else None,
+        }
+
+    def put_page(self, url, etag, last_modified, content_type, body, store_body=True):
+        """Сохраняет страницу и возвращает хэш её содержимого."""
+        digest = content_hash(body)
+        self._conn.execute(
+            'INSERT INTO pages (scope, spider, url, etag, last_modified, content_type, content_hash, body, fetched_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (scope, spider, url) DO UPDATE SET etag=excluded.etag, last_modified=excluded.last_modified, '
+            'content_type=excluded.content_type, content_hash=excluded.content_hash, body=excluded.body, '
+            'fetched_at=excluded.fetched_at',
+            (self.scope, self.spider, url, etag, last_modified, content_type, digest,
+             zlib.compress(body) if store_body else None, time.time())
+        )
+        return digest
+
+    def touch_page(self, url):
+        self._conn.execute(
+            'UPDATE pages SET fetched_at=? WHERE scope=? AND spider=? AND url=?',
+            (time.time(), self.scope, self.spider, url)
+        )
+
+    # --- Элементы ---
+    def has_item(self, digest):
+        """Выдавался ли элемент в прошлых сборах."""
+        return self._conn.execute(
+            'SELECT 1 FROM items WHERE scope=? AND spider=? AND hash=?', (self.scope, self.spider, digest)
+        ).fetchone() is not None
+
+    def add_items(self, digests):
+        """Отмечает элементы выданными одной транзакцией."""
+        now = time.time()
+        self._conn.execute('BEGIN')
+        try:
+            self._conn.executemany(
+                'INSERT INTO items (scope, spider, hash, seen_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (scope, spider, hash) DO NOTHING',
+                [(self.scope, self.spider, digest, now) for digest in digests]
+            )
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
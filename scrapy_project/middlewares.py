@@ -1,4 +1,358 @@
-# Этот файл содержит шаблоны для пользовательских middleware Scrapy
+# Этот файл содержит пользовательские middleware Scrapy
 # Middleware позволяют изменять запросы и ответы во время работы паука
 
-# Пример шаблона (оставим пустым для MVP) 
\ No newline at end of file
+import logging  # Для логирования событий
+import time  # Для времени исключения прокси
+from urllib.parse import urlsplit  # Для домена запроса и скрытия пароля прокси
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from twisted.internet import defer, threads  # Для работы с индексом вне потока реактора
+from twisted.python.threadpool import ThreadPool  # Выделенный поток индекса
+
+from scrapy_project.incremental import CrawlIndex
+
+logger = logging.getLogger(__name__)
+
+
+def mask_proxy(proxy):
+    """Адрес прокси без логина и пароля (для логов и статистики)."""
+    parts = urlsplit(proxy)
+    host = parts.hostname or proxy
+    return f'{parts.scheme}://{host}:{parts.port}' if parts.port else f'{parts.scheme}://{host}'
+
+
+class ProxyState:
+    """Состояние одного прокси: счётчики, сглаженная задержка и исключение из пула."""
+
+    def __init__(self, url, latency_alpha):
+        self.url = url
+        self.name = mask_proxy(url)
+        self.alpha = latency_alpha
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.bans = 0
+        self.latency = None  # Экспоненциально сглаженная задержка ответа, секунды
+        self.recent = []  # Результаты последних запросов (True — успех)
+        self.evicted_until = 0.0
+        self.evictions = 0
+        self.probing = False  # После исключения прокси получает один пробный запрос
+
+    def available(self, now):
+        return now >= self.evicted_until
+
+    def error_rate(self):
+        return self.recent.count(False) / len(self.recent) if self.recent else 0.0
+
+    def score(self):
+        """Чем меньше, тем лучше: задержка с поправкой на долю ошибок."""
+        latency = self.latency if self.latency is not None else 1.0
+        return latency * (1 + 4 * self.error_rate())
+
+    def record(self, ok, window, latency=None):
+        self.recent.append(ok)
+        del self.recent[:-window]
+        if ok:
+            self.successes += 1
+            if latency is not None:
+                self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+        else:
+            self.failures += 1
+
+
+class ProxyPoolMiddleware:
+    """
+    Ротация прокси из пула с оценкой их состояния.
+
+    Каждому домену (слоту загрузчика) назначается один прокси — лучший по
+    сглаженной задержке и доле ошибок среди наименее занятых. Прокси с
+    большой долей ошибок и банов (PROXY_POOL_BAN_CODES) исключается на
+    время, которое растёт при повторных исключениях; затем получает один
+    пробный запрос и либо возвращается в пул, либо исключается снова.
+    Забаненный или упавший запрос повторяется через другой прокси.
+    Статистика по прокси пишется в stats Scrapy при закрытии паука.
+
+    Настройки: PROXY_POOL (список или строка через запятую), PROXY (один прокси
+    пользователя, добавляется в пул), PROXY_POOL_BAN_CODES, PROXY_POOL_MAX_RETRIES,
+    PROXY_POOL_EVICT_ERROR_RATE, PROXY_POOL_MIN_REQUESTS, PROXY_POOL_WINDOW,
+    PROXY_POOL_REPROBE_INTERVAL, PROXY_POOL_LATENCY_ALPHA.
+    """
+
+    def __init__(self, proxies, ban_codes, max_retries, evict_error_rate, min_requests, window,
+                 reprobe_interval, latency_alpha, stats=None):
+        self.proxies = [ProxyState(url, latency_alpha) for url in proxies]
+        self.ban_codes = set(ban_codes)
+        self.max_retries = max_retries
+        self.evict_error_rate = evict_error_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.reprobe_interval = reprobe_interval
+        self.stats = stats
+        self.by_url = {p.url: p for p in self.proxies}
+        self.domain_proxy = {}  # Домен -> назначенный прокси
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pool = settings.getlist('PROXY_POOL')
+        if settings.get('PROXY'):
+            pool.append(settings.get('PROXY'))
+        proxies = list(dict.fromkeys(p.strip() for p in pool if p and p.strip()))
+        if not proxies:
+            raise NotConfigured('Пул прокси пуст')
+        middleware = cls(
+            proxies,
+            ban_codes=[int(code) for code in settings.getlist('PROXY_POOL_BAN_CODES', [403, 407, 429, 503])],
+            max_retries=settings.getint('PROXY_POOL_MAX_RETRIES', 3),
+            evict_error_rate=settings.getfloat('PROXY_POOL_EVICT_ERROR_RATE', 0.5),
+            min_requests=settings.getint('PROXY_POOL_MIN_REQUESTS', 5),
+            window=settings.getint('PROXY_POOL_WINDOW', 20),
+            reprobe_interval=settings.getfloat('PROXY_POOL_REPROBE_INTERVAL', 60),
+            latency_alpha=settings.getfloat('PROXY_POOL_LATENCY_ALPHA', 0.3),
+            stats=crawler.stats,
+        )
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    # --- Выбор прокси ---
+    def _choose(self, exclude=None):
+        now = time.monotonic()
+        candidates = [p for p in self.proxies if p.available(now) and p is not exclude]
+        if not candidates:
+            # Все прокси исключены: берём тот, что вернётся в пул раньше остальных, а не останавливаем сбор
+            candidates = sorted((p for p in self.proxies if p is not exclude), key=lambda p: p.evicted_until)[:1]
+            if not candidates:
+                return exclude
+        load = {}
+        for proxy in self.domain_proxy.values():
+            load[proxy.url] = load.get(proxy.url, 0) + 1
+        return min(candidates, key=lambda p: p.score() * (1 + load.get(p.url, 0)))
+
+    def _proxy_for(self, domain):
+        proxy = self.domain_proxy.get(domain)
+        if proxy is None or not proxy.available(time.monotonic()):
+            proxy = self._choose()
+            self.domain_proxy[domain] = proxy
+        return proxy
+
+    # --- Учёт результатов ---
+    def _evict(self, proxy, reason):
+        proxy.evictions += 1
+        # Повторные исключения удлиняют паузу: 1, 2, 4... интервала, но не больше 16
+        pause = self.reprobe_interval * min(16, 2 ** (proxy.evictions - 1))
+        proxy.evicted_until = time.monotonic() + pause
+        proxy.probing = True
+        proxy.recent.clear()
+        for domain, assigned in list(self.domain_proxy.items()):
+            if assigned is proxy:
+                del self.domain_proxy[domain]
+        logger.warning('Прокси %s исключён на %.0f с: %s', proxy.name, pause, reason)
+
+    def _record(self, proxy, ok, latency=None, reason=''):
+        proxy.record(ok, self.window, latency)
+        if proxy.probing:
+            if ok:
+                proxy.probing = False
+                logger.info('Прокси %s снова в пуле', proxy.name)
+            else:
+                self._evict(proxy, f'пробный запрос не прошёл ({reason})')
+            return
+        if not ok and len(proxy.recent) >= self.min_requests and proxy.error_rate() >= self.evict_error_rate:
+            self._evict(proxy, f'доля ошибок {proxy.error_rate():.0%} ({reason})')
+
+    def _retry(self, request, proxy, reason, spider):
+        retries = request.meta.get('proxy_pool_retries', 0)
+        if retries >= self.max_retries:
+            logger.debug('Запрос %s не удался через все попытки прокси: %s', request.url, reason)
+            return None
+        domain = urlsplit(request.url).hostname or ''
+        replacement = self._choose(exclude=proxy)
+        self.domain_proxy[domain] = replacement
+        if self.stats is not None:
+            self.stats.inc_value('proxy_pool/retries', spider=spider)
+        meta = {**request.meta, 'proxy_pool_retries': retries + 1, 'proxy': replacement.url, 'proxy_pool_proxy': replacement.url}
+        return request.replace(meta=meta, dont_filter=True)
+
+    # --- Хуки downloader middleware ---
+    def process_request(self, request, spider):
+        # Прокси, заданный пауком явно, не трогаем
+        if 'proxy' in request.meta and 'proxy_pool_proxy' not in request.meta:
+            return None
+        domain = urlsplit(request.url).hostname or ''
+        proxy = self._proxy_for(domain)
+        proxy.requests += 1
+        request.meta['proxy'] = proxy.url
+        request.meta['proxy_pool_proxy'] = proxy.url
+        return None
+
+    def process_response(self, request, response, spider):
+        proxy = self.by_url.get(request.meta.get('proxy_pool_proxy'))
+        if proxy is None:
+            return response
+        if response.status in self.ban_codes:
+            proxy.bans += 1
+            self._record(proxy, False, reason=f'HTTP {response.status}')
+            return self._retry(request, proxy, f'HTTP {response.status}', spider) or response
+        self._record(proxy, True, latency=request.meta.get('download_latency'))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        proxy = self.by_url.get(request.meta.get('proxy_pool_proxy'))
+        if proxy is None:
+            return None
+        reason = type(exception).__name__
+        self._record(proxy, False, reason=reason)
+        return self._retry(request, proxy, reason, spider)
+
+    def spider_closed(self, spider):
+        lines = []
+        for proxy in sorted(self.proxies, key=lambda p: p.score()):
+            stats = {
+                'requests': proxy.requests,
+                'successes': proxy.successes,
+                'failures': proxy.failures,
+                'bans': proxy.bans,
+                'evictions': proxy.evictions,
+                'latency_ms': round(proxy.latency * 1000) if proxy.latency is not None else None,
+            }
+            if self.stats is not None:
+                for key, value in stats.items():
+                    if value is not None:
+                        self.stats.set_value(f'proxy_pool/{proxy.name}/{key}', value, spider=spider)
+            lines.append(f'{proxy.name}: ' + ', '.join(f'{k}={v}' for k, v in stats.items()))
+        logger.info('Статистика прокси:\n%s', '\n'.join(lines))
+
+
+class IncrementalMiddleware:
+    """
+    Инкрементальный сбор: условные запросы по индексу прошлых сборов.
+
+    К GET-запросам уже загружавшихся страниц добавляются If-None-Match и
+    If-Modified-Since. На ответ 304 сайт тело не присылает, а паук получает
+    сохранённое тело из индекса, чтобы пройти по ссылкам и пагинации; уже
+    выданные элементы отбрасывает IncrementalItemFilter. Запросы с
+    meta['incremental'] = False обрабатываются как обычно.
+
+    Настройки: INCREMENTAL_ENABLED, INCREMENTAL_DB, INCREMENTAL_SCOPE,
+    INCREMENTAL_STORE_BODY (хранить сжатые тела для ответа на 304; без них
+    условные запросы не отправляются, а неизменность определяется по хэшу).
+    Индекс работает в отдельном потоке, методы возвращают Deferred.
+    """
+
+    def __init__(self, db_path, scope, store_body, stats):
+        self.db_path = db_path
+        self.scope = scope
+        self.store_body = store_body
+        self.stats = stats
+        self.index = None
+        self._pool = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('INCREMENTAL_ENABLED'):
+            raise NotConfigured('Инкрементальный сбор выключен')
+        middleware = cls(
+            settings.get('INCREMENTAL_DB', 'crawl_index.db'),
+            settings.get('INCREMENTAL_SCOPE', ''),
+            settings.getbool('INCREMENTAL_STORE_BODY', True),
+            crawler.stats,
+        )
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def _run(self, func, *args, **kwargs):
+        """Выполняет вызов индекса в его потоке и возвращает Deferred."""
+        from twisted.internet import reactor
+        return threads.deferToThreadPool(reactor, self._pool, func, *args, **kwargs)
+
+    def spider_opened(self, spider):
+        # Один поток: соединение SQLite используется строго последовательно,
+        # а чтение, сжатие и запись страниц не останавливают реактор
+        self._pool = ThreadPool(minthreads=1, maxthreads=1, name='incremental-index')
+        self._pool.start()
+        d = self._run(CrawlIndex, self.db_path, self.scope, spider.name)
+        d.addCallback(lambda index: setattr(self, 'index', index))
+        return d
+
+    def spider_closed(self, spider):
+        if self._pool is None:
+            return None
+        index, self.index = self.index, None
+        d = self._run(index.close) if index is not None else defer.succeed(None)
+        d.addErrback(lambda failure: logger.error('Не удалось закрыть индекс: %s', failure.value))
+        d.addBoth(lambda _: self._stop_pool())
+        return d
+
+    def _stop_pool(self):
+        pool, self._pool = self._pool, None
+        pool.stop()
+
+    def _applies(self, request):
+        return self.index is not None and request.method == 'GET' and request.meta.get('incremental', True)
+
+    def process_request(self, request, spider):
+        if not self._applies(request) or 'incremental_page' in request.meta:
+            return None
+        d = self._run(self.index.get_page, request.url)
+        d.addCallback(self._add_conditions, request)
+        return d
+
+    def _add_conditions(self, page, request):
+        request.meta['incremental_page'] = page
+        if page is None:
+            return None
+        # Без сохранённого тела ответ 304 нечем заменить, поэтому условный запрос не отправляем
+        # (в том числе при INCREMENTAL_STORE_BODY = False)
+        if page['body'] is None:
+            return None
+        if page['etag']:
+            request.headers.setdefault('If-None-Match', page['etag'])
+        if page['last_modified']:
+            request.headers.setdefault('If-Modified-Since', page['last_modified'])
+        return None
+
+    def process_response(self, request, response, spider):
+        if not self._applies(request):
+            return response
+        page = request.meta.get('incremental_page')
+        if response.status == 304 and page is not None and page['body'] is not None:
+            # Время загрузки обновляется в фоне: ответ из индекса не ждёт записи
+            self._run(self.index.touch_page, request.url).addErrback(
+                lambda failure: logger.warning('Не удалось обновить страницу в индексе: %s', failure.value)
+            )
+            self.stats.inc_value('incremental/not_modified', spider=spider)
+            self.stats.inc_value('incremental/bytes_saved', len(page['body']), spider=spider)
+            headers = Headers(response.headers)
+            if page['content_type']:
+                headers['Content-Type'] = page['content_type']
+            response_cls = responsetypes.from_args(headers=headers, url=request.url, body=page['body'])
+            return response_cls(
+                url=request.url, status=200, headers=headers, body=page['body'],
+                request=request, flags=response.flags + ['incremental']
+            )
+        if response.status != 200:
+            return response
+        content_type = response.headers.get('Content-Type')
+        d = self._run(
+            self.index.put_page,
+            request.url,
+            etag=(response.headers.get('ETag') or b'').decode('latin-1') or None,
+            last_modified=(response.headers.get('Last-Modified') or b'').decode('latin-1') or None,
+            content_type=content_type.decode('latin-1') if content_type else None,
+            body=response.body,
+            store_body=self.store_body,
+        )
+        d.addCallback(self._count_page, page, response, spider)
+        return d
+
+    def _count_page(self, digest, page, response, spider):
+        if page is not None and page['content_hash'] == digest:
+            self.stats.inc_value('incremental/unchanged', spider=spider)
+        else:
+            self.stats.inc_value('incremental/changed' if page else 'incremental/new', spider=spider)
+        return response
@@ -1,4 +1,374 @@
-# Этот файл содержит шаблоны для пользовательских pipeline Scrapy
+# Этот файл содержит пользовательские pipeline Scrapy
 # Pipeline позволяют обрабатывать и сохранять данные после сбора
 
-# Пример шаблона (оставим пустым для MVP) 
\ No newline at end of file
+import gzip  # Для сжатия экспорта
+import json  # Для записи JSON Lines
+import logging  # Для логирования событий
+import math  # Для размера фильтра Блума
+import os  # Для работы с путями
+import tempfile  # Для уникальных временных файлов
+from collections import deque  # Для очередей пачек приёмников
+
+from itemadapter import ItemAdapter  # Универсальный доступ к полям Item
+from scrapy import signals
+from scrapy.exceptions import DropItem, NotConfigured
+from twisted.internet import defer, task, threads  # Для периодической отправки пачек и записи в потоках
+
+from scrapy_project import sinks
+from scrapy_project.incremental import CrawlIndex, item_hash
+
+logger = logging.getLogger(__name__)
+
+# Сигнал с очередной пачкой элементов: обработчик получает items (список словарей) и spider
+batch_ready = object()
+
+
+class IncrementalItemFilter:
+    """
+    Инкрементальный сбор: пропускает только элементы, которых не было
+    в прошлых сборах этой области (INCREMENTAL_SCOPE). Хэши выданных
+    элементов хранятся в индексе INCREMENTAL_DB вместе со страницами.
+
+    Элемент считается выданным, только если прошёл все пайплайны (сигнал
+    item_scraped), а в индекс хэши попадают при закрытии паука и только
+    при успешном завершении (INCREMENTAL_COMMIT_REASONS): элементы
+    прерванного или упавшего сбора придут снова в следующий раз.
+    """
+
+    def __init__(self, crawler, db_path, scope, commit_reasons):
+        self.crawler = crawler
+        self.db_path = db_path
+        self.scope = scope
+        self.commit_reasons = set(commit_reasons)
+        self.index = None
+        self.delivered = set()  # Хэши элементов этого сбора, прошедших все пайплайны
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('INCREMENTAL_ENABLED'):
+            raise NotConfigured('Инкрементальный сбор выключен')
+        pipeline = cls(
+            crawler,
+            settings.get('INCREMENTAL_DB', 'crawl_index.db'),
+            settings.get('INCREMENTAL_SCOPE', ''),
+            settings.getlist('INCREMENTAL_COMMIT_REASONS', ['finished']),
+        )
+        crawler.signals.connect(pipeline.item_scraped, signal=signals.item_scraped)
+        # Причина завершения известна только в spider_closed (после close_spider пайплайнов)
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.index = CrawlIndex(self.db_path, self.scope, spider.name)
+
+    def process_item(self, item, spider):
+        digest = item_hash(ItemAdapter(item).asdict())
+        if digest in self.delivered or self.index.has_item(digest):
+            self.crawler.stats.inc_value('incremental/items_skipped')
+            raise DropItem('Элемент не изменился с прошлого сбора')
+        return item
+
+    def item_scraped(self, item, spider):
+        digest = item_hash(ItemAdapter(item).asdict())
+        if digest not in self.delivered:
+            self.delivered.add(digest)
+            self.crawler.stats.inc_value('incremental/items_new')
+
+    def spider_closed(self, spider, reason):
+        if self.index is None:
+            return
+        try:
+            if reason in self.commit_reasons:
+                self.index.add_items(self.delivered)
+            else:
+                logger.info('Сбор завершён (%s): %s новых элементов не записаны в индекс', reason, len(self.delivered))
+        finally:
+            self.index.close()
+
+
+class StreamingExportPipeline:
+    """
+    Потоковая выдача результатов.
+
+    Каждый элемент сразу дописывается в сжатый gzip-файл JSON Lines, а в памяти
+    копится только текущая пачка. Пачка отправляется сигналом batch_ready,
+    когда набирается STREAM_BATCH_SIZE элементов или проходит
+    STREAM_BATCH_INTERVAL секунд. Если файл экспорта превысил
+    STREAM_EXPORT_MAX_BYTES, паук останавливается.
+
+    Настройки:
+    STREAM_EXPORT_PATH — путь файла экспорта (по умолчанию — уникальный временный файл)
+    STREAM_BATCH_SIZE — размер пачки (по умолчанию 20)
+    STREAM_BATCH_INTERVAL — максимальный интервал между пачками в секундах (по умолчанию 10)
+    STREAM_EXPORT_MAX_BYTES — предельный размер сжатого файла (по умолчанию 45 МБ)
+    """
+
+    def __init__(self, crawler, path, batch_size, interval, max_bytes):
+        self.crawler = crawler
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.batch = []
+        self.items = 0
+        self._raw = None
+        self._gz = None
+        self._timer = None
+        self._closing = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            crawler,
+            path=settings.get('STREAM_EXPORT_PATH'),
+            batch_size=settings.getint('STREAM_BATCH_SIZE', 20),
+            interval=settings.getfloat('STREAM_BATCH_INTERVAL', 10),
+            max_bytes=settings.getint('STREAM_EXPORT_MAX_BYTES', 45 * 1024 * 1024),
+        )
+
+    def open_spider(self, spider):
+        if not self.path:
+            fd, self.path = tempfile.mkstemp(prefix=f'{spider.name}_', suffix='.jsonl.gz')
+            os.close(fd)
+        self._raw = open(self.path, 'wb')
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        self._timer = task.LoopingCall(self._flush, spider)
+        self._timer.start(self.interval, now=False)
+        self.crawler.stats.set_value('stream/path', self.path)
+        logger.info('Экспорт результатов в %s', self.path)
+
+    def process_item(self, item, spider):
+        data = ItemAdapter(item).asdict()
+        self._gz.write(json.dumps(data, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.batch.append(data)
+        self.items += 1
+        if len(self.batch) >= self.batch_size:
+            self._flush(spider)
+        if self._raw.tell() > self.max_bytes and not self._closing:
+            self._closing = True
+            logger.warning('Файл экспорта превысил %s байт, останавливаю паука', self.max_bytes)
+            self.crawler.engine.close_spider(spider, 'export_size_exceeded')
+        return item
+
+    def _flush(self, spider):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        self.crawler.stats.inc_value('stream/batches')
+        self.crawler.signals.send_catch_log(signal=batch_ready, items=batch, spider=spider)
+
+    def close_spider(self, spider):
+        if self._timer is not None and self._timer.running:
+            self._timer.stop()
+        self._flush(spider)
+        self._gz.close()
+        self._raw.close()
+        self.crawler.stats.set_value('stream/items', self.items)
+        self.crawler.stats.set_value('stream/bytes', os.path.getsize(self.path))
+
+
+class BloomFilter:
+    """
+    Множество хэшей фиксированного размера. Память не растёт с числом элементов:
+    на capacity элементов с долей ложных срабатываний error_rate нужно около
+    1.44 * log2(1 / error_rate) бит на элемент. Ложное срабатывание — новый
+    элемент принят за повтор; повтор не пропускается никогда.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, digest):
+        """Добавляет hex-хэш; возвращает False, если он (вероятно) уже был."""
+        # Двойное хэширование: k позиций из двух половин sha1
+        h1, h2 = int(digest[:16], 16), int(digest[16:32], 16) | 1
+        new = False
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % self.size
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                new = True
+        return new
+
+
+class SinkWriter:
+    """
+    Очередь пачек одного приёмника. Запись идёт в пуле потоков, по одной пачке
+    за раз; в очереди не больше max_pending пачек. Когда очередь полна, put()
+    возвращает Deferred, который сработает после освобождения места, — пайплайн
+    ждёт его, и Scrapy перестаёт принимать новые элементы (обратное давление).
+    Неудачная пачка повторяется retries раз с растущей паузой, затем отбрасывается.
+    """
+
+    def __init__(self, sink, stats, max_pending, retries):
+        self.sink = sink
+        self.stats = stats
+        self.max_pending = max_pending
+        self.retries = retries
+        self.pending = deque()
+        self.waiters = deque()  # (Deferred, пачка), ожидающие места в очереди
+        self.drained = []  # Deferred, ожидающие опустошения очереди
+        self.busy = False
+
+    def _stat(self, key, count=1):
+        self.stats.inc_value(f'sinks/{self.sink.name}/{key}', count)
+
+    def put(self, batch):
+        if len(self.pending) < self.max_pending:
+            self.pending.append(batch)
+            self._next()
+            return defer.succeed(None)
+        self._stat('backpressure')
+        d = defer.Deferred()
+        self.waiters.append((d, batch))
+        return d
+
+    def drain(self):
+        if not self.busy and not self.pending and not self.waiters:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.drained.append(d)
+        return d
+
+    def _next(self):
+        if self.busy:
+            return
+        if not self.pending:
+            drained, self.drained = self.drained, []
+            for d in drained:
+                d.callback(None)
+            return
+        batch = self.pending.popleft()
+        if self.waiters:
+            d, waiting = self.waiters.popleft()
+            self.pending.append(waiting)
+            d.callback(None)
+        self.busy = True
+        self._write(batch).addBoth(self._done)
+
+    def _done(self, _):
+        self.busy = False
+        self._next()
+
+    @defer.inlineCallbacks
+    def _write(self, batch):
+        from twisted.internet import reactor
+        for attempt in range(self.retries + 1):
+            try:
+                yield threads.deferToThread(self.sink.write, batch)
+            except Exception as e:
+                if attempt == self.retries:
+                    self._stat('errors')
+                    self._stat('items_dropped', len(batch))
+                    logger.error('Приёмник %s: пачка из %s элементов отброшена: %s', self.sink.name, len(batch), e)
+                    return
+                self._stat('retries')
+                logger.warning('Приёмник %s: ошибка записи (%s), повтор %s', self.sink.name, e, attempt + 1)
+                yield task.deferLater(reactor, 2 ** attempt, lambda: None)
+            else:
+                self._stat('batches')
+                self._stat('items', len(batch))
+                return
+
+
+class DedupBatchPipeline:
+    """
+    Удаление повторов и пакетная запись в приёмники.
+
+    Повтор определяется по хэшу содержимого элемента через фильтр Блума
+    (память фиксирована). Новые элементы копятся в буфере и пачками уходят
+    во все приёмники ITEM_SINKS (см. scrapy_project/sinks.py); у каждого
+    приёмника своя ограниченная очередь, поэтому медленный приёмник
+    притормаживает сбор, а не копит элементы в памяти.
+
+    Настройки:
+    DEDUP_ENABLED — удалять повторы (по умолчанию включено)
+    DEDUP_CAPACITY, DEDUP_ERROR_RATE — размер фильтра Блума
+    ITEM_SINKS — адреса приёмников
+    ITEM_SINK_BATCH_SIZE, ITEM_SINK_FLUSH_INTERVAL — размер пачки и интервал между пачками
+    ITEM_SINK_MAX_PENDING — пачек в очереди одного приёмника
+    ITEM_SINK_RETRIES — повторов записи пачки
+    """
+
+    def __init__(self, crawler, sink_uris, dedup, capacity, error_rate, batch_size, interval, max_pending, retries):
+        self.crawler = crawler
+        self.sink_uris = sink_uris
+        self.dedup = dedup
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.retries = retries
+        self.seen = None
+        self.writers = []
+        self.buffer = []
+        self._timer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        sink_uris = settings.getlist('ITEM_SINKS')
+        dedup = settings.getbool('DEDUP_ENABLED', True)
+        if not dedup and not sink_uris:
+            raise NotConfigured('Удаление повторов выключено, приёмники не заданы')
+        return cls(
+            crawler,
+            sink_uris=sink_uris,
+            dedup=dedup,
+            capacity=settings.getint('DEDUP_CAPACITY', 1_000_000),
+            error_rate=settings.getfloat('DEDUP_ERROR_RATE', 0.001),
+            batch_size=settings.getint('ITEM_SINK_BATCH_SIZE', 100),
+            interval=settings.getfloat('ITEM_SINK_FLUSH_INTERVAL', 5),
+            max_pending=settings.getint('ITEM_SINK_MAX_PENDING', 4),
+            retries=settings.getint('ITEM_SINK_RETRIES', 3),
+        )
+
+    def open_spider(self, spider):
+        if self.dedup:
+            self.seen = BloomFilter(self.capacity, self.error_rate)
+        self.writers = [
+            SinkWriter(sinks.from_uri(uri), self.crawler.stats, self.max_pending, self.retries)
+            for uri in self.sink_uris
+        ]
+        if self.writers:
+            self._timer = task.LoopingCall(self._flush)
+            self._timer.start(self.interval, now=False)
+            logger.info('Приёмники элементов: %s', ', '.join(w.sink.name for w in self.writers))
+
+    def process_item(self, item, spider):
+        data = ItemAdapter(item).asdict()
+        digest = item_hash(data)
+        if self.seen is not None and not self.seen.add(digest):
+            self.crawler.stats.inc_value('dedup/duplicates')
+            raise DropItem('Повтор элемента')
+        if not self.writers:
+            return item
+        self.buffer.append({**data, '_hash': digest})
+        if len(self.buffer) >= self.batch_size:
+            # Элемент идёт дальше, когда пачку приняли все приёмники
+            return self._flush().addCallback(lambda _: item)
+        return item
+
+    def _flush(self):
+        if not self.buffer:
+            return defer.succeed(None)
+        batch, self.buffer = self.buffer, []
+        return defer.DeferredList([writer.put(batch) for writer in self.writers])
+
+    @defer.inlineCallbacks
+    def close_spider(self, spider):
+        if self._timer is not None and self._timer.running:
+            self._timer.stop()
+        yield self._flush()
+        yield defer.DeferredList([writer.drain() for writer in self.writers])
+        for writer in self.writers:
+            try:
+                yield threads.deferToThread(writer.sink.close)
+            except Exception:
+                logger.exception('Ошибка при закрытии приёмника %s', writer.sink.name)
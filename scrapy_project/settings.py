@@ -1,4 +1,7 @@
 # Файл настроек Scrapy
+# Значения по умолчанию для всех задач; бот переопределяет их для каждой задачи
+# по профилю и параметрам пользователя (см. scrapy_project/profiles.py)
+import os
 
 BOT_NAME = "scrapy_project"  # Имя бота Scrapy
 
@@ -9,9 +12,83 @@ NEWSPIDER_MODULE = "scrapy_project.spiders"  # Где создавать нов
 ROBOTSTXT_OBEY = True
 
 # Задержка между запросами (по умолчанию 1 секунда)
-DOWNLOAD_DELAY = 1
+DOWNLOAD_DELAY = float(os.environ.get("SCRAPY_DOWNLOAD_DELAY", 1))
 
-# Максимальное количество одновременных запросов
-CONCURRENT_REQUESTS = 8
+# Максимальное количество одновременных запросов (всего и на один домен)
+CONCURRENT_REQUESTS = int(os.environ.get("SCRAPY_CONCURRENT_REQUESTS", 8))
+CONCURRENT_REQUESTS_PER_DOMAIN = int(os.environ.get("SCRAPY_CONCURRENT_REQUESTS_PER_DOMAIN", 8))
 
-# Прочие настройки можно добавить по мере необходимости 
\ No newline at end of file
+# User-Agent (если не задан — стандартный User-Agent Scrapy)
+if os.environ.get("SCRAPY_USER_AGENT"):
+    USER_AGENT = os.environ["SCRAPY_USER_AGENT"]
+
+# Прокси по умолчанию (пусто — без прокси)
+PROXY = os.environ.get("SCRAPY_PROXY", "")
+
+# Пул прокси с ротацией и оценкой состояния (через запятую); PROXY тоже попадает в пул
+DOWNLOADER_MIDDLEWARES = {
+    # После RetryMiddleware (550): ошибки и баны сначала видит пул и повторяет через другой прокси;
+    # до HttpProxyMiddleware (750), которая применяет meta['proxy']
+    "scrapy_project.middlewares.ProxyPoolMiddleware": 700,
+    # После распаковки ответа (HttpCompressionMiddleware, 590): в индекс попадает распакованное тело
+    "scrapy_project.middlewares.IncrementalMiddleware": 580,
+}
+PROXY_POOL = [p for p in os.environ.get("SCRAPY_PROXY_POOL", "").split(",") if p.strip()]
+PROXY_POOL_BAN_CODES = [403, 407, 429, 503]  # Ответы, означающие бан или перегрузку прокси
+PROXY_POOL_MAX_RETRIES = 3  # Сколько раз повторить запрос через другой прокси
+PROXY_POOL_EVICT_ERROR_RATE = 0.5  # Доля ошибок среди последних запросов, после которой прокси исключается
+PROXY_POOL_MIN_REQUESTS = 5  # Минимум запросов для оценки доли ошибок
+PROXY_POOL_WINDOW = 20  # Сколько последних запросов учитывать
+PROXY_POOL_REPROBE_INTERVAL = 60  # Через сколько секунд исключённый прокси получает пробный запрос
+
+# AutoThrottle: подстраивает задержку под время ответа сайта
+AUTOTHROTTLE_ENABLED = os.environ.get("SCRAPY_AUTOTHROTTLE", "0") == "1"
+AUTOTHROTTLE_START_DELAY = float(os.environ.get("SCRAPY_AUTOTHROTTLE_START_DELAY", 1))
+AUTOTHROTTLE_MAX_DELAY = float(os.environ.get("SCRAPY_AUTOTHROTTLE_MAX_DELAY", 30))
+AUTOTHROTTLE_TARGET_CONCURRENCY = float(os.environ.get("SCRAPY_AUTOTHROTTLE_TARGET", 1))
+
+# HTTP-кэш: повторные запросы тех же страниц не уходят в сеть
+HTTPCACHE_ENABLED = os.environ.get("SCRAPY_HTTPCACHE", "0") == "1"
+HTTPCACHE_EXPIRATION_SECS = int(os.environ.get("SCRAPY_HTTPCACHE_EXPIRATION", 3600))
+HTTPCACHE_DIR = os.environ.get("SCRAPY_HTTPCACHE_DIR", "httpcache")
+
+# Потоковая выдача результатов: gzip JSON Lines + пачки элементов для бота
+ITEM_PIPELINES = {
+    "scrapy_project.pipelines.IncrementalItemFilter": 100,
+    "scrapy_project.pipelines.DedupBatchPipeline": 300,
+    "scrapy_project.pipelines.StreamingExportPipeline": 800,
+}
+STREAM_BATCH_SIZE = 20  # Элементов в одной пачке
+STREAM_BATCH_INTERVAL = 10  # Секунд между пачками
+STREAM_EXPORT_MAX_BYTES = 45 * 1024 * 1024  # Лимит Telegram на файлы — 50 МБ
+
+# Инкрементальный сбор: условные запросы и только новые элементы (см. scrapy_project/incremental.py)
+INCREMENTAL_ENABLED = os.environ.get("SCRAPY_INCREMENTAL", "0") == "1"
+INCREMENTAL_DB = os.environ.get("SCRAPY_INCREMENTAL_DB", "crawl_index.db")
+INCREMENTAL_SCOPE = ""  # Область индекса; бот задаёт её по пользователю
+INCREMENTAL_STORE_BODY = True  # Хранить сжатые тела страниц, чтобы на 304 пройти по ссылкам
+# Причины завершения, при которых выданные элементы записываются в индекс (item_limit — лимит паука)
+INCREMENTAL_COMMIT_REASONS = ["finished", "item_limit"]
+
+# Удаление повторов и пакетная запись в приёмники (см. scrapy_project/sinks.py)
+DEDUP_ENABLED = os.environ.get("SCRAPY_DEDUP", "1") == "1"
+DEDUP_CAPACITY = 1_000_000  # Элементов в фильтре Блума (~1.8 МБ при DEDUP_ERROR_RATE 0.001)
+DEDUP_ERROR_RATE = 0.001  # Доля новых элементов, ошибочно принятых за повторы
+# Адреса приёмников через запятую: jsonl:///data/items.jsonl, sqlite:///data/items.db,
+# kafka://kafka:9092/items, wp+http://wp-publisher:8081
+ITEM_SINKS = [s for s in os.environ.get("SCRAPY_ITEM_SINKS", "").split(",") if s.strip()]
+ITEM_SINK_BATCH_SIZE = 100  # Элементов в пачке
+ITEM_SINK_FLUSH_INTERVAL = 5  # Секунд между пачками
+ITEM_SINK_MAX_PENDING = 4  # Пачек в очереди приёмника, дальше сбор ждёт
+ITEM_SINK_RETRIES = 3  # Повторов записи пачки
+
+# Обход в ширину: приоритет запроса снижается с глубиной, очереди планировщика — FIFO.
+# Ближние к стартовым страницы (и элементы с них) приходят первыми
+DEPTH_PRIORITY = 1
+SCHEDULER_DISK_QUEUE = "scrapy.squeues.PickleFifoDiskQueue"
+SCHEDULER_MEMORY_QUEUE = "scrapy.squeues.FifoMemoryQueue"
+# Лимиты паука по умолчанию (аргументы max_depth и max_items их переопределяют)
+SPIDER_MAX_DEPTH = int(os.environ.get("SCRAPY_MAX_DEPTH", 3))
+SPIDER_MAX_ITEMS = int(os.environ.get("SCRAPY_MAX_ITEMS", 1000))
+
+# Прочие настройки можно добавить по мере необходимости 
@@ -0,0 +1,189 @@
+"""
+Приёмники пачек элементов для DedupBatchPipeline.
+
+Приёмник задаётся адресом (настройка ITEM_SINKS, переменная SCRAPY_ITEM_SINKS):
+    jsonl:///путь/items.jsonl       — дописывает JSON Lines в файл
+    sqlite:///путь/items.db?table=items — вставляет пачку одним executemany
+    kafka://host:9092/topic         — отправляет в топик через общий продюсер
+    wp+http://wp-publisher:8081     — ставит статьи в очередь wp-publisher (/publish)
+
+Методы write() и close() блокирующие: пайплайн вызывает их в пуле потоков
+реактора, по одному вызову на приёмник за раз.
+"""
+import json  # Для сериализации элементов
+import logging  # Для логирования событий
+import sqlite3  # Для приёмника SQLite
+import threading  # Для общего продюсера Kafka
+import time  # Для времени вставки
+from abc import ABC, abstractmethod  # Для базового класса приёмника
+from html import escape  # Для текста статьи
+from urllib.parse import parse_qs, urlsplit  # Для разбора адреса приёмника
+
+import requests  # Для запросов к wp-publisher
+
+try:
+    from kafka import KafkaProducer  # Необязательная зависимость: нужна только приёмнику kafka://
+except ImportError:
+    KafkaProducer = None
+
+logger = logging.getLogger(__name__)
+
+
+class SinkError(Exception):
+    """Приёмник не настроен или не может принять пачку."""
+
+
+class Sink(ABC):
+    """Базовый приёмник: write() получает список словарей с полем _hash."""
+
+    name = 'sink'
+
+    @abstractmethod
+    def write(self, items):
+        """Записывает пачку; ошибка означает, что пачку нужно повторить."""
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink(Sink):
+    def __init__(self, path):
+        self.name = f'jsonl:{path}'
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, items):
+        self._file.write(''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class SqliteSink(Sink):
+    def __init__(self, path, table='items'):
+        if not table.isidentifier():
+            raise SinkError(f'Недопустимое имя таблицы: {table}')
+        self.name = f'sqlite:{path}'
+        self.table = table
+        # Вызовы идут из разных потоков пула, но никогда одновременно
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} (hash TEXT PRIMARY KEY, data TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    def write(self, items):
+        now = time.time()
+        with self._conn:  # Одна транзакция на пачку
+            self._conn.executemany(
+                f'INSERT OR IGNORE INTO {self.table} (hash, data, created_at) VALUES (?, ?, ?)',
+                [(item['_hash'], json.dumps(item, ensure_ascii=False), now) for item in items]
+            )
+
+    def close(self):
+        self._conn.close()
+
+
+# --- Kafka: один продюсер на bootstrap-серверы для всех сборов процесса ---
+_producers = {}  # bootstrap -> [KafkaProducer, число пользователей]
+_producers_lock = threading.Lock()
+
+
+def _acquire_producer(bootstrap):
+    with _producers_lock:
+        entry = _producers.get(bootstrap)
+        if entry is None:
+            producer = KafkaProducer(
+                bootstrap_servers=bootstrap.split(','),
+                client_id='scrapy-item-sink',
+                linger_ms=20,
+                compression_type='gzip',
+                acks=1,
+                value_serializer=lambda v: json.dumps(v, ensure_ascii=False).encode('utf-8'),
+                key_serializer=lambda k: k.encode('utf-8'),
+            )
+            entry = _producers[bootstrap] = [producer, 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def _release_producer(bootstrap):
+    with _producers_lock:
+        entry = _producers[bootstrap]
+        entry[1] -= 1
+        if entry[1] > 0:
+            entry[0].flush()
+            return
+        del _producers[bootstrap]
+    entry[0].close()
+
+
+class KafkaSink(Sink):
+    def __init__(self, bootstrap, topic, timeout=30):
+        if KafkaProducer is None:
+            raise SinkError('Для приёмника kafka:// установите kafka-python')
+        self.name = f'kafka:{topic}'
+        self.bootstrap = bootstrap
+        self.topic = topic
+        self.timeout = timeout
+        self._producer = _acquire_producer(bootstrap)
+
+    def write(self, items):
+        futures = [self._producer.send(self.topic, key=item['_hash'], value=item) for item in items]
+        self._producer.flush(timeout=self.timeout)
+        for future in futures:
+            future.get(timeout=self.timeout)  # Поднимет ошибку доставки
+
+    def close(self):
+        _release_producer(self.bootstrap)
+
+
+class WordPressSink(Sink):
+    """
+    Ставит элементы в очередь публикации wp-publisher. Хэш элемента служит
+    Idempotency-Key, поэтому повтор пачки после ошибки не создаёт дублей.
+    """
+
+    def __init__(self, base_url, timeout=30):
+        self.name = f'wp:{base_url}'
+        self.url = base_url.rstrip('/') + '/publish'
+        self.timeout = timeout
+        self._session = requests.Session()  # Keep-alive между запросами
+
+    @staticmethod
+    def article(item):
+        title = item.get('title') or item.get('url') or 'Без названия'
+        content = f'<p>{escape(title)}</p>'
+        if item.get('url'):
+            content += f'<p><a href="{escape(item["url"])}">{escape(item["url"])}</a></p>'
+        return {'title': title[:200], 'content': content}
+
+    def write(self, items):
+        for item in items:
+            resp = self._session.post(
+                self.url, json=self.article(item), headers={'Idempotency-Key': item['_hash']}, timeout=self.timeout
+            )
+            resp.raise_for_status()
+
+    def close(self):
+        self._session.close()
+
+
+def from_uri(uri):
+    """Создаёт приёмник по адресу."""
+    parts = urlsplit(uri.strip())
+    if parts.scheme == 'jsonl':
+        return JsonLinesSink(parts.netloc + parts.path)
+    if parts.scheme == 'sqlite':
+        table = parse_qs(parts.query).get('table', ['items'])[0]
+        return SqliteSink(parts.netloc + parts.path, table)
+    if parts.scheme == 'kafka':
+        topic = parts.path.strip('/')
+        if not parts.netloc or not topic:
+            raise SinkError(f'Ожидается kafka://host:port/topic, получено {uri}')
+        return KafkaSink(parts.netloc, topic)
+    if parts.scheme in ('wp+http', 'wp+https'):
+        return WordPressSink(f'{parts.scheme[3:]}://{parts.netloc}{parts.path}')
+    raise SinkError(f'Неизвестный приёмник: {uri}')
@@ -1,18 +1,94 @@
+import itertools  # Для чередования стартовых URL по доменам
+import re  # Для разбора списка стартовых URL
+from urllib.parse import urlsplit  # Для домена URL
+
 import scrapy  # Импортируем модуль scrapy
+from scrapy import signals
+from scrapy.linkextractors import LinkExtractor  # Для ссылок внутри разрешённых доменов
 from scrapy_project.items import ExampleItem  # Импортируем наш Item
 
 # Определяем класс паука, наследуемый от scrapy.Spider
 class ExampleSpider(scrapy.Spider):
+    """
+    Паук с обходом в ширину.
+
+    Аргументы (из бота или командной строки, -a имя=значение):
+    seeds — стартовые URL через пробел или запятую (по умолчанию start_urls);
+    seeds_file — файл со стартовыми URL, по одному в строке;
+    max_depth — сколько переходов по ссылкам от стартовых страниц (SPIDER_MAX_DEPTH),
+                страницы пагинации глубину не увеличивают;
+    max_items — после стольких элементов, прошедших все пайплайны, паук
+                останавливается (SPIDER_MAX_ITEMS);
+    follow_links — переходить ли по ссылкам внутри доменов, кроме пагинации (1/0).
+    """
     name = "example"  # Имя паука, используется для запуска
     allowed_domains = ["quotes.toscrape.com"]  # Разрешённые домены для обхода
     start_urls = ["http://quotes.toscrape.com/"]  # Список стартовых URL
 
+    # Приоритеты: страницы пагинации раньше прочих ссылок, чтобы элементы приходили быстрее
+    PAGINATION_PRIORITY = 10
+    LINK_PRIORITY = 0
+
+    def __init__(self, seeds=None, seeds_file=None, max_depth=None, max_items=None, follow_links='1', *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        urls = re.split(r'[\s,]+', seeds or '')
+        if seeds_file:
+            with open(seeds_file, encoding='utf-8') as f:
+                urls += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        urls = [u if '://' in u else f'http://{u}' for u in urls if u]
+        if urls:
+            self.start_urls = list(dict.fromkeys(urls))
+            self.allowed_domains = sorted({urlsplit(u).hostname for u in self.start_urls if urlsplit(u).hostname})
+        self._max_depth = max_depth
+        self._max_items = max_items
+        self.follow_links = str(follow_links).lower() in ('1', 'true', 'on', 'yes')
+        self.items_scraped = 0
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        settings = crawler.settings
+        spider.max_depth = int(spider._max_depth if spider._max_depth is not None else settings.getint('SPIDER_MAX_DEPTH', 3))
+        spider.max_items = int(spider._max_items if spider._max_items is not None else settings.getint('SPIDER_MAX_ITEMS', 1000))
+        spider.link_extractor = LinkExtractor(allow_domains=spider.allowed_domains)
+        # Считаем только элементы, прошедшие пайплайны: отброшенные повторы лимит не расходуют
+        crawler.signals.connect(spider.item_scraped, signal=signals.item_scraped)
+        return spider
+
+    def start_requests(self):
+        # Чередуем стартовые URL разных доменов: каждый домен получает свой слот
+        # загрузчика, и параллельность используется с первых запросов
+        by_domain = {}
+        for url in self.start_urls:
+            by_domain.setdefault(urlsplit(url).hostname, []).append(url)
+        for url in itertools.chain.from_iterable(itertools.zip_longest(*by_domain.values())):
+            if url:
+                yield scrapy.Request(url, callback=self.parse, priority=self.PAGINATION_PRIORITY)
+
     def parse(self, response):
         # Метод parse вызывается для обработки ответа на каждый URL
+        if not hasattr(response, 'css'):
+            return  # Не HTML (например, файл по ссылке)
         for quote in response.css("div.quote"):
             item = ExampleItem()  # Создаём экземпляр Item
             # Извлекаем текст цитаты
             item["title"] = quote.css("span.text::text").get()
             # Сохраняем URL страницы
             item["url"] = response.url
-            yield item  # Возвращаем результат 
\ No newline at end of file
+            yield item
+
+        # Пагинация: та же глубина по ссылкам, повышенный приоритет
+        link_depth = response.meta.get('link_depth', 0)
+        for href in response.css("li.next a::attr(href), a[rel=next]::attr(href)").getall():
+            yield response.follow(href, callback=self.parse, priority=self.PAGINATION_PRIORITY,
+                                  meta={'link_depth': link_depth})
+        # Остальные ссылки внутри разрешённых доменов
+        if self.follow_links and link_depth < self.max_depth:
+            for link in self.link_extractor.extract_links(response):
+                yield response.follow(link, callback=self.parse, priority=self.LINK_PRIORITY,
+                                      meta={'link_depth': link_depth + 1})
+
+    def item_scraped(self, item, spider):
+        self.items_scraped += 1
+        if self.items_scraped == self.max_items:
+            self.crawler.engine.close_spider(self, 'item_limit')
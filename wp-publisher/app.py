@@ -1,7 +1,18 @@
 import os
-from fastapi import FastAPI, HTTPException
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import httpx
+import health  # /health и /metrics
+from instrumentation import instrument, outbound, start_loop_monitor  # Метрики Prometheus
+from job_queue import JobQueue  # Постоянная очередь публикаций
+from taxonomy import TaxonomyIndex, TaxonomyError  # Кэш рубрик и меток
+
+logging.basicConfig(level=logging.INFO)
 
 def get_secret(path, default=None):
     try:
@@ -15,39 +26,200 @@ WP_URL = get_secret(os.environ.get('WP_URL_FILE', '/run/secrets/wp_url'))
 WP_USER = get_secret(os.environ.get('WP_USER_FILE', '/run/secrets/wp_user'))
 WP_PASSWORD = get_secret(os.environ.get('WP_PASSWORD_FILE', '/run/secrets/wp_password'))
 
-app = FastAPI()
+# Настройки HTTP-клиента WordPress
+WP_TIMEOUT = float(os.environ.get('WP_TIMEOUT', 10))
+WP_HTTP2 = os.environ.get('WP_HTTP2', '1') == '1'
+WP_MAX_CONNECTIONS = int(os.environ.get('WP_MAX_CONNECTIONS', 20))
+WP_KEEPALIVE_EXPIRY = float(os.environ.get('WP_KEEPALIVE_EXPIRY', 60))
+# Пакетная публикация: сколько статей публикуется одновременно и максимум статей в запросе
+WP_BATCH_CONCURRENCY = int(os.environ.get('WP_BATCH_CONCURRENCY', 8))
+WP_BATCH_MAX_ITEMS = int(os.environ.get('WP_BATCH_MAX_ITEMS', 500))
+
+# Фоновая доставка из очереди: число воркеров и максимальный интервал проверки очереди
+PUBLISH_WORKERS = int(os.environ.get('PUBLISH_WORKERS', 4))
+PUBLISH_POLL_INTERVAL = float(os.environ.get('PUBLISH_POLL_INTERVAL', 5))
+
+# Общий клиент с пулом соединений (создаётся при старте приложения)
+wp_client: httpx.AsyncClient = None
+# Очередь публикаций и сигнал воркерам о новой задаче
+job_queue = JobQueue()
+# Индекс рубрик и меток: названия переводятся в id без запросов к WordPress
+taxonomy_index = TaxonomyIndex()
+job_ready = asyncio.Event()
+# Общий лимит одновременных публикаций из пакетных запросов
+batch_semaphore = asyncio.Semaphore(WP_BATCH_CONCURRENCY)
+
+class WordPressError(Exception):
+    """Ошибка публикации: код ответа WordPress (или 502 при сетевой ошибке) и текст."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global wp_client
+    # Соединения с WordPress переиспользуются между запросами (keep-alive, HTTP/2)
+    wp_client = httpx.AsyncClient(
+        base_url=WP_URL or '',
+        auth=(WP_USER or '', WP_PASSWORD or ''),
+        http2=WP_HTTP2,
+        timeout=WP_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=WP_MAX_CONNECTIONS,
+            max_keepalive_connections=WP_MAX_CONNECTIONS,
+            keepalive_expiry=WP_KEEPALIVE_EXPIRY
+        )
+    )
+    await taxonomy_index.start(wp_client)
+    recovered = await job_queue.init()
+    if recovered:
+        logging.info(f'Возвращено в очередь прерванных задач: {recovered}')
+    workers = [asyncio.create_task(publish_worker(), name=f'publish-worker-{i}') for i in range(PUBLISH_WORKERS)]
+    monitor = start_loop_monitor()
+    yield
+    monitor.cancel()
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await taxonomy_index.stop()
+    await wp_client.aclose()
+    await job_queue.close()
 
-# Модель запроса
+app = FastAPI(lifespan=lifespan)
+# /health и /metrics обслуживаются тем же процессом, что и публикация
+app.include_router(health.app.router)
+
+# Модель запроса: рубрики и метки — id или названия
 class Article(BaseModel):
     title: str
     content: str
-    categories: list[int] = []
-    tags: list[int] = []
+    categories: list[int | str] = []
+    tags: list[int | str] = []
 
-# Эндпоинт публикации статьи
-@app.post('/publish')
-async def publish_article(article: Article):
+# Публикация одной статьи через REST API WordPress
+async def _post_to_wp(article: Article):
+    # Названия рубрик и меток переводим в id через кэш
+    try:
+        categories = await taxonomy_index.resolve('categories', article.categories)
+        tags = await taxonomy_index.resolve('tags', article.tags)
+    except TaxonomyError as e:
+        raise WordPressError(422, str(e))
+    except httpx.HTTPStatusError as e:
+        raise WordPressError(e.response.status_code, e.response.text)
+    except httpx.HTTPError as e:
+        raise WordPressError(502, str(e) or type(e).__name__)
     # Формируем данные для WordPress
     data = {
         'title': article.title,
         'content': article.content,
         'status': 'publish',
-        'categories': article.categories,
-        'tags': article.tags
+        'categories': categories,
+        'tags': tags
     }
-    # Публикуем через REST API WordPress
-    async with httpx.AsyncClient() as client:
+    try:
+        with outbound('wordpress') as call:
+            resp = await wp_client.post('/wp-json/wp/v2/posts', json=data)
+            if resp.status_code >= 400:
+                call.fail(f'HTTP {resp.status_code}')
+    except httpx.HTTPError as e:
+        raise WordPressError(502, str(e) or type(e).__name__)
+    if not 200 <= resp.status_code < 300:
+        raise WordPressError(resp.status_code, resp.text)
+    # Пост уже создан: ответ, который не удалось разобрать, не должен привести к повтору и дублю
+    try:
+        post = resp.json()
+    except ValueError:
+        post = None
+    if not isinstance(post, dict):
+        logging.warning(f'WordPress ответил {resp.status_code} без JSON-описания поста, ссылка неизвестна')
+        post = {}
+    return {'status': 'ok', 'url': post.get('link'), 'id': post.get('id')}
+
+# Повторять имеет смысл только временные ошибки: перегрузку, 5xx и сетевые сбои (502)
+def _is_retryable(status_code):
+    return status_code == 429 or status_code >= 500
+
+# Воркер доставки: забирает задачи из очереди и публикует с повторами
+async def publish_worker():
+    while True:
+        job_ready.clear()
+        job = await job_queue.claim()
+        if job is None:
+            due = await job_queue.next_due()
+            wait = PUBLISH_POLL_INTERVAL if due is None else min(PUBLISH_POLL_INTERVAL, max(0.05, due - time.time()))
+            try:
+                await asyncio.wait_for(job_ready.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            continue
         try:
-            resp = await client.post(
-                f'{WP_URL}/wp-json/wp/v2/posts',
-                auth=(WP_USER, WP_PASSWORD),
-                json=data,
-                timeout=10
-            )
-            if resp.status_code == 201:
-                post = resp.json()
-                return {'status': 'ok', 'url': post.get('link'), 'id': post.get('id')}
-            else:
-                raise HTTPException(status_code=resp.status_code, detail=resp.text)
+            result = await _post_to_wp(Article(**job['payload']))
+        except WordPressError as e:
+            status = await job_queue.retry_or_fail(job, f'HTTP {e.status_code}: {e.detail[:500]}', _is_retryable(e.status_code))
+            logging.warning(f'Задача {job["id"]}, попытка {job["attempts"]}: HTTP {e.status_code}, статус {status}')
         except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+            status = await job_queue.retry_or_fail(job, str(e) or type(e).__name__)
+            logging.exception(f'Задача {job["id"]}, попытка {job["attempts"]}: статус {status}')
+        else:
+            await job_queue.complete(job['id'], result)
+
+# Эндпоинт публикации статьи: статья ставится в очередь, ответ приходит сразу.
+# Повторная отправка с тем же Idempotency-Key (или той же статьи без ключа) возвращает существующую задачу.
+@app.post('/publish')
+@instrument()
+async def publish_article(article: Article, idempotency_key: str | None = Header(default=None)):
+    job, created = await job_queue.enqueue(article.model_dump(), idempotency_key)
+    if created:
+        job_ready.set()
+    return JSONResponse(
+        {'job_id': job['id'], 'status': job['status'], 'duplicate': not created},
+        status_code=202 if created else 200
+    )
+
+# Состояние кэша рубрик и меток
+@app.get('/taxonomy/stats')
+async def taxonomy_stats():
+    return taxonomy_index.as_dict()
+
+# Число задач в очереди по статусам
+@app.get('/jobs')
+async def jobs_summary():
+    return await job_queue.counts()
+
+# Статус задачи публикации
+@app.get('/jobs/{job_id}')
+async def job_status(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Задача не найдена')
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'result': job['result'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+        'next_attempt_at': job['next_attempt_at'] if job['status'] == 'pending' else None,
+    }
+
+# Пакетная публикация: статьи публикуются параллельно (не более WP_BATCH_CONCURRENCY),
+# ошибка одной статьи не прерывает остальные
+@app.post('/publish/batch')
+@instrument()
+async def publish_batch(articles: list[Article]):
+    if len(articles) > WP_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f'Не больше {WP_BATCH_MAX_ITEMS} статей в одном запросе')
+
+    async def publish_one(index, article):
+        async with batch_semaphore:
+            try:
+                return {'index': index, **await _post_to_wp(article)}
+            except WordPressError as e:
+                return {'index': index, 'status': 'error', 'code': e.status_code, 'detail': e.detail}
+
+    results = await asyncio.gather(*(publish_one(i, a) for i, a in enumerate(articles)))
+    published = sum(1 for r in results if r['status'] == 'ok')
+    return {'published': published, 'failed': len(results) - published, 'results': results}
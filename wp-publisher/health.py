@@ -1,6 +1,7 @@
 import time
 from fastapi import FastAPI
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+import instrumentation
 
 start_time = time.time()
 app = FastAPI()
@@ -12,4 +13,10 @@ def health():
         "status": "ok",
         "uptime": f"{uptime // 60} мин {uptime % 60} сек",
         "details": "WordPress Publisher работает"
-    }) 
\ No newline at end of file
+    })
+
+@app.get("/metrics")
+def prometheus_metrics():
+    # Метрики процесса в формате Prometheus
+    body, content_type = instrumentation.render()
+    return Response(body, media_type=content_type)
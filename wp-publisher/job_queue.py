@@ -0,0 +1,195 @@
+"""
+Постоянная очередь публикаций wp-publisher.
+
+Задачи хранятся в SQLite (режим WAL), поэтому переживают перезапуск
+сервиса. Соединение обслуживается одним выделенным потоком, запросы
+к базе не блокируют event loop. Каждая задача имеет ключ идемпотентности
+(заголовок Idempotency-Key или хэш содержимого статьи): повторная отправка
+той же статьи возвращает уже существующую задачу, а не создаёт дубль поста.
+Исключение — задачи в статусе failed: повторная отправка запускает их заново.
+"""
+import asyncio  # Для выполнения запросов вне event loop
+import hashlib  # Для ключа идемпотентности по содержимому
+import json  # Для хранения статьи
+import os  # Для чтения переменных окружения
+import random  # Для джиттера задержек
+import sqlite3  # Для работы с SQLite
+import time  # Для расписания повторов
+import uuid  # Для идентификаторов задач
+from concurrent.futures import ThreadPoolExecutor  # Для выделенного потока базы
+
+# Путь к базе очереди
+PUBLISH_QUEUE_DB = os.environ.get('PUBLISH_QUEUE_DB', 'publish_queue.db')
+# Максимум попыток доставки одной статьи
+PUBLISH_MAX_ATTEMPTS = int(os.environ.get('PUBLISH_MAX_ATTEMPTS', 8))
+# Базовая и максимальная задержка между попытками в секундах
+PUBLISH_BACKOFF_BASE = float(os.environ.get('PUBLISH_BACKOFF_BASE', 2))
+PUBLISH_BACKOFF_MAX = float(os.environ.get('PUBLISH_BACKOFF_MAX', 300))
+
+
+def content_key(payload: dict):
+    """Ключ идемпотентности по содержимому статьи."""
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return 'sha256:' + hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def backoff(attempts):
+    """Задержка перед следующей попыткой: экспонента с джиттером."""
+    delay = min(PUBLISH_BACKOFF_MAX, PUBLISH_BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class JobQueue:
+    """
+    Очередь задач публикации (таблица publish_jobs).
+    Статусы: pending — ждёт доставки, running — выполняется,
+    done — опубликована, failed — попытки исчерпаны или ошибка неустранима.
+    """
+
+    def __init__(self, path=PUBLISH_QUEUE_DB, max_attempts=PUBLISH_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._conn = None
+        # Один поток: соединение SQLite используется строго последовательно
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='publish-queue')
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # --- Операции, выполняемые в потоке базы ---
+    def _init_db(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS publish_jobs (
+                id TEXT PRIMARY KEY,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                result TEXT,
+                error TEXT
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_publish_jobs_due ON publish_jobs (status, next_attempt_at)')
+        # Задачи, прерванные остановкой сервиса, снова становятся в очередь
+        recovered = conn.execute("UPDATE publish_jobs SET status='pending' WHERE status='running'").rowcount
+        conn.commit()
+        self._conn = conn
+        return recovered
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def _enqueue(self, payload, key):
+        now = time.time()
+        cursor = self._conn.execute(
+            'INSERT INTO publish_jobs (id, idempotency_key, payload, status, next_attempt_at, created_at, updated_at) '
+            "VALUES (?, ?, ?, 'pending', ?, ?, ?) "
+            # Задача, завершившаяся ошибкой, при повторной отправке снова встаёт в очередь
+            "ON CONFLICT (idempotency_key) DO UPDATE SET status='pending', attempts=0, payload=excluded.payload, "
+            'next_attempt_at=excluded.next_attempt_at, updated_at=excluded.updated_at, result=NULL, error=NULL '
+            "WHERE publish_jobs.status='failed'",
+            (uuid.uuid4().hex, key, json.dumps(payload, ensure_ascii=False), now, now, now)
+        )
+        self._conn.commit()
+        row = self._conn.execute('SELECT * FROM publish_jobs WHERE idempotency_key=?', (key,)).fetchone()
+        return self._to_dict(row), cursor.rowcount == 1
+
+    def _get(self, job_id):
+        return self._to_dict(self._conn.execute('SELECT * FROM publish_jobs WHERE id=?', (job_id,)).fetchone())
+
+    def _claim(self):
+        now = time.time()
+        row = self._conn.execute(
+            "SELECT * FROM publish_jobs WHERE status='pending' AND next_attempt_at<=? "
+            'ORDER BY next_attempt_at LIMIT 1', (now,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute(
+            "UPDATE publish_jobs SET status='running', attempts=attempts+1, updated_at=? WHERE id=?",
+            (now, row['id'])
+        )
+        self._conn.commit()
+        job = self._to_dict(row)
+        job['attempts'] += 1
+        job['status'] = 'running'
+        return job
+
+    def _finish(self, job_id, status, result=None, error=None, next_attempt_at=None):
+        now = time.time()
+        self._conn.execute(
+            'UPDATE publish_jobs SET status=?, result=?, error=?, next_attempt_at=COALESCE(?, next_attempt_at), '
+            'updated_at=? WHERE id=?',
+            (status, json.dumps(result, ensure_ascii=False) if result else None, error, next_attempt_at, now, job_id)
+        )
+        self._conn.commit()
+
+    def _next_due(self):
+        row = self._conn.execute("SELECT MIN(next_attempt_at) FROM publish_jobs WHERE status='pending'").fetchone()
+        return row[0]
+
+    def _counts(self):
+        rows = self._conn.execute('SELECT status, COUNT(*) FROM publish_jobs GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # --- Асинхронный интерфейс ---
+    async def init(self):
+        """Открывает базу; возвращает число задач, возвращённых в очередь после перезапуска."""
+        return await self._run(self._init_db)
+
+    async def enqueue(self, payload: dict, key: str = None):
+        """
+        Ставит статью в очередь. Возвращает (задача, создана ли новая):
+        при совпадении ключа идемпотентности возвращается существующая задача,
+        а задача в статусе failed сбрасывается в pending (считается новой).
+        """
+        return await self._run(self._enqueue, payload, key or content_key(payload))
+
+    async def get(self, job_id):
+        return await self._run(self._get, job_id)
+
+    async def claim(self):
+        """Забирает ближайшую готовую к выполнению задачу или возвращает None."""
+        return await self._run(self._claim)
+
+    async def complete(self, job_id, result):
+        await self._run(self._finish, job_id, 'done', result)
+
+    async def retry_or_fail(self, job, error, retryable=True):
+        """Откладывает задачу с экспоненциальной задержкой или помечает её failed."""
+        if retryable and job['attempts'] < self.max_attempts:
+            await self._run(self._finish, job['id'], 'pending', None, error, time.time() + backoff(job['attempts']))
+            return 'pending'
+        await self._run(self._finish, job['id'], 'failed', None, error)
+        return 'failed'
+
+    async def next_due(self):
+        """Время ближайшей попытки (time.time()) или None, если очередь пуста."""
+        return await self._run(self._next_due)
+
+    async def counts(self):
+        return await self._run(self._counts)
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,180 @@
+"""
+Кэш рубрик и меток WordPress.
+
+Статьи могут указывать категории и метки по названию: имена переводятся
+в id через индекс в памяти, а не запросами к /wp-json/wp/v2/categories на
+каждую публикацию. Индекс загружается целиком при старте (страницы
+запрашиваются параллельно), затем периодически догружает новые термины.
+Недостающий термин создаётся один раз: под блокировкой таксономии, с
+повторной проверкой индекса.
+"""
+import asyncio  # Для блокировок и фонового обновления
+import logging  # Для логирования событий
+import os  # Для чтения переменных окружения
+import time  # Для времени обновления
+
+from prometheus_client import Counter  # Попадания и промахи кэша в /metrics
+
+# Как часто догружать новые термины (секунды)
+TAXONOMY_REFRESH_INTERVAL = float(os.environ.get('TAXONOMY_REFRESH_INTERVAL', 300))
+# Раз во сколько обновлений перечитывать таксономии целиком (учёт переименований и удалений)
+TAXONOMY_FULL_REFRESH_EVERY = int(os.environ.get('TAXONOMY_FULL_REFRESH_EVERY', 12))
+# Создавать отсутствующие рубрики и метки
+TAXONOMY_CREATE_MISSING = os.environ.get('TAXONOMY_CREATE_MISSING', '1') == '1'
+
+TAXONOMIES = ('categories', 'tags')
+PER_PAGE = 100
+
+TAXONOMY_LOOKUPS = Counter('wp_taxonomy_lookups_total', 'Поиск терминов по названию', ['taxonomy', 'result'])
+
+logger = logging.getLogger(__name__)
+
+
+class TaxonomyError(Exception):
+    """Термин не найден и не может быть создан."""
+
+
+def normalize(name: str):
+    return ' '.join(name.split()).casefold()
+
+
+class TaxonomyIndex:
+    """Индекс "название/slug -> id" для рубрик и меток."""
+
+    def __init__(self, refresh_interval=TAXONOMY_REFRESH_INTERVAL, create_missing=TAXONOMY_CREATE_MISSING):
+        self.refresh_interval = refresh_interval
+        self.create_missing = create_missing
+        self._client = None
+        self._terms = {t: {} for t in TAXONOMIES}  # normalize(name или slug) -> id
+        self._max_id = {t: 0 for t in TAXONOMIES}
+        self._locks = {t: asyncio.Lock() for t in TAXONOMIES}
+        self._task = None
+        self._refreshes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'created': 0, 'refreshed_at': None, 'last_error': None}
+
+    # --- Загрузка из WordPress ---
+    async def _get_page(self, taxonomy, page, **params):
+        resp = await self._client.get(
+            f'/wp-json/wp/v2/{taxonomy}',
+            params={'per_page': PER_PAGE, 'page': page, '_fields': 'id,name,slug', **params}
+        )
+        resp.raise_for_status()
+        return resp.json(), int(resp.headers.get('X-WP-TotalPages', 1))
+
+    async def _load_all(self, taxonomy):
+        """Все термины таксономии: первая страница, затем остальные параллельно."""
+        terms, pages = await self._get_page(taxonomy, 1)
+        rest = await asyncio.gather(*(self._get_page(taxonomy, page) for page in range(2, pages + 1)))
+        for items, _ in rest:
+            terms.extend(items)
+        return terms
+
+    async def _load_new(self, taxonomy):
+        """Термины, созданные после последней загрузки: страницы по убыванию id до первого известного."""
+        known = self._max_id[taxonomy]
+        terms, page, pages = [], 1, 1
+        while page <= pages:
+            items, pages = await self._get_page(taxonomy, page, orderby='id', order='desc')
+            fresh = [t for t in items if t['id'] > known]
+            terms.extend(fresh)
+            if len(fresh) < len(items):
+                break
+            page += 1
+        return terms
+
+    def _add(self, taxonomy, terms, index=None):
+        index = index if index is not None else self._terms[taxonomy]
+        for term in terms:
+            index[normalize(term['name'])] = term['id']
+            index[normalize(term['slug'])] = term['id']
+            self._max_id[taxonomy] = max(self._max_id[taxonomy], term['id'])
+        return index
+
+    async def refresh(self, full=False):
+        """Обновляет индекс: целиком (full) или только новыми терминами."""
+        try:
+            for taxonomy in TAXONOMIES:
+                if full:
+                    terms = await self._load_all(taxonomy)
+                    self._max_id[taxonomy] = 0
+                    # Индекс заменяется целиком, читатели не видят его наполовину заполненным
+                    self._terms[taxonomy] = self._add(taxonomy, terms, {})
+                else:
+                    self._add(taxonomy, await self._load_new(taxonomy))
+            self.stats['refreshed_at'] = time.time()
+            self.stats['last_error'] = None
+        except Exception as e:
+            self.stats['last_error'] = str(e) or type(e).__name__
+            logger.warning('Не удалось обновить рубрики и метки: %s', e)
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            self._refreshes += 1
+            await self.refresh(full=self._refreshes % TAXONOMY_FULL_REFRESH_EVERY == 0)
+
+    async def start(self, client):
+        self._client = client
+        await self.refresh(full=True)
+        self._task = asyncio.create_task(self._loop(), name='taxonomy-refresh')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    # --- Разрешение названий ---
+    async def _create(self, taxonomy, name):
+        resp = await self._client.post(f'/wp-json/wp/v2/{taxonomy}', json={'name': name})
+        if resp.status_code == 400:
+            # Термин уже есть (создан в обход индекса): WordPress сообщает его id
+            data = resp.json().get('data') or {}
+            if isinstance(data, dict) and data.get('term_id'):
+                return data['term_id']
+        resp.raise_for_status()
+        term = resp.json()
+        self._add(taxonomy, [term])
+        self.stats['created'] += 1
+        logger.info('Создан термин %s "%s" (id %s)', taxonomy, name, term['id'])
+        return term['id']
+
+    async def resolve_one(self, taxonomy, value):
+        if isinstance(value, int):
+            return value
+        # Pydantic оставляет "5" строкой (list[int | str]); строка из цифр — это id, а не название
+        if value.strip().isascii() and value.strip().isdigit():
+            return int(value)
+        key = normalize(value)
+        term_id = self._terms[taxonomy].get(key)
+        if term_id is not None:
+            self.stats['hits'] += 1
+            TAXONOMY_LOOKUPS.labels(taxonomy, 'hit').inc()
+            return term_id
+        self.stats['misses'] += 1
+        TAXONOMY_LOOKUPS.labels(taxonomy, 'miss').inc()
+        async with self._locks[taxonomy]:
+            # Пока ждали блокировку, термин мог создать другой запрос
+            term_id = self._terms[taxonomy].get(key)
+            if term_id is not None:
+                return term_id
+            if not self.create_missing:
+                raise TaxonomyError(f'{taxonomy}: термин "{value}" не найден')
+            term_id = await self._create(taxonomy, ' '.join(value.split()))
+            self._terms[taxonomy][key] = term_id
+            return term_id
+
+    async def resolve(self, taxonomy, values):
+        """Переводит список id и названий в список id (без повторов, порядок сохраняется)."""
+        ids = []
+        for value in values:
+            term_id = await self.resolve_one(taxonomy, value)
+            if term_id not in ids:
+                ids.append(term_id)
+        return ids
+
+    def as_dict(self):
+        return {
+            **self.stats,
+            'categories': len(set(self._terms['categories'].values())),
+            'tags': len(set(self._terms['tags'].values())),
+        }